@@ -1,112 +1,388 @@
 import argparse
+import cProfile
 import json
+import os
+import pstats
+import sys
 import time
+from collections import deque
+import instrumentation
 from joint_optimization import *
-from typing import List, Dict
+from workload import load_jobs
+from batch import batch_plan
+from plan_cache import PlanCache
+from simulator import simulate_plan
+from typing import Callable, List, Dict, Optional
 
-def copy_server_pool(server_pool: List[Server]) -> List[Server]:
-    return [server.copy() for server in server_pool]
-
-def evaluation(nslots: int, server_slots: List[int]):
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-f", "--file", help="Input file for DAGs")
-    args = parser.parse_args()
+def strategies(args) -> List[Strategy]:
+    '''
+    return: the strategies printed as Ditto, Ratio and Average
+    '''
+    ditto = Strategy.DITTO_COST if args.objective == "cost" else Strategy.DITTO
+    return [ditto, Strategy.RATIO, Strategy.AVERAGE]
 
+def evaluation(args, nslots: int, server_slots: List[int], cache: PlanCache = None,
+               trace: Callable[[str, Dict[str, Tuple[float, float, instrumentation.Recorder]]], None] = None):
+    '''
+    trace: if given, every plan is recorded and
+           trace(job name, {strategy name: (jct, execution time, Recorder)}) is called once per job
+    '''
     print("Reproduction of 'Ditto'")
 
-    with open(args.file, "r") as f:
-        job_records = json.load(f)
+    planner = None
+    if args.beam > 0:
+        from beam_search import beam_planner
+        planner = beam_planner(args.beam, args.beam_k, args.beam_workers)
+    elif args.decompose > 0:
+        from decompose import decompose_planner
+        planner = decompose_planner(args.decompose, args.decompose_workers)
 
-    for job_record in job_records:
-        job_name = job_record["name"]
+    for job_name, job in load_jobs(args.file, nslots, args.compact):
         print(f"Processing job: {job_name}")
 
-        stages: Dict[int, Stage] = {}
-        stage_lookup: Dict[str, int] = {}
-        edges: Dict[Tuple[int, int], float] = {}
-        
-        for stage in job_record["stages"]:
-            stage_name = stage["name"]
-            if stage_name in stage_lookup:
-                raise Exception(f"Duplicate stage name: {stage_name}")
-            stage_lookup[stage_name] = len(stages)
-            stages[len(stages)] = Stage(stage["alpha"], stage["beta"])
-
-        for stage in job_record["stages"]:
-            stage_name = stage["name"]
-            for child in stage["children"]:
-                child_name = child["name"]
-                if child_name not in stage_lookup:
-                    raise Exception(f"Stage {child_name} not found")
-                edges[(stage_lookup[stage_name], stage_lookup[child_name])] = child["weight"]
-
-        # print("Stages: {}".format(stages))
-        # print("Edges: {}".format(edges))
-
-        job = Job(stages, edges, nslots)
-
         # test legality: sum(server_pool) >= nslots
         total_slots = sum(n for n in server_slots)
         assert total_slots >= nslots
-        server_pool = [Server(n) for n in server_slots]
+        server_pool = ServerPool([Server(n) for n in server_slots])
+        job.undo_log = server_pool.undo_log = UndoLog()
+        if args.nic_bandwidth:
+            from shuffle_cost import ShuffleCost
+            for i, server in enumerate(server_pool.servers):
+                server.bandwidth = args.nic_bandwidth[i % len(args.nic_bandwidth)]
+            ShuffleCost(job, server_pool)
 
-        start_time_ditto = time.time()
-        ditto_time = joint_optimization(job.copy(), copy_server_pool(server_pool), Strategy.DITTO)
-        end_time_ditto = time.time()
+        results = {}
+        recorders = {}
+        simulated = {}
+        costs = {}
+        for strategy in strategies(args):
+            budget = None
+            if args.deadline is not None or args.max_iterations is not None:
+                budget = Budget(args.deadline, args.max_iterations)
+            inspect = None
+            if args.simulate or args.objective == "cost":
+                def inspect(job, servers, strategy=strategy):
+                    if args.simulate:
+                        simulated[strategy] = simulate_plan(job, servers)
+                    if args.objective == "cost":
+                        costs[strategy] = estimate_cost(job)
+            if trace is not None:
+                recorders[strategy.name] = instrumentation.enable()
+            start_time = time.time()
+            with instrumentation.phase(strategy.name):
+                jct = plan_isolated(job, server_pool, strategy, cache, inspect, budget, planner)
+            end_time = time.time()
+            instrumentation.disable()
+            results[strategy] = (jct, end_time - start_time)
+            if budget is not None and budget.hit:
+                print(f"{strategy.name} stopped at the planning budget before converging", file=sys.stderr)
+
+        ditto, ratio, average = strategies(args)
+        ditto_time, ditto_execution_time = results[ditto]
+        ratio_time, ratio_execution_time = results[ratio]
+        average_time, average_execution_time = results[average]
+        print(f"Ditto: {ditto_time}, execution time: {ditto_execution_time}")
+        print(f"Ratio: {ratio_time}, execution time: {ratio_execution_time}")
+        print(f"Average: {average_time}, execution time: {average_execution_time}")
+        if args.simulate:
+            print(f"Simulated: Ditto: {simulated[ditto]}, Ratio: {simulated[ratio]}, Average: {simulated[average]}")
+        if args.objective == "cost":
+            print(f"Cost: Ditto: {costs[ditto]}, Ratio: {costs[ratio]}, Average: {costs[average]}")
+        if trace is not None:
+            trace(job_name, {name: (*results[Strategy[name]], recorder) for name, recorder in recorders.items()})
+        print()
+
+def batch_evaluation(args, nslots: int, server_configs: List[List[int]]):
+    '''
+    Plan every job on every server configuration with every strategy on a process pool.
+    Output is ordered by job, then configuration, and does not depend on --workers.
+    '''
+    print("Reproduction of 'Ditto'")
 
-        start_time_ratio = time.time()
-        ratio_time = joint_optimization(job.copy(), copy_server_pool(server_pool), Strategy.RATIO)
-        end_time_ratio = time.time()
+    for server_slots in server_configs:
+        assert sum(server_slots) >= nslots
 
-        start_time_average = time.time()
-        average_time = joint_optimization(job.copy(), copy_server_pool(server_pool), Strategy.AVERAGE)
-        end_time_average = time.time()
+    # names of the jobs handed to batch_plan whose results are not printed yet
+    job_names = deque()
+    def jobs():
+        for job_name, job in load_jobs(args.file, nslots, args.compact):
+            job_names.append(job_name)
+            yield job
 
-        print(f"Ditto: {ditto_time}, execution time: {end_time_ditto - start_time_ditto}")
-        print(f"Ratio: {ratio_time}, execution time: {end_time_ratio - start_time_ratio}")
-        print(f"Average: {average_time}, execution time: {end_time_average - start_time_average}")
+    start_time = time.time()
+    njobs = 0
+    for results in batch_plan(jobs(), server_configs, strategies(args), args.workers, args.cache_size, args.cache_dir,
+                              args.deadline, args.max_iterations, args.cache_dir_size):
+        print(f"Processing job: {job_names.popleft()}")
+        for i, (ditto_time, ratio_time, average_time) in enumerate(results):
+            print(f"[{i}] Ditto: {ditto_time}, Ratio: {ratio_time}, Average: {average_time}")
         print()
+        njobs += 1
+    print(f"Planned {njobs} jobs in {time.time() - start_time}s", file=sys.stderr)
+
+def parse_server(spec: str) -> Tuple[int, Optional[float], Optional[float]]:
+    '''
+    spec: "slots", "slots:memory" or "slots:memory:disk"
+    '''
+    fields = spec.split(":")
+    if not 1 <= len(fields) <= 3:
+        raise argparse.ArgumentTypeError(f"Bad server {spec}, expected slots[:memory[:disk]]")
+    try:
+        return int(fields[0]), *[float(field) if field else None for field in fields[1:]], *[None] * (3 - len(fields))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Bad server {spec}, expected slots[:memory[:disk]]")
+
+def cluster_evaluation(args, nslots: int, server_specs: List[Tuple[int, Optional[float], Optional[float]]]):
+    '''
+    Replay an arrival trace of the workload jobs on one cluster of server_specs (slots,
+    memory, disk) and print the planning throughput and the cluster utilization.
+    '''
+    server_slots = [spec[0] for spec in server_specs]
+    from cluster import Cluster, poisson_arrivals, read_arrivals, replay
+
+    jobs = dict(load_jobs(args.workload, nslots))
+    if args.arrivals:
+        arrivals = read_arrivals(args.arrivals, jobs)
+    else:
+        arrivals = poisson_arrivals(list(jobs.values()), args.njobs, args.rate, args.seed)
+
+    cluster = Cluster([Server(*spec) for spec in server_specs], Strategy[args.strategy], record=args.simulate)
+    stats = replay(cluster, arrivals)
+    print(f"Jobs: {stats['submitted']} submitted, {stats['admitted']} admitted, {stats['rejected']} rejected ({stats['plans']} plans)")
+    print(f"Planning throughput: {stats['throughput_jobs_per_s']:.1f} jobs/s ({stats['planning_s']:.3f}s planning)")
+    print(f"Utilization: {stats['utilization']:.3f} over a makespan of {stats['makespan']:.1f}")
+    print(f"Mean JCT: {stats['mean_jct']:.2f}, queueing delay mean: {stats['mean_delay']:.2f}, p99: {stats['p99_delay']:.2f}")
+    if args.simulate:
+        from simulator import simulate
+        start_time = time.time()
+        result = simulate(cluster.admissions, server_slots)
+        print(f"Simulated: mean JCT: {sum(result['jct']) / max(len(result['jct']), 1):.2f}, makespan: {result['makespan']:.1f}, "
+              f"slot wait: {result['slot_wait']:.1f}, NIC wait: {result['nic_wait']:.1f} ({time.time() - start_time:.3f}s)")
+
+def sweep_evaluation(args):
+    '''
+    Sweep the slot budget of every job, print the knee point of its JCT-vs-slots curve
+    '''
+    import numpy as np
+    from dop_sweep import dop_sweep
+
+    curves = {}
+    for job_name, job in load_jobs(args.workload, 0):
+        sweep = dop_sweep(job, np.arange(args.min or len(job.stages), args.max + 1))
+        if sweep.knee is None:
+            print(f"{job_name}: no budget up to {args.max} gives every stage a slot")
+            continue
+        line = f"{job_name}: knee at {sweep.budgets[sweep.knee]} slots (JCT {sweep.jct[sweep.knee]}), {len(sweep.frontier)} Pareto points"
+        if args.slo is not None:
+            line += f", cheapest for JCT <= {args.slo}: {sweep.cheapest(args.slo)}"
+        print(line)
+        curves[job_name] = {
+            "budgets": sweep.budgets.tolist(),
+            "slots": sweep.slots.tolist(),
+            "jct": [jct if np.isfinite(jct) else None for jct in sweep.jct.tolist()],
+            "frontier": sweep.budgets[sweep.frontier].tolist(),
+            "knee": int(sweep.budgets[sweep.knee]),
+        }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(curves, f)
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", help="Input file for DAGs (JSON array or NDJSON)")
+    parser.add_argument("--compact", action="store_true", help="Store each job in NumPy arrays (CSR edges)")
+    parser.add_argument("--workers", type=int, default=0, help="Plan jobs on this many processes (batch mode)")
+    parser.add_argument("--cache-size", type=int, default=0, help="Keep up to this many plans in memory")
+    parser.add_argument("--cache-dir", help="Also keep plans on disk in this directory")
+    parser.add_argument("--cache-dir-size", type=int, default=4096, help="Keep up to this many plans in --cache-dir")
+    parser.add_argument("--trace", help="Write counters and phase timers of every job to this NDJSON file")
+    parser.add_argument("--objective", choices=["jct", "cost"], default="jct",
+                        help="Objective of the DITTO grouping order; cost also prints the cost of every plan")
+    parser.add_argument("--deadline", type=float, help="Stop DITTO after this many seconds per plan with the best plan so far")
+    parser.add_argument("--max-iterations", type=int, help="Stop DITTO after this many grouping iterations per plan")
+    parser.add_argument("--beam", type=int, default=0, help="Plan DITTO with a beam search of this width over grouping orders")
+    parser.add_argument("--beam-k", type=int, default=3, help="Candidate edges per beam state")
+    parser.add_argument("--beam-workers", type=int, default=0, help="Expand beam states on this many processes")
+    parser.add_argument("--decompose", type=int, default=0, help="Plan DITTO part by part, parts of at least this many stages")
+    parser.add_argument("--decompose-workers", type=int, default=0, help="Plan the parts on this many processes")
+    parser.add_argument("--nic-bandwidth", type=float, nargs="+",
+                        help="Price shuffles by placement: NIC bandwidth of every server (or one for all), "
+                             "relative to the bandwidth the edge weights were measured at")
+    parser.add_argument("--simulate", action="store_true", help="Also print the JCT of every plan in the discrete-event simulator")
+    parser.add_argument("--profile", help="Write cProfile stats to this file and flamegraph stacks of the planner phases to <file>.folded")
+    subparsers = parser.add_subparsers(dest="command")
+    compile_parser = subparsers.add_parser("compile", help="Compile a DAG file into a binary workload")
+    compile_parser.add_argument("source", help="DAG file (JSON array or NDJSON)")
+    compile_parser.add_argument("-o", "--output", help="Binary workload, defaults to the source with a .bin suffix")
+    fit_parser = subparsers.add_parser("fit", help="Fit alpha and beta of the stages from execution logs")
+    fit_parser.add_argument("source", help="DAG file (JSON array or NDJSON)")
+    fit_parser.add_argument("logs", nargs="+", help="Execution logs, CSV (job,stage,dop,duration) or NDJSON")
+    fit_parser.add_argument("-o", "--output", required=True, help="Fitted DAG file, NDJSON for a .ndjson suffix, a .bin suffix also compiles it")
+    fit_parser.add_argument("--chunk", type=int, default=1 << 16, help="Log records read at a time")
+    cluster_parser = subparsers.add_parser("cluster", help="Replay job arrivals on one shared cluster")
+    cluster_parser.add_argument("workload", help="DAG file (JSON array, NDJSON or compiled)")
+    cluster_parser.add_argument("--arrivals", help="Arrival trace, one 'time,job name' line per arrival")
+    cluster_parser.add_argument("--rate", type=float, default=0.05, help="Poisson arrival rate without --arrivals")
+    cluster_parser.add_argument("--njobs", type=int, default=1000, help="Number of arrivals without --arrivals")
+    cluster_parser.add_argument("--seed", type=int, default=0)
+    cluster_parser.add_argument("--servers", type=parse_server, nargs="+",
+                                help="slots[:memory[:disk]] of every server, defaults to the slots of both server configurations")
+    cluster_parser.add_argument("--strategy", choices=[strategy.name for strategy in Strategy], default=Strategy.DITTO.name)
+    cluster_parser.add_argument("--simulate", action="store_true", help="Also run the admitted plans in the discrete-event simulator")
+    sweep_parser = subparsers.add_parser("sweep", help="JCT of the bottom-up DoP over a range of slot budgets")
+    sweep_parser.add_argument("workload", help="DAG file (JSON array, NDJSON or compiled)")
+    sweep_parser.add_argument("--min", type=int, help="Smallest budget, defaults to one slot per stage")
+    sweep_parser.add_argument("--max", type=int, default=500, help="Largest budget")
+    sweep_parser.add_argument("--slo", type=float, help="Also print the cheapest budget with a JCT of at most this")
+    sweep_parser.add_argument("-o", "--output", help="Write every curve and frontier to this JSON file")
+    serve_parser = subparsers.add_parser("serve", help="Serve plan requests for the jobs of a workload on a local socket")
+    serve_parser.add_argument("workload", help="DAG file (JSON array, NDJSON or compiled)")
+    serve_parser.add_argument("--socket", help="Unix socket to listen on, instead of localhost TCP")
+    serve_parser.add_argument("--port", type=int, default=7070, help="localhost TCP port without --socket")
+    serve_parser.add_argument("--workers", dest="serve_workers", type=int, default=os.cpu_count(), help="Planning processes")
+    serve_parser.add_argument("--batch-size", type=int, default=16, help="Most requests sent to a worker at once")
+    serve_parser.add_argument("--cache-size", dest="serve_cache_size", type=int, default=1024, help="Plans cached by every worker")
+    loadgen_parser = subparsers.add_parser("loadgen", help="Measure the plan latency of a running service")
+    loadgen_parser.add_argument("--socket", help="Unix socket of the service, instead of localhost TCP")
+    loadgen_parser.add_argument("--port", type=int, default=7070, help="localhost TCP port without --socket")
+    loadgen_parser.add_argument("--requests", type=int, default=1000)
+    loadgen_parser.add_argument("--concurrency", type=int, default=8, help="Connections, each with one request in flight")
+    loadgen_parser.add_argument("--strategy", choices=[strategy.name for strategy in Strategy], default=Strategy.DITTO.name)
+    loadgen_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        from compiled import compile_workload
+        compile_workload(args.source, args.output or os.path.splitext(args.source)[0] + ".bin")
+        return
+
+    if args.command == "fit":
+        from fit_profiles import fit_workload
+        output = args.output
+        if output.endswith(".bin"):
+            output = os.path.splitext(output)[0] + ".json"
+        start = time.perf_counter()
+        stats = fit_workload(args.source, args.logs, output, args.chunk)
+        if output != args.output:
+            from compiled import compile_workload
+            compile_workload(output, args.output)
+        print(f"Records: {stats['records']}, stages fitted: {stats['stages_fitted']}, kept: {stats['stages_kept']}, "
+              f"unknown: {stats['unknown_stages']}, execution time: {time.perf_counter() - start:.3f}s")
+        return
+
     nslots = 120
-    server_slots = [
-        16,
-        29,
-        25,
-        13,
-        31,
-        47,
-        33,
-        24,
-        4,
-        26,
-        16,
-        1,
-        33,
-        20,
+    server_configs = [
+        [
+            16,
+            29,
+            25,
+            13,
+            31,
+            47,
+            33,
+            24,
+            4,
+            26,
+            16,
+            1,
+            33,
+            20,
+        ],
+        [
+            12,
+            11,
+            15,
+            13,
+            18,
+            17,
+            19,
+            14,
+            24,
+            16,
+            16,
+            11,
+            13,
+            10,
+        ],
     ]
-    # print(len(server_slots))
-    evaluation(nslots, server_slots)
-
-    print("===========================")
-
-    server_slots = [
-        12,
-        11,
-        15,
-        13,
-        18,
-        17,
-        19,
-        14,
-        24,
-        16,
-        16,
-        11,
-        13,
-        10,
-    ]
-    evaluation(nslots, server_slots)
+
+    if args.command == "sweep":
+        sweep_evaluation(args)
+        return
+
+    if args.command == "serve":
+        import asyncio
+        from service import PlannerService
+        service = PlannerService(args.workload, nslots, server_configs, args.serve_workers,
+                                 args.batch_size, args.serve_cache_size)
+        try:
+            asyncio.run(service.serve(args.socket, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.command == "loadgen":
+        import asyncio
+        from service import load_test
+        stats = asyncio.run(load_test(args.socket, args.port, args.requests, args.concurrency, args.strategy,
+                                      len(server_configs), args.seed))
+        print(f"Requests: {stats['requests']} ({stats['errors']} errors) in {stats['seconds']:.3f}s, "
+              f"{stats['throughput_per_s']:.1f} requests/s")
+        print(f"Latency ms: p50 {stats['p50_ms']:.3f}, p90 {stats['p90_ms']:.3f}, p99 {stats['p99_ms']:.3f}, max {stats['max_ms']:.3f}")
+        return
+
+    if args.command == "cluster":
+        cluster_evaluation(args, nslots, args.servers or [(n, None, None) for server_slots in server_configs for n in server_slots])
+        return
+
+    if args.beam and args.decompose:
+        parser.error("--beam and --decompose are exclusive")
+    if args.beam and args.objective == "cost":
+        parser.error("--beam only plans for --objective jct")
+    if args.nic_bandwidth and (args.beam or args.decompose):
+        parser.error("--nic-bandwidth does not support --beam or --decompose")
+    if args.workers > 0:
+        if args.trace or args.profile or args.simulate or args.beam or args.decompose or args.nic_bandwidth:
+            parser.error("--trace, --profile, --simulate, --beam, --decompose and --nic-bandwidth do not support --workers")
+        batch_evaluation(args, nslots, server_configs)
+        return
+
+    cache = None
+    if args.cache_size > 0 or args.cache_dir is not None:
+        cache = PlanCache(max(args.cache_size, 1), args.cache_dir, args.cache_dir_size)
+
+    trace_file = open(args.trace, "w") if args.trace else None
+    profiler = cProfile.Profile() if args.profile else None
+    # phase timers of all plans, for the flamegraph
+    total = instrumentation.Recorder()
+
+    for i, server_slots in enumerate(server_configs):
+        def trace(job_name: str, plans: Dict[str, Tuple[float, float, instrumentation.Recorder]]):
+            if trace_file is not None:
+                record = {"job": job_name, "servers": i, "plans": {}}
+                for name, (jct, seconds, recorder) in plans.items():
+                    record["plans"][name] = {"jct": jct, "seconds": seconds, **recorder.trace()}
+                trace_file.write(json.dumps(record) + "\n")
+            for _, _, recorder in plans.values():
+                total.merge(recorder)
+
+        if i > 0:
+            print("===========================")
+        if profiler is not None:
+            profiler.enable()
+        evaluation(args, nslots, server_slots, cache, trace if trace_file or profiler else None)
+        if profiler is not None:
+            profiler.disable()
+
+    if cache is not None:
+        print(f"Plan cache: {cache.stats()}", file=sys.stderr)
+    if trace_file is not None:
+        trace_file.close()
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        with open(args.profile + ".folded", "w") as f:
+            f.write("\n".join(total.folded()) + "\n")
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
 
 if __name__ == "__main__":
     main()
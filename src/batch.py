@@ -0,0 +1,60 @@
+'''
+Batch planning on a process pool.
+
+Every job is sent to a worker once, together with all the server configurations and
+strategies to plan it with; the worker plans each (configuration, strategy) pair on an
+isolated snapshot. Results stream back in input order, so the output does not depend
+on the number of workers.
+'''
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+from joint_optimization import *
+
+# PlanCache of this worker process, see init_worker
+worker_cache = None
+
+def init_worker(cache_size: int, cache_dir: str, cache_dir_size: int) -> None:
+    global worker_cache
+    if cache_size > 0 or cache_dir is not None:
+        from plan_cache import PlanCache
+        worker_cache = PlanCache(max(cache_size, 1), cache_dir, cache_dir_size)
+
+
+def plan_job(job: Job, server_configs: List[List[int]], strategies: List[Strategy],
+             deadline: float = None, max_iterations: int = None) -> List[List[float]]:
+    '''
+    deadline, max_iterations: Budget of every plan, if given
+    return: List[List[float]], result[c][s] is the JCT of job on server_configs[c] with strategies[s]
+    '''
+    results = []
+    for server_slots in server_configs:
+        server_pool = ServerPool([Server(n) for n in server_slots])
+        job.undo_log = server_pool.undo_log = UndoLog()
+        results.append([])
+        for strategy in strategies:
+            budget = None
+            if deadline is not None or max_iterations is not None:
+                budget = Budget(deadline, max_iterations)
+            results[-1].append(plan_isolated(job, server_pool, strategy, worker_cache, budget=budget))
+    return results
+
+
+def batch_plan(jobs: Iterable[Job], server_configs: List[List[int]], strategies: List[Strategy], workers: int,
+               cache_size: int = 0, cache_dir: str = None,
+               deadline: float = None, max_iterations: int = None, cache_dir_size: int = 4096) -> Iterator[List[List[float]]]:
+    '''
+    Plan every job with plan_job on `workers` processes, yielding results in the order of jobs.
+    At most a few jobs per worker are in flight, so jobs can be a lazy stream.
+    cache_size, cache_dir, cache_dir_size: give every worker a PlanCache (the directory is shared)
+    deadline, max_iterations: Budget of every plan, if given
+    '''
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_size, cache_dir, cache_dir_size)) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(plan_job, job, server_configs, strategies, deadline, max_iterations))
+            if len(pending) >= 4 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
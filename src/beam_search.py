@@ -0,0 +1,150 @@
+'''
+Beam search over grouping orders.
+
+DITTO keeps the first edge of the greedy grouping order that places. The beam search
+keeps, at every step, the `width` best plans (lowest estimated JCT) among the first `k`
+placeable edges of the greedy order of every plan in the beam. A plan is the sequence of
+grouped edges on top of the bottom-up DoP; replaying it on a detached copy of the servers
+(ServerPool.detached: same totals, free resources and best fit order) gives the same
+placements as on the servers themselves, so beam states are just tuples of edges.
+
+Expansions run on a process pool. The DoP-planned job and the detached servers are handed
+to each worker once, by the pool initializer, and stay read-only there; a task
+only carries the edges of one state. The plain DITTO plan seeds the search, so the result is
+never worse than DITTO, and a Budget bounds the search with the best plan found so far.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from joint_optimization import *
+
+# job planned by bottom_up_dop and detached servers of this worker, see init_worker
+base_job: Job = None
+base_servers: ServerPool = None
+
+def init_worker(job: Job, servers: ServerPool) -> None:
+    global base_job, base_servers
+    base_job = job
+    # detached again, the index of a pickled pool is keyed by the ids of the sender's servers
+    base_servers = servers.detached()
+
+
+def replay(grouped: Tuple[Tuple[int, int], ...]) -> Tuple[Job, ServerPool]:
+    '''
+    return: (job, servers), a copy of the base job with the edges of grouped zeroed and
+            placed in order onto a copy of the base servers
+    '''
+    job = base_job.copy()
+    servers = base_servers.detached()
+    job.undo_log = servers.undo_log = UndoLog()
+    for edge in grouped:
+        job.set_edge_weight(edge, 0)
+        if not place(servers, job, edge):
+            raise Exception(f"Grouping {edge} does not place when replaying {grouped}")
+    return job, servers
+
+
+def expand(grouped: Tuple[Tuple[int, int], ...], k: int) -> List[Tuple[float, Tuple[Tuple[int, int], ...]]]:
+    '''
+    return: (JCT, grouped + (edge,)) for the first k edges of the greedy grouping order that place
+    '''
+    job, servers = replay(grouped)
+    log = job.undo_log
+
+    mark = log.checkpoint()
+    Eu = greedy_group(job)
+    log.rollback(mark)
+
+    children = []
+    for edge in Eu:
+        if job.edges[edge] == 0: break
+        mark = log.checkpoint()
+        job.set_edge_weight(edge, 0)
+        if place(servers, job, edge):
+            children.append((estimate_jct(job), grouped + (edge,)))
+        log.rollback(mark)
+        if len(children) == k:
+            break
+    return children
+
+
+def beam_search(job: Job, servers: List[Server], width: int = 4, k: int = 3, workers: int = 0, budget: Budget = None) -> float:
+    '''
+    Plan job like joint_optimization(job, servers, Strategy.DITTO), searching grouping orders
+    with a beam of `width` plans, `k` candidate edges per plan.
+    workers: size of the process pool, 0 to expand in this process
+    return: float is the estimated JCT of the best plan, which is applied to job and servers
+    '''
+    if not isinstance(servers, ServerPool):
+        servers = ServerPool(servers)
+    if job.undo_log is None:
+        job.undo_log = servers.undo_log or UndoLog()
+    if servers.undo_log is None:
+        servers.undo_log = job.undo_log
+
+    with instrumentation.phase("dop"):
+        bottom_up_dop(job)
+    planned = job.copy()
+    planned.undo_log = None
+    detached = servers.detached()
+
+    # DITTO itself is the first candidate
+    ditto = AnytimePlan(planned.copy(), detached.detached(), Strategy.DITTO)
+    best_jct = ditto.refine(budget)
+    best = tuple(ditto.grouped)
+
+    executor = None
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(planned, detached))
+    else:
+        init_worker(planned, detached)
+    try:
+        beam = [()]
+        seen = {frozenset()}
+        # every candidate grouping tried counts as one iteration, on top of the DITTO ones
+        iterations = ditto.iterations
+        while beam and not (budget is not None and budget.spent(iterations)):
+            instrumentation.count("beam.levels")
+            if executor is not None:
+                expansions = executor.map(expand, beam, [k] * len(beam))
+            else:
+                expansions = (expand(grouped, k) for grouped in beam)
+
+            children = []
+            for expansion in expansions:
+                iterations += len(expansion)
+                for jct, grouped in expansion:
+                    # orders grouping the same edges are one plan
+                    key = frozenset(grouped)
+                    if key not in seen:
+                        seen.add(key)
+                        children.append((jct, grouped))
+            instrumentation.count("beam.states", len(children))
+
+            children.sort(key=lambda child: child[0])
+            beam = [grouped for _, grouped in children[:width]]
+            if children and children[0][0] < best_jct:
+                best_jct, best = children[0]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with instrumentation.phase("placement"):
+        for edge in best:
+            job.set_edge_weight(edge, 0)
+            if not place(servers, job, edge):
+                raise Exception(f"Grouping {edge} of the best plan does not place")
+    return estimate_jct(job)
+
+
+def beam_planner(width: int, k: int, workers: int):
+    '''
+    return: a planner for plan_isolated, beam search for DITTO and joint_optimization for
+            RATIO and AVERAGE; the beam only ranks plans by JCT, so DITTO_COST is refused
+    '''
+    def planner(job: Job, servers: ServerPool, strategy: Strategy, budget: Budget = None) -> float:
+        if strategy == Strategy.DITTO_COST:
+            raise ValueError("The beam search does not plan for cost")
+        if strategy != Strategy.DITTO:
+            return joint_optimization(job, servers, strategy, budget)
+        return beam_search(job, servers, width, k, workers, budget)
+    return planner
@@ -0,0 +1,153 @@
+'''
+Planner benchmark suite on synthetic DAGs (see synthetic.py).
+
+    python3 ./src/benchmark.py --sizes 10 1000 100000 -o bench.json
+    python3 ./src/benchmark.py --baseline bench.json
+
+For every shape, size and benchmark it reports the median perf_counter time over
+--repeat runs and the peak traced memory (tracemalloc, from one extra run). Results are
+written as JSON; with --baseline, benchmarks slower than the baseline by more than
+--threshold are listed and the exit status is 1.
+
+greedy_group and the DITTO plan only run up to --group-limit stages.
+'''
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from bottom_up_dop import bottom_up_dop
+from joint_optimization import *
+from simulator import placements_of, simulate
+from synthetic import SHAPES, server_pool
+
+def prepare_dop(job: Job) -> Job:
+    job = job.copy()
+    bottom_up_dop(job)
+    return job
+
+
+def place_all(job: Job, servers: ServerPool) -> None:
+    for edge in job.edges.keys():
+        place(servers, job, edge)
+
+
+def simulation_input(job: Job, seed: int) -> Tuple[List[Tuple[float, Job, Dict[int, int]]], List[int]]:
+    '''
+    The planned job with every stage at its best fit, as simulate arguments
+    '''
+    servers = ServerPool(server_pool(job.nslot, seed))
+    for id, stage in job.stages.items():
+        servers.place((id, stage))
+    return [(0.0, job, placements_of(servers))], [server.total_slots for server in servers.servers]
+
+
+def benchmarks(job: Job, seed: int):
+    '''
+    yield : (benchmark name, setup, run, grouping) where run(*setup()) is timed and
+            grouping tells whether it is limited by --group-limit
+    '''
+    planned = prepare_dop(job)
+    yield "bottom_up_dop", lambda: (job.copy(),), bottom_up_dop, False
+    yield "longest_path", lambda: (planned.stages, planned.edges), longest_path_dag_with_weights_and_path, False
+    yield "greedy_group", lambda: (planned.copy(),), greedy_group, True
+    yield "place", lambda: (planned, ServerPool(server_pool(planned.nslot, seed))), place_all, False
+    simulation = simulation_input(planned, seed)
+    yield "simulate", lambda: simulation, simulate, False
+    for strategy in Strategy:
+        yield f"joint_optimization[{strategy.name}]", lambda strategy=strategy: (job.copy(), server_pool(job.nslot, seed), strategy), \
+            joint_optimization, strategy == Strategy.DITTO
+
+
+def measure(setup, run, repeat: int) -> Tuple[List[float], int]:
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def run_suite(shapes: List[str], sizes: List[int], repeat: int, group_limit: int, seed: int) -> List[Dict]:
+    results = []
+    for shape in shapes:
+        for nstages in sizes:
+            job = SHAPES[shape](nstages, seed)
+            for name, setup, run, grouping in benchmarks(job, seed):
+                if grouping and nstages > group_limit:
+                    continue
+                times, peak = measure(setup, run, repeat)
+                result = {
+                    "benchmark": name,
+                    "shape": shape,
+                    "stages": nstages,
+                    "edges": len(job.edges),
+                    "median_s": statistics.median(times),
+                    "runs_s": times,
+                    "peak_bytes": peak,
+                }
+                print(f"{shape:>10} {nstages:>7} {name:>30} {result['median_s']:>10.4f}s {peak / 2**20:>9.2f}MiB", file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def compare(results: List[Dict], baseline: List[Dict], threshold: float) -> List[str]:
+    '''
+    return: List[str] describing every benchmark slower than threshold x its baseline median
+    '''
+    base = {(r["benchmark"], r["shape"], r["stages"]): r["median_s"] for r in baseline}
+    slowdowns = []
+    for r in results:
+        before = base.get((r["benchmark"], r["shape"], r["stages"]))
+        if before and r["median_s"] > threshold * before:
+            slowdowns.append(f"{r['benchmark']} {r['shape']} {r['stages']}: {before:.4f}s -> {r['median_s']:.4f}s ({r['median_s'] / before:.2f}x)")
+    return slowdowns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES.keys()), default=list(SHAPES.keys()))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark, the median is reported")
+    parser.add_argument("--group-limit", type=int, default=2000, help="Largest DAG to run greedy_group and the DITTO plan on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Flag benchmarks slower than this ratio of the baseline")
+    args = parser.parse_args()
+
+    results = run_suite(args.shapes, args.sizes, args.repeat, args.group_limit, args.seed)
+    report = {
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        slowdowns = compare(results, baseline, args.threshold)
+        for slowdown in slowdowns:
+            print(f"SLOWER {slowdown}")
+        if slowdowns:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,15 @@
+import instrumentation
 from job import *
 from math import pow
+from collections import deque
+from indexed_heap import IndexedHeap
+from critical_path import edge_weights
+
+try:
+    import numpy as np
+    from compact_job import CompactJob, layers_of, merge_layers, round_dops, round_shares
+except ImportError:     # NumPy is optional, only CompactJob needs it
+    CompactJob = None
 
 def merge_stage(alpha_i:float, alpha_j:float, has_edge:bool):
     if has_edge:
@@ -22,61 +32,73 @@ def get_depth(stages: Dict[int,Stage], edges: Dict[Tuple[int, int], float])->Dic
     depth_dict = {}
     in_dict = {}
     out_dict = {}
-    v_list = []
     for v in stages.keys():
         depth_dict[v] = -1
-        v_list.append(v)
         in_dict[v] = 0
         out_dict[v] = []
     for i,j in edges.keys():
         in_dict[j] += 1
         out_dict[i].append(j)
-    
-    depth = 0
-    while len(v_list):
-        zero_list = []
-        for v in v_list:
-            if in_dict[v]==0:
-                zero_list.append(v)
-        for v in zero_list:
-            v_list.remove(v)
-            depth_dict[v]=depth
-            for child in out_dict[v]:
-                in_dict[child] -= 1
-        depth += 1
+
+    # Kahn's algorithm: a stage is one layer below the deepest of its parents
+    queue = deque()
+    for v in stages.keys():
+        if in_dict[v]==0:
+            depth_dict[v] = 0
+            queue.append(v)
+    visited = 0
+    while queue:
+        v = queue.popleft()
+        visited += 1
+        for child in out_dict[v]:
+            in_dict[child] -= 1
+            depth_dict[child] = max(depth_dict[child],depth_dict[v]+1)
+            if in_dict[child]==0:
+                queue.append(child)
+
+    if visited < len(stages):
+        cycle = [v for v in stages.keys() if in_dict[v] > 0]
+        raise Exception(f"Cycle detected among stages: {cycle}")
     return depth_dict
-    
 
-def alloc_slot(nslot: int, rate: float, min_a: int, min_b: int):
-    if min_a + min_b > nslot:
-        print("Slot is not enough!")
-        return 0,0
-    aslot = int(nslot*rate/(rate+1))
-    aslot = max(min_a,aslot)
-    bslot = nslot - aslot
-    bslot = max(min_b,bslot)
-    aslot = nslot - bslot
-    return aslot,bslot
 
+def get_layers(job: Job)->List[List[int]]:
+    '''
+    Stages of job grouped by depth, cached on the job until an edge is added or removed
+    (Job.edge_version). Edge weights do not matter here, so grouping edges (weight 0)
+    keeps the cache.
+    '''
+    key = (len(job.stages), job.edge_version)
+    if job.layers is None or job.layers_key != key:
+        if CompactJob is not None and isinstance(job, CompactJob):
+            job.layers = layers_of(job)
+            job.layers_key = key
+            return job.layers
+        layers = []
+        for v, depth in get_depth(job.stages,job.edges).items():
+            while len(layers) <= depth:
+                layers.append([])
+            layers[depth].append(v)
+        job.layers = layers
+        job.layers_key = key
+    return job.layers
+    
+
+def merge_rates(job: Job, layer_dict: List[List[int]]) -> Tuple[List[float], List[float], List[List[float]]]:
+    '''
+    Merge the stages of every layer, then the layers bottom up.
+    return: (alpha_list, rate_cross_layer_list, rate_inner_layer_list), alpha_list[i] is the
+            merged alpha of layers i and below
+    '''
+    if CompactJob is not None and isinstance(job, CompactJob):
+        return merge_layers(job, layer_dict)
 
-def bottom_up_dop(job: Job):
     stages = job.stages
-    edges = job.edges
-    depth_dict = get_depth(stages,edges)
-    layer_dict = {}
     rate_cross_layer_list = [] # cross layer rate, r[i]=l[i]/l[i+1]
     rate_inner_layer_list = [] # inner layer rate, r[i]=l[i]/l[i+1] (reverse)
     alpha_list = []
+    max_depth = len(layer_dict)-1
 
-    max_depth = 0
-    for v, depth in depth_dict.items():
-        if depth not in layer_dict.keys():
-            layer_dict[depth] = []
-            
-        layer_dict[depth].append(v)
-        max_depth = max(max_depth,depth)
-    
-    # merge
     for i in range(0,max_depth+1):
         v_list = layer_dict[i]
         alpha_list.append(stages[v_list[0]].alpha)
@@ -85,40 +107,285 @@ def bottom_up_dop(job: Job):
             sj = v_list[j]
             alpha_list[i],rate = merge_stage(alpha_list[i],stages[sj].alpha,False)
             rate_inner_layer_list[i].append(rate)
-    
+
     for i in range(0,max_depth):
         rate_cross_layer_list.append(0)
     for i in range(max_depth,0, -1):
         alpha_list[i-1],rate = merge_stage(alpha_list[i-1],alpha_list[i],True)
         rate_cross_layer_list[i-1] = rate
+    return alpha_list, rate_cross_layer_list, rate_inner_layer_list
 
-    #print(rate_cross_layer_list)
-    #print(rate_inner_layer_list)
-    #print(alpha_list[0])
-        
-    # split
-    nslot = job.nslot
-    v_num = len(stages)
-    for i in range(0,max_depth):
+
+def continuous_dop(job: Job, nslot: float = None) -> Dict[int, float]:
+    '''
+    The bottom-up split of nslot (job.nslot by default) without rounding: every layer and
+    every stage keeps its exact share, so the shares add up to nslot. nslot can also be a
+    NumPy array of budgets: every share is then an array, from the same operations.
+    '''
+    layer_dict = get_layers(job)
+    max_depth = len(layer_dict)-1
+    _, rate_cross_layer_list, rate_inner_layer_list = merge_rates(job, layer_dict)
+
+    shares = {}
+    nslot = float(job.nslot) if nslot is None else nslot * 1.0
+    for i in range(0,max_depth+1):
         v_list = layer_dict[i]
-        v_num -= len(v_list)
-        aslot, bslot = alloc_slot(nslot,rate_cross_layer_list[i],len(v_list),v_num)
-        left_num = len(v_list)
+        aslot = nslot
+        if i < max_depth:
+            rate = rate_cross_layer_list[i]
+            aslot = nslot*rate/(rate+1)
+            nslot -= aslot
         for j in range(len(v_list)-2,-1,-1):
-            left_num -= 1
-            islot, jslot = alloc_slot(aslot,rate_inner_layer_list[i][j],left_num,1)
-            stages[v_list[j+1]].nslot = jslot
+            rate = rate_inner_layer_list[i][j]
+            islot = aslot*rate/(rate+1)
+            shares[v_list[j+1]] = aslot - islot
             aslot = islot
-        stages[v_list[0]].nslot = aslot
-        nslot = bslot
-    v_list = layer_dict[max_depth]
-    left_num = len(v_list)
-    for j in range(len(v_list)-2,-1,-1):
-        left_num -= 1
-        islot, jslot = alloc_slot(aslot,rate_inner_layer_list[max_depth][j],left_num,1)
-        stages[v_list[j+1]].nslot = jslot
-        nslot = islot
-    stages[v_list[0]].nslot = aslot
+        shares[v_list[0]] = aslot
+    return shares
+
+
+def slot_gain(alpha: float, nslot: int) -> float:
+    # how much alpha / nslot drops with one more slot
+    if nslot == 0:
+        return float("inf") if alpha > 0 else 0.0
+    return alpha / (nslot * (nslot + 1))
+
+
+def round_dop(alphas: List[float], shares: List[float], nslot: int, minimums: List[int]) -> List[int]:
+    '''
+    Round the DoP shares of stages to integers adding up to exactly nslot.
+    Every share is rounded down, to at least its minimum. The slots left are then handed out
+    one at a time to the stage whose alpha / nslot drops the most; slots taken by the
+    minimums are taken back from the stages whose alpha / nslot grows the least.
+    The rounding only minimizes the total stage time, sum of alpha / nslot: it does not know
+    the edges. bottom_up_dop hands its slots to the critical path instead (critical_path_slots).
+    O(V log V + S log V) for V stages and S slots.
+    '''
+    if sum(minimums) > nslot:
+        raise NotEnoughSlots(f"{nslot} slots are not enough for {sum(minimums)} stages")
+    dop = [max(minimum, int(share)) for share, minimum in zip(shares, minimums)]
+    left = nslot - sum(dop)
+    if left > 0:
+        heap = IndexedHeap([(k, slot_gain(alphas[k], dop[k])) for k in range(len(dop))])
+        for _ in range(left):
+            k, _ = heap.peek()
+            dop[k] += 1
+            heap.update(k, slot_gain(alphas[k], dop[k]))
+    elif left < 0:
+        heap = IndexedHeap([(k, -slot_gain(alphas[k], dop[k]-1)) for k in range(len(dop)) if dop[k] > minimums[k]])
+        for _ in range(-left):
+            k, _ = heap.peek()
+            dop[k] -= 1
+            if dop[k] > minimums[k]:
+                heap.update(k, -slot_gain(alphas[k], dop[k]-1))
+            else:
+                heap.remove(k)
+    return dop
+
+
+# PathSlots.deal finds the critical path again at least twice, and more often as long as
+# that walks at most PATH_WALKS stages and edges in total
+PATH_WALKS = 1 << 16
+# the slots of paths of at least this many stages of a CompactJob are dealt over arrays
+ARRAY_PATH = 256
+
+
+class PathSlots:
+    '''
+    The stages of a job (by index in job.stages) in topological order with their out-edges,
+    as plain lists: the critical path of any DoP is found in two passes over them.
+    '''
+    def __init__(self, job: Job) -> None:
+        self.compact = CompactJob is not None and isinstance(job, CompactJob)
+        ids = list(job.stages.keys())
+        self.ids = ids
+        if self.compact:
+            # dense ids: the index of a stage is its id
+            self.alpha = job.alpha.tolist()
+            self.beta = job.beta.tolist()
+            self.order = [v for layer in get_layers(job) for v in layer]
+        else:
+            index = {v: i for i, v in enumerate(ids)}
+            self.alpha = [job.stages[v].alpha for v in ids]
+            self.beta = [job.stages[v].beta for v in ids]
+            self.order = [index[v] for layer in get_layers(job) for v in layer]
+        # out[i] is the (target, weight) of every edge leaving stage i
+        if self.compact and job.shuffle_cost is None:
+            offsets = job.offsets.tolist()
+            targets = job.targets.tolist()
+            weights = job.weights.tolist()
+            self.out = [list(zip(targets[start:end], weights[start:end])) for start, end in zip(offsets, offsets[1:])]
+        else:
+            self.out: List[List[Tuple[int, float]]] = [[] for _ in ids]
+            for (i, j), weight in edge_weights(job).items():
+                self.out[i if self.compact else index[i]].append((j if self.compact else index[j], weight))
+        self.size = len(ids) + sum(len(out) for out in self.out)
+
+    def critical_path(self, nslot: List[int]) -> Tuple[List[int], float, float]:
+        '''
+        return: (path, length, rival), the critical path with nslot[i] slots for stage i,
+                its length and the length of the longest other path (the longest through a
+                stage or an edge off the path: subpaths of the path are never longer)
+        '''
+        instrumentation.count("dop.walked", self.size)
+        out = self.out
+        cost = [alpha / n + beta for alpha, n, beta in zip(self.alpha, nslot, self.beta)]
+        arrival = [0.0] * len(cost)
+        pred = [-1] * len(cost)
+        distance = [0.0] * len(cost)
+        for i in self.order:
+            reach = arrival[i] + cost[i]
+            distance[i] = reach
+            for j, weight in out[i]:
+                if pred[j] < 0 or reach + weight > arrival[j]:
+                    arrival[j] = reach + weight
+                    pred[j] = i
+        # longest path starting at each stage
+        tail = [0.0] * len(cost)
+        for i in reversed(self.order):
+            longest = 0.0
+            for j, weight in out[i]:
+                if weight + tail[j] > longest:
+                    longest = weight + tail[j]
+            tail[i] = cost[i] + longest
+
+        end = max(range(len(cost)), key=distance.__getitem__)
+        path = [end]
+        while pred[path[-1]] >= 0:
+            path.append(pred[path[-1]])
+        path.reverse()
+        on_path = set(path)
+        rival = max((distance[i] + tail[i] - cost[i] for i in range(len(cost)) if i not in on_path), default=0.0)
+        for k, i in enumerate(path):
+            after = path[k+1] if k + 1 < len(path) else -1
+            for j, weight in out[i]:
+                if j != after and j in on_path:
+                    rival = max(rival, distance[i] + weight + tail[j])
+        return path, distance[end], rival
+
+    def deal(self, nslot: List[int], left: int) -> None:
+        '''
+        Hand left more slots to the stages (nslot in job.stages order, updated in place), each
+        to the stage of the critical path whose alpha / nslot drops the most (an IndexedHeap
+        over the stages of the path). Slots only shorten paths, so the path stays critical
+        while it is longer than the longest other path; only then is the critical path found
+        again, at most max(2, PATH_WALKS / (V + E)) times. The slots left after that, or when
+        no stage of the path can use them (every alpha on the path is 0), go to the largest
+        gain of the whole job. O(V + E + S log V) for S slots.
+        '''
+        alpha = self.alpha
+        for _ in range(max(2, PATH_WALKS // max(1, self.size))):
+            if left <= 0:
+                break
+            path, length, rival = self.critical_path(nslot)
+            if not any(alpha[i] > 0 for i in path):
+                break
+            if self.compact and len(path) >= ARRAY_PATH:
+                left -= self.deal_path_arrays(nslot, path, length - rival, left)
+                continue
+            heap = IndexedHeap([(i, slot_gain(alpha[i], nslot[i])) for i in path])
+            # at least one slot: on a tie the path found is as critical as any
+            while left > 0:
+                i, gain = heap.peek()
+                nslot[i] += 1
+                heap.update(i, slot_gain(alpha[i], nslot[i]))
+                left -= 1
+                length -= gain
+                if length <= rival:
+                    break
+        if left <= 0:
+            return
+        if self.compact:
+            # the same increments, taken at once over the arrays
+            dop = np.array(nslot, dtype=np.int64)
+            nslot[:] = round_dops(np.array(alpha), dop[None, :], np.array([dop.sum() + left]))[0].tolist()
+            return
+        heap = IndexedHeap([(i, slot_gain(alpha[i], nslot[i])) for i in range(len(nslot))])
+        for _ in range(left):
+            i, _ = heap.peek()
+            nslot[i] += 1
+            heap.update(i, slot_gain(alpha[i], nslot[i]))
+
+    def deal_path_arrays(self, nslot: List[int], path: List[int], need: float, left: int) -> int:
+        '''
+        The slots deal hands to path, over arrays: the best increments of the path stages
+        (round_dops, ties by path order like the heap), as few as shorten it by need but at
+        least one and at most left, found by galloping and bisection.
+        return: int is the number of slots handed out
+        '''
+        alphas = np.array([self.alpha[i] for i in path])
+        dop = np.array([nslot[i] for i in path], dtype=np.int64)
+        cost = (alphas / dop).sum()
+        def taken(count: int) -> np.ndarray:
+            # round_dops adds at most as many slots as there are stages at a time
+            new = dop
+            while count > 0:
+                step = min(count, len(path))
+                new = round_dops(alphas, new[None, :], np.array([new.sum() + step]))[0]
+                count -= step
+            return new
+        # gallop, then bisect
+        low, high = 1, 1
+        while high < left and cost - (alphas / taken(high)).sum() < need:
+            low, high = high + 1, min(2 * high, left)
+        while low < high:
+            middle = (low + high) // 2
+            if cost - (alphas / taken(middle)).sum() >= need:
+                high = middle
+            else:
+                low = middle + 1
+        for i, n in zip(path, taken(low).tolist()):
+            nslot[i] = n
+        return low
+
+
+def critical_path_targets(job: Job, left: int) -> Dict[int, int]:
+    '''
+    return: Dict[int, int], the nslot of every stage that gets one of left more slots
+            (PathSlots.deal), the job is not changed
+    '''
+    if left <= 0 or not job.stages:
+        return {}
+    paths = PathSlots(job)
+    if paths.compact:
+        before = job.nslot_array.tolist()
+    else:
+        before = [job.stages[v].nslot for v in paths.ids]
+    nslot = list(before)
+    paths.deal(nslot, left)
+    return {v: n for v, n, old in zip(paths.ids, nslot, before) if n != old}
+
+
+def critical_path_slots(job: Job, left: int) -> None:
+    '''
+    Hand left more slots to the critical path of job (critical_path_targets)
+    '''
+    for v, nslot in critical_path_targets(job, left).items():
+        job.set_stage_nslot(v, nslot)
+
+
+def bottom_up_dop(job: Job):
+    '''
+    Split job.nslot over the stages bottom up (continuous_dop), round every share down to at
+    least one slot, then hand the slots left to the critical path (critical_path_slots).
+    When the minimums take more than job.nslot, round_dop takes slots back instead.
+    '''
+    shares = continuous_dop(job)
+    ids = list(job.stages.keys())
+    floors = [max(1, int(shares[v])) for v in ids]
+    left = job.nslot - sum(floors)
+    if left < 0:
+        if CompactJob is not None and isinstance(job, CompactJob):
+            round_shares(job, shares)
+            return
+        floors = round_dop([job.stages[v].alpha for v in ids], [shares[v] for v in ids], job.nslot, [1]*len(ids))
+        left = 0
+    if CompactJob is not None and isinstance(job, CompactJob):
+        job.set_stage_nslots(floors)
+    else:
+        for v, nslot in zip(ids, floors):
+            job.set_stage_nslot(v, nslot)
+    critical_path_slots(job, left)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+'''
+Multi-job planning on one shared cluster.
+
+A Cluster keeps one live ServerPool. Jobs are admitted first come first served: each is
+planned with joint_optimization against the slots still free, through a view of the pool
+(ServerPool.view) so stage ids of different jobs never clash, and holds its slots until it
+finishes at admission time + planned JCT. The DoP budget of a job is capped by the free
+slots and halved while the plan does not fit; a job that does not fit waits for running
+jobs to finish, and is rejected if it does not fit on the idle cluster either.
+
+The clock is simulated; only planning is timed for real, giving the sustained planning
+throughput (admitted jobs per second spent in admit).
+'''
+
+import random
+import time
+from collections import deque
+from heapq import heappush, heappop
+from typing import Iterable, Iterator, Optional
+from joint_optimization import *
+
+class Cluster:
+    def __init__(self, servers: List[Server], strategy: Strategy = Strategy.DITTO, record: bool = False) -> None:
+        '''
+        record: keep (admission time, job, placements) of every admitted job in admissions,
+                the input of simulator.simulate
+        '''
+        self.pool = ServerPool(servers)
+        self.strategy = strategy
+        self.total_slots = sum(server.total_slots for server in servers)
+        self.free_slots = sum(server.available_slots for server in servers)
+        self.running: Dict[int, ServerPool] = {}    # job id -> its view of the pool
+        self.next_id = 0
+
+        self.now = 0.0
+        self.waiting = deque()      # (arrival time, Job) not admitted yet, in arrival order
+        self.finishes = []          # heap of (finish time, job id)
+        self.busy_area = 0.0        # integral of the used slots over time
+        self.planning_time = 0.0
+        self.plans = 0
+        self.submitted = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.delays: List[float] = []
+        self.jcts: List[float] = []
+        self.record = record
+        self.admissions: List[Tuple[float, Job, Dict[int, int]]] = []
+
+    def admit(self, job: Job) -> Optional[Tuple[int, float]]:
+        '''
+        Plan job on the free slots and place every stage.
+        return: (job id, JCT), None if the job does not fit now (nothing is changed then)
+        '''
+        job_id = self.next_id
+        view = self.pool.view(job_id)
+        log = job.undo_log = view.undo_log = UndoLog()
+        requested = job.nslot
+
+        budget = min(requested, self.free_slots)
+        while budget >= len(job.stages):
+            mark = log.checkpoint()
+            job.nslot = budget
+            try:
+                jct = joint_optimization(job, view, self.strategy)
+            except NotEnoughSlots:
+                # the budget cannot give every stage a slot, a smaller one cannot either
+                log.rollback(mark)
+                break
+            # only grouped stages are placed by planning, the rest go to their best fit
+            if all(view.locate(id) is not None or view.place((id, stage)) for id, stage in job.stages.items()):
+                log.commit(mark)
+                self.next_id += 1
+                self.running[job_id] = view
+                self.free_slots -= sum(stage.nslot for stage in job.stages.values())
+                return job_id, jct
+            log.rollback(mark)
+            budget //= 2
+
+        job.nslot = requested
+        return None
+
+    def release(self, job_id: int) -> None:
+        view = self.running.pop(job_id)
+        for stage_id in list(view.stage_server.keys()):
+            self.free_slots += view.release(stage_id).nslot
+
+    def busy_slots(self) -> int:
+        return self.total_slots - self.free_slots
+
+    def advance(self, t: float) -> None:
+        '''
+        Move the clock to t, finishing jobs and admitting waiting ones on the way.
+        '''
+        while self.finishes and self.finishes[0][0] <= t:
+            finish, job_id = heappop(self.finishes)
+            self.busy_area += self.busy_slots() * (finish - self.now)
+            self.now = finish
+            self.release(job_id)
+            self.admit_waiting()
+        self.busy_area += self.busy_slots() * (t - self.now)
+        self.now = t
+
+    def admit_waiting(self) -> None:
+        while self.waiting:
+            arrival, job = self.waiting[0]
+            start = time.perf_counter()
+            admitted = self.admit(job)
+            self.planning_time += time.perf_counter() - start
+            self.plans += 1
+            if admitted is None:
+                if self.running:
+                    break
+                # does not fit on the idle cluster, it never will
+                self.waiting.popleft()
+                self.rejected += 1
+                continue
+            self.waiting.popleft()
+            job_id, jct = admitted
+            heappush(self.finishes, (self.now + jct, job_id))
+            self.admitted += 1
+            self.delays.append(self.now - arrival)
+            self.jcts.append(jct)
+            if self.record:
+                view = self.running[job_id]
+                self.admissions.append((self.now, job, {stage_id: view.position[id(server)] for stage_id, server in view.stage_server.items()}))
+
+    def submit(self, arrival: float, job: Job) -> None:
+        self.advance(arrival)
+        self.submitted += 1
+        self.waiting.append((arrival, job))
+        if len(self.waiting) == 1:
+            self.admit_waiting()
+
+    def drain(self) -> None:
+        while self.finishes:
+            self.advance(self.finishes[0][0])
+
+    def stats(self) -> Dict[str, float]:
+        delays = sorted(self.delays)
+        return {
+            "submitted": self.submitted,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "plans": self.plans,
+            "planning_s": self.planning_time,
+            "throughput_jobs_per_s": self.admitted / self.planning_time if self.planning_time > 0 else 0.0,
+            "makespan": self.now,
+            "utilization": self.busy_area / (self.total_slots * self.now) if self.now > 0 else 0.0,
+            "mean_jct": sum(self.jcts) / len(self.jcts) if self.jcts else 0.0,
+            "mean_delay": sum(delays) / len(delays) if delays else 0.0,
+            "p99_delay": delays[min(int(0.99 * len(delays)), len(delays) - 1)] if delays else 0.0,
+        }
+
+
+def replay(cluster: Cluster, arrivals: Iterable[Tuple[float, Job]]) -> Dict[str, float]:
+    '''
+    Submit every (arrival time, job) in time order, run the cluster until all jobs finish
+    return: Cluster.stats()
+    '''
+    for arrival, job in arrivals:
+        cluster.submit(arrival, job)
+    cluster.drain()
+    return cluster.stats()
+
+
+def poisson_arrivals(jobs: List[Job], njobs: int, rate: float, seed: int = 0) -> Iterator[Tuple[float, Job]]:
+    '''
+    njobs copies of jobs picked at random, arriving as a Poisson process of `rate` jobs per unit of time
+    '''
+    rng = random.Random(seed)
+    t = 0.0
+    for _ in range(njobs):
+        t += rng.expovariate(rate)
+        yield t, rng.choice(jobs).copy()
+
+
+def read_arrivals(path: str, jobs: Dict[str, Job]) -> Iterator[Tuple[float, Job]]:
+    '''
+    Arrival trace with one "time,job name" line per arrival, sorted by time
+    '''
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            t, name = line.split(",", 1)
+            if name.strip() not in jobs:
+                raise Exception(f"Unknown job in arrival trace {path}: {name.strip()}")
+            yield float(t), jobs[name.strip()].copy()
@@ -0,0 +1,408 @@
+'''
+Array-backed job graph.
+
+Stage alpha/beta/nslot/memory/disk live in NumPy arrays indexed by dense stage ids, edges in CSR form
+(offsets/targets/weights, sorted by source stage, keeping the insertion order of the edges
+leaving one stage). job.stages and job.edges are views over the arrays, so every function
+written against the dict-based Job keeps working on a CompactJob. The hot paths of
+bottom_up_dop (layers, merge and rounding) run over the arrays directly, and keyed edge
+lookups go through an index built on first use.
+
+NumPy is only needed when a CompactJob is built.
+'''
+
+import numpy as np
+from collections.abc import Mapping, MutableMapping
+from job import *
+
+class StageView:
+    __slots__ = ("arrays", "id")
+
+    def __init__(self, arrays, id: int) -> None:
+        self.arrays = arrays
+        self.id = id
+
+    @property
+    def alpha(self) -> float:
+        return float(self.arrays.alpha[self.id])
+
+    @alpha.setter
+    def alpha(self, value: float) -> None:
+        self.arrays.alpha[self.id] = value
+
+    @property
+    def beta(self) -> float:
+        return float(self.arrays.beta[self.id])
+
+    @beta.setter
+    def beta(self, value: float) -> None:
+        self.arrays.beta[self.id] = value
+
+    @property
+    def nslot(self) -> int:
+        return int(self.arrays.nslot_array[self.id])
+
+    @nslot.setter
+    def nslot(self, value: int) -> None:
+        self.arrays.nslot_array[self.id] = value
+
+    @property
+    def memory(self) -> float:
+        return float(self.arrays.memory[self.id])
+
+    @property
+    def disk(self) -> float:
+        return float(self.arrays.disk[self.id])
+
+
+class StagesView(Mapping):
+    '''
+    Dict[int, Stage] over the stage arrays
+    '''
+    def __init__(self, arrays) -> None:
+        self.arrays = arrays
+
+    def __getitem__(self, id: int) -> StageView:
+        if not 0 <= id < len(self.arrays.alpha):
+            raise KeyError(id)
+        return StageView(self.arrays, id)
+
+    def __iter__(self):
+        return iter(range(len(self.arrays.alpha)))
+
+    def __len__(self) -> int:
+        return len(self.arrays.alpha)
+
+    def __contains__(self, id) -> bool:
+        return isinstance(id, (int, np.integer)) and 0 <= id < len(self.arrays.alpha)
+
+    def keys(self) -> range:
+        return range(len(self.arrays.alpha))
+
+    def costs(self) -> Dict[int, float]:
+        arrays = self.arrays
+        return dict(enumerate((arrays.alpha / arrays.nslot_array + arrays.beta).tolist()))
+
+
+class EdgesView(MutableMapping):
+    '''
+    Dict[Tuple[int, int], float] over the CSR arrays. Weights can be changed,
+    the edge set is fixed.
+    '''
+    def __init__(self, arrays) -> None:
+        self.arrays = arrays
+        # built on first use: the edge tuples in CSR order, edge -> index in the CSR arrays,
+        # and edge -> weight (kept in sync by __setitem__)
+        self.edge_list = None
+        self.positions = None
+        self.lookup = None
+
+    def index(self, edge: Tuple[int, int]) -> int:
+        if self.positions is None:
+            self.positions = {edge: k for k, edge in enumerate(self.keys())}
+        return self.positions[edge]
+
+    def __getitem__(self, edge: Tuple[int, int]) -> float:
+        if self.lookup is not None:
+            return self.lookup[edge]
+        return self.arrays.weights.item(self.index(edge))
+
+    def __setitem__(self, edge: Tuple[int, int], weight: float) -> None:
+        self.arrays.weights[self.index(edge)] = weight
+        if self.lookup is not None:
+            self.lookup[edge] = float(weight)
+
+    def weight_dict(self) -> Dict[Tuple[int, int], float]:
+        '''
+        return: a dict of the edge weights for per-edge hot loops (the critical path),
+            built once and then kept in sync by __setitem__
+        '''
+        if self.lookup is None:
+            self.lookup = self.copy()
+        return self.lookup
+
+    def __delitem__(self, edge: Tuple[int, int]) -> None:
+        raise TypeError("edges of a CompactJob cannot be removed")
+
+    def __iter__(self):
+        arrays = self.arrays
+        sources = np.repeat(np.arange(len(arrays.offsets) - 1), np.diff(arrays.offsets))
+        return zip(sources.tolist(), arrays.targets.tolist())
+
+    def __len__(self) -> int:
+        return len(self.arrays.targets)
+
+    def keys(self) -> List[Tuple[int, int]]:
+        if self.edge_list is None:
+            self.edge_list = list(iter(self))
+        return self.edge_list
+
+    def values(self) -> List[float]:
+        return self.arrays.weights.tolist()
+
+    def adjacency(self) -> Tuple[Dict[int, List[Tuple[int, int]]], Dict[int, int]]:
+        '''
+        return: (the edges leaving every stage, the in-degree of every stage), for
+            critical_path.relaxation_order
+        '''
+        arrays = self.arrays
+        edges = self.keys()
+        offsets = arrays.offsets.tolist()
+        graph = {v: edges[offsets[v]:offsets[v+1]] for v in range(len(offsets) - 1)}
+        in_degree = dict(enumerate(np.bincount(arrays.targets, minlength=len(offsets) - 1).tolist()))
+        return graph, in_degree
+
+    def copy(self) -> Dict[Tuple[int, int], float]:
+        return dict(zip(self.keys(), self.arrays.weights.tolist()))
+
+    def longest_path(self, node_costs: Dict[int, float]) -> List[Tuple[int, int, float]]:
+        return longest_path(self.arrays, node_costs)
+
+
+class CompactJob(Job):
+    def __init__(self, names: List[str], alpha: np.ndarray, beta: np.ndarray, nslot: np.ndarray,
+                 offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray, job_nslot: int,
+                 memory: np.ndarray = None, disk: np.ndarray = None) -> None:
+        '''
+        names: List[str] is the interned stage names, names[id] is the name of stage id
+        alpha, beta, nslot: per stage arrays
+        offsets, targets, weights: CSR edges, the edges leaving stage i are
+            targets[offsets[i]:offsets[i+1]] with weights[offsets[i]:offsets[i+1]]
+        memory, disk: per stage arrays, zeros by default
+        '''
+        self.names = names
+        self.alpha = alpha
+        self.beta = beta
+        self.nslot_array = nslot
+        self.memory = memory if memory is not None else np.zeros(len(alpha))
+        self.disk = disk if disk is not None else np.zeros(len(alpha))
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        super().__init__(StagesView(self), EdgesView(self), job_nslot)
+
+    @classmethod
+    def from_job(cls, job: Job, names: List[str] = None):
+        '''
+        Intern the stages of a dict-based job to dense ids 0..V-1 in job.stages order.
+        '''
+        ids = {id: i for i, id in enumerate(job.stages.keys())}
+        if names is None:
+            names = [str(id) for id in job.stages.keys()]
+        stages = list(job.stages.values())
+        alpha = np.fromiter((stage.alpha for stage in stages), dtype=np.float64, count=len(stages))
+        beta = np.fromiter((stage.beta for stage in stages), dtype=np.float64, count=len(stages))
+        nslot = np.fromiter((stage.nslot for stage in stages), dtype=np.int64, count=len(stages))
+        memory = np.fromiter((stage.memory for stage in stages), dtype=np.float64, count=len(stages))
+        disk = np.fromiter((stage.disk for stage in stages), dtype=np.float64, count=len(stages))
+
+        sources = np.fromiter((ids[i] for i, _ in job.edges.keys()), dtype=np.int64, count=len(job.edges))
+        targets = np.fromiter((ids[j] for _, j in job.edges.keys()), dtype=np.int64, count=len(job.edges))
+        weights = np.fromiter(job.edges.values(), dtype=np.float64, count=len(job.edges))
+        order = np.argsort(sources, kind="stable")
+        offsets = np.zeros(len(stages) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(stages)), out=offsets[1:])
+        return cls(names, alpha, beta, nslot, offsets, targets[order], weights[order], job.nslot, memory, disk)
+
+    def set_stage_nslots(self, nslot: np.ndarray) -> None:
+        '''
+        Set the nslot of every stage at once, like set_stage_nslot on each changed stage
+        '''
+        changed = np.nonzero(nslot != self.nslot_array)[0]
+        if self.undo_log is not None:
+            self.undo_log.record(self.set_stage_nslots, self.nslot_array.copy())
+        self.nslot_array[:] = nslot
+        if self.critical_path is not None:
+            for id in changed.tolist():
+                self.critical_path.stage_changed(id)
+
+    def copy(self):
+        # like Job.copy: edge weights and DoP are copied, the graph is shared
+        job = CompactJob(self.names, self.alpha, self.beta, self.nslot_array.copy(),
+                         self.offsets, self.targets, self.weights.copy(), self.nslot, self.memory, self.disk)
+        job.edges.edge_list, job.edges.positions = self.edges.edge_list, self.edges.positions
+        return self.copy_caches(job)
+
+
+def layers_of(job: CompactJob) -> List[List[int]]:
+    '''
+    get_layers over the CSR arrays: Kahn's algorithm, every layer by ascending stage id.
+    '''
+    offsets = job.offsets.tolist()
+    targets = job.targets.tolist()
+    in_degree = np.bincount(job.targets, minlength=len(job.alpha)).tolist()
+    depth = [0] * len(in_degree)
+    queue = [v for v, degree in enumerate(in_degree) if degree == 0]
+    for v in queue:
+        for child in targets[offsets[v]:offsets[v+1]]:
+            in_degree[child] -= 1
+            if depth[child] <= depth[v]:
+                depth[child] = depth[v] + 1
+            if in_degree[child] == 0:
+                queue.append(child)
+
+    if len(queue) < len(depth):
+        cycle = [v for v, degree in enumerate(in_degree) if degree > 0]
+        raise Exception(f"Cycle detected among stages: {cycle}")
+    depth = np.array(depth, dtype=np.int64)
+    order = np.argsort(depth, kind="stable")
+    sizes = np.bincount(depth).tolist()
+    order = order.tolist()
+    layers = []
+    start = 0
+    for size in sizes:
+        layers.append(order[start:start + size])
+        start += size
+    return layers
+
+
+def longest_path(job: CompactJob, node_costs: Dict[int, float]) -> List[Tuple[int, int, float]]:
+    '''
+    longest_path_dag_with_weights_and_path over the CSR arrays: the same depth first
+    relaxation order, so the same ties, on lists instead of the edge views.
+    return : list[(si, sj, w)] along the critical path
+    '''
+    offsets = job.offsets.tolist()
+    targets = job.targets.tolist()
+    weights = job.weights.tolist()
+    costs = [node_costs[v] for v in range(len(job.alpha))]
+    in_degree = np.bincount(job.targets, minlength=len(costs)).tolist()
+    distance = [0] * len(costs)
+    pred = [None] * len(costs)
+
+    for root in [v for v, degree in enumerate(in_degree) if degree == 0]:
+        distance[root] = costs[root]
+        pred[root] = root
+        stack = [(root, iter(range(offsets[root], offsets[root+1])))]
+        while stack:
+            source, edges = stack[-1]
+            for k in edges:
+                node = targets[k]
+                in_degree[node] -= 1
+                new_distance = distance[source] + weights[k] + costs[node]
+                if new_distance > distance[node]:
+                    pred[node] = source
+                    distance[node] = new_distance
+                if in_degree[node] == 0:
+                    stack.append((node, iter(range(offsets[node], offsets[node+1]))))
+                    break
+            else:
+                stack.pop()
+
+    path = []
+    node = max(range(len(distance)), key=distance.__getitem__)
+    while pred[node] is not None:
+        path.append(node)
+        if pred[node] == node:
+            break
+        node = pred[node]
+    path.reverse()
+    return [(path[i], path[i+1], job.edges[(path[i], path[i+1])]) for i in range(len(path) - 1)]
+
+
+def round_shares(job: CompactJob, shares: Dict[int, float]) -> None:
+    '''
+    round_dop over the arrays, with one slot per stage at least (bottom_up_dop when the
+    minimums take more than job.nslot).
+    '''
+    if len(job.alpha) > job.nslot:
+        raise NotEnoughSlots(f"{job.nslot} slots are not enough for {len(job.alpha)} stages")
+    shares = np.fromiter((shares[v] for v in range(len(job.alpha))), dtype=np.float64, count=len(job.alpha))
+    job.set_stage_nslots(round_dops(job.alpha, shares[None, :], np.array([job.nslot]))[0])
+
+
+def merge_layers(job: CompactJob, layers: List[List[int]]) -> Tuple[List[float], List[float], List[List[float]]]:
+    '''
+    Vectorized merge step of bottom_up_dop over all layers at once.
+    return: (alpha_list, rate_cross_layer_list, rate_inner_layer_list)
+        alpha_list[i] is layer i merged with every layer below it
+    '''
+    lengths = np.fromiter((len(layer) for layer in layers), dtype=np.int64, count=len(layers))
+    starts = np.zeros(len(layers), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    flat = job.alpha[np.fromiter((v for layer in layers for v in layer), dtype=np.int64, count=int(lengths.sum()))]
+
+    # inside a layer stages merge without edges: alpha adds up
+    prefix = np.cumsum(flat)
+    prefix -= np.repeat(prefix[starts] - flat[starts], lengths)
+    inner = np.zeros_like(flat)
+    np.divide(prefix[:-1], flat[1:], out=inner[1:], where=flat[1:] != 0)
+    layer_alpha = prefix[starts + lengths - 1]
+
+    # across layers: sqrt(alpha_s) = sqrt(alpha_i) + sqrt(alpha_j), merged bottom up
+    merged_sqrt = np.cumsum(np.sqrt(layer_alpha)[::-1])[::-1]
+    cross = np.zeros(len(layers) - 1)
+    np.divide(np.sqrt(layer_alpha[:-1]), merged_sqrt[1:], out=cross, where=merged_sqrt[1:] != 0)
+
+    inner_list = inner.tolist()
+    rate_inner_layer_list = [inner_list[start + 1:start + length] for start, length in zip(starts.tolist(), lengths.tolist())]
+    return (merged_sqrt ** 2).tolist(), cross.tolist(), rate_inner_layer_list
+
+
+def slot_gains(alphas: np.ndarray, nslot: np.ndarray) -> np.ndarray:
+    # slot_gain of bottom_up_dop, elementwise, for nslot >= 1
+    return alphas / (nslot * (nslot + 1))
+
+
+def candidate_counts(alphas: np.ndarray, dop: np.ndarray, adding: bool, bound: np.ndarray, count: np.ndarray) -> np.ndarray:
+    '''
+    return: np.ndarray, how many slots of every stage (columns) for each budget (rows) are
+            worth bound or better: slots to add with a gain of at least bound if adding,
+            else slots to take back with a gain of at most bound; at most count
+    '''
+    cap = count[:, None]
+    bound = bound[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # n (n + 1) = alphas / bound at the bound, corrected by one slot either way for rounding
+        # 0 / 0 only for alpha 0 at bound 0, where every slot ties
+        root = (np.sqrt(1 + 4 * (alphas / bound)) - 1) / 2
+        if adding:
+            last = np.clip(np.nan_to_num(np.floor(root), nan=np.inf), dop - 1, dop - 1 + cap).astype(np.int64)
+            for _ in range(2):
+                last = np.where((last < dop - 1 + cap) & (slot_gains(alphas, last + 1) >= bound), last + 1, last)
+                last = np.where((last >= dop) & (slot_gains(alphas, last) < bound), last - 1, last)
+            return last - dop + 1
+        first = np.clip(np.nan_to_num(np.ceil(root), nan=0), 1, dop).astype(np.int64)
+        for _ in range(2):
+            first = np.where((first > 1) & (slot_gains(alphas, first - 1) <= bound), first - 1, first)
+            first = np.where((first < dop) & (slot_gains(alphas, first) > bound), first + 1, first)
+    return np.minimum(dop - first, cap)
+
+
+def round_dops(alphas: np.ndarray, shares: np.ndarray, budgets: np.ndarray) -> np.ndarray:
+    '''
+    round_dop with a minimum of one slot per stage, for every budget at once
+    alphas: np.ndarray is the alpha of every stage
+    shares: np.ndarray is the share of every stage (columns) for each budget (rows)
+    return: np.ndarray, the DoP of every stage for each budget, adding up to the budget
+    '''
+    nbudget, nstage = shares.shape
+    dop = np.maximum(1, shares.astype(np.int64))
+    left = budgets - dop.sum(axis=1)
+    count = np.abs(left)
+    adding = left > 0
+    if not count.any():
+        return dop
+
+    # every budget needs fewer than nstage slots, and its count-th best first slot bounds
+    # the gain of every slot it takes
+    with np.errstate(divide="ignore", invalid="ignore"):
+        first = np.where(adding[:, None], -slot_gains(alphas, dop),
+                         np.where(dop > 1, slot_gains(alphas, dop - 1), np.inf))
+    bound = np.abs(np.take_along_axis(np.sort(first, axis=1), np.maximum(count - 1, 0)[:, None], axis=1)[:, 0])
+    levels = np.zeros_like(dop)
+    levels[adding] = candidate_counts(alphas, dop[adding], True, bound[adding], count[adding])
+    levels[~adding] = candidate_counts(alphas, dop[~adding], False, bound[~adding], count[~adding])
+
+    # the candidate slots of all budgets, sorted by budget, then best gain, then stage like
+    # the heap of round_dop
+    cell = np.repeat(np.arange(nbudget * nstage), levels.ravel())
+    step = np.arange(len(cell)) - np.repeat(np.cumsum(levels.ravel()) - levels.ravel(), levels.ravel())
+    row, stage = np.divmod(cell, nstage)
+    nslot = np.where(adding[row], dop.ravel()[cell] + step, dop.ravel()[cell] - 1 - step)
+    gain = slot_gains(alphas[stage], nslot)
+    order = np.lexsort((step, stage, np.where(adding[row], -gain, gain), row))
+    start = np.cumsum(levels.sum(axis=1)) - levels.sum(axis=1)
+    taken = cell[order][np.arange(len(order)) - start[row[order]] < count[row[order]]]
+    moved = np.bincount(taken, minlength=nbudget * nstage).reshape(dop.shape)
+    return dop + np.sign(left)[:, None] * moved
@@ -0,0 +1,179 @@
+'''
+Precompiled binary workload.
+
+    python3 ./src/ compile queries/dags.json -o queries/dags.bin
+    python3 ./src/ -f queries/dags.bin
+
+Layout (little endian, every array aligned to 8 bytes):
+    header      magic "DITTODAG", version u32, njobs u32, source mtime_ns i64, source size i64,
+                job index offset u64, source path length u32, source path (relative to the
+                compiled file)
+    job blocks  one per job, in source order:
+                nstages u64, nedges u64, name length u32, names blob length u32, job name,
+                name offsets u32[nstages + 1], names blob (utf-8),
+                alpha f64[nstages], beta f64[nstages], memory f64[nstages], disk f64[nstages],
+                edge offsets i64[nstages + 1], targets i64[nedges], weights f64[nedges],
+                volumes f64[nedges] (the "bytes" of every edge, NaN where the source gives none)
+    job index   njobs x u64 offsets of the job blocks
+
+The edges are the CSR arrays of CompactJob. Loading maps the file copy-on-write and wraps
+the arrays with np.frombuffer, so nothing is parsed or copied; grouping writes edge weights
+into private pages only. A compiled file records the mtime and size of its source and is
+rebuilt when the source changed, and so is a file of an older version (version 1 had no
+memory and disk arrays, version 2 no volumes).
+'''
+
+import mmap
+import os
+import struct
+import numpy as np
+from compact_job import CompactJob
+from job import *
+from workload import COMPILED_MAGIC as MAGIC, load_jobs
+from typing import Iterator, Sequence
+
+VERSION = 3
+HEADER = struct.Struct("<8sIIqqQI")
+JOB_HEADER = struct.Struct("<QQII")
+
+class InternedNames(Sequence):
+    '''
+    Stage names decoded on access from the names blob of a compiled job
+    '''
+    def __init__(self, offsets: np.ndarray, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __getitem__(self, id: int) -> str:
+        if not 0 <= id < len(self):
+            raise IndexError(id)
+        return bytes(self.blob[self.offsets[id]:self.offsets[id+1]]).decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+def pad(n: int) -> int:
+    return -n % 8
+
+
+def volume_array(job: CompactJob) -> np.ndarray:
+    '''
+    return: job.volumes along the CSR edges of job, NaN for edges without one
+    '''
+    volumes = np.full(len(job.targets), np.nan)
+    for (i, j), volume in (job.volumes or {}).items():
+        start = job.offsets[i]
+        volumes[start + np.flatnonzero(job.targets[start:job.offsets[i+1]] == j)[0]] = volume
+    return volumes
+
+
+def volume_dict(offsets: np.ndarray, targets: np.ndarray, volumes: np.ndarray) -> Dict[Tuple[int, int], float]:
+    '''
+    return: the known volumes of a volume_array by (source, target), None if none is known
+    '''
+    known = np.flatnonzero(~np.isnan(volumes))
+    if len(known) == 0:
+        return None
+    sources = np.searchsorted(offsets, known, side="right") - 1
+    return dict(zip(zip(sources.tolist(), targets[known].tolist()), volumes[known].tolist()))
+
+
+def compile_workload(source: str, output: str) -> None:
+    '''
+    Compile a JSON / NDJSON workload, one job at a time, into a binary workload at output.
+    '''
+    stat = os.stat(source)
+    source_path = os.path.relpath(os.path.abspath(source), os.path.dirname(os.path.abspath(output))).encode("utf-8")
+    header_size = HEADER.size + len(source_path)
+    header_size += pad(header_size)
+
+    tmp = output + ".tmp"
+    index = []
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * header_size)
+        offset = header_size
+        for job_name, job in load_jobs(source, 0, compact=True):
+            name = job_name.encode("utf-8")
+            encoded = [stage_name.encode("utf-8") for stage_name in job.names]
+            name_offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+            np.cumsum([len(s) for s in encoded], out=name_offsets[1:])
+            blob = b"".join(encoded)
+
+            parts = [JOB_HEADER.pack(len(job.alpha), len(job.targets), len(name), len(blob)), name, name_offsets.tobytes(), blob]
+            parts.append(b"\0" * pad(sum(len(part) for part in parts)))
+            for array, dtype in [(job.alpha, "<f8"), (job.beta, "<f8"), (job.memory, "<f8"), (job.disk, "<f8"),
+                                 (job.offsets, "<i8"), (job.targets, "<i8"), (job.weights, "<f8"),
+                                 (volume_array(job), "<f8")]:
+                parts.append(array.astype(dtype, copy=False).tobytes())
+
+            index.append(offset)
+            for part in parts:
+                f.write(part)
+                offset += len(part)
+
+        f.write(np.array(index, dtype="<u8").tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), stat.st_mtime_ns, stat.st_size, offset, len(source_path)) + source_path)
+    os.replace(tmp, output)
+
+
+def source_of(path: str) -> Tuple[str, int, int]:
+    '''
+    return: (source path, source mtime_ns, source size) recorded in a compiled file
+    '''
+    with open(path, "rb") as f:
+        _, version, _, mtime_ns, size, _, path_len = HEADER.unpack(f.read(HEADER.size))
+        source_path = f.read(path_len).decode("utf-8")
+    if version != VERSION:
+        mtime_ns = size = -1
+    return os.path.join(os.path.dirname(os.path.abspath(path)), source_path), mtime_ns, size
+
+
+def is_stale(path: str) -> bool:
+    source, mtime_ns, size = source_of(path)
+    if not os.path.exists(source):
+        if mtime_ns < 0:
+            raise Exception(f"{path} has an unsupported version and its source {source} is missing")
+        return False
+    stat = os.stat(source)
+    return stat.st_mtime_ns != mtime_ns or stat.st_size != size
+
+
+def load_compiled(path: str, nslots: int) -> Iterator[Tuple[str, Job]]:
+    '''
+    yield : (job name, CompactJob) for every job in a compiled workload,
+            recompiling it first if its source changed
+    '''
+    if is_stale(path):
+        compile_workload(source_of(path)[0], path)
+
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(buf)
+
+    _, _, njobs, _, _, index_offset, _ = HEADER.unpack_from(buf, 0)
+    index = np.frombuffer(buf, dtype="<u8", count=njobs, offset=index_offset)
+
+    for offset in index.tolist():
+        nstages, nedges, name_len, blob_len = JOB_HEADER.unpack_from(buf, offset)
+        offset += JOB_HEADER.size
+        job_name = bytes(view[offset:offset + name_len]).decode("utf-8")
+        offset += name_len
+        name_offsets = np.frombuffer(buf, dtype="<u4", count=nstages + 1, offset=offset)
+        offset += name_offsets.nbytes
+        names = InternedNames(name_offsets, view[offset:offset + blob_len])
+        offset += blob_len
+        offset += pad(offset)
+
+        arrays = []
+        for dtype, count in [("<f8", nstages), ("<f8", nstages), ("<f8", nstages), ("<f8", nstages),
+                             ("<i8", nstages + 1), ("<i8", nedges), ("<f8", nedges), ("<f8", nedges)]:
+            arrays.append(np.frombuffer(buf, dtype=dtype, count=count, offset=offset))
+            offset += 8 * count
+        alpha, beta, memory, disk, offsets, targets, weights, volumes = arrays
+
+        job = CompactJob(names, alpha, beta, np.zeros(nstages, dtype=np.int64), offsets, targets, weights, nslots,
+                         memory, disk)
+        job.volumes = volume_dict(offsets, targets, volumes)
+        yield job_name, job
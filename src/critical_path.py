@@ -0,0 +1,260 @@
+import instrumentation
+from job import *
+from heapq import heappush, heappop
+from typing import Iterator, Optional, Set
+
+'''
+Persistent critical path of a Job.
+
+The longest distance (node cost + edge weight) and the predecessor of every stage are kept
+between queries. Changing one edge weight or the nslot of one stage only marks the touched
+stage dirty; the next query recomputes the dirty stages and walks downstream in topological
+order, stopping wherever a distance and a predecessor stay the same.
+
+Edges weigh edge_weights(job): the costs of job.shuffle_cost when a cost model is attached,
+the static edge weights otherwise.
+
+Ties are broken exactly like the DFS in longest_path_dag_with_weights_and_path: the in-edges
+of a stage are kept in the order the DFS relaxes them, so the first predecessor reaching the
+largest distance wins, and the end of the critical path is the first stage in job.stages
+holding the largest distance.
+'''
+
+class CriticalPath:
+    def __init__(self, job: Job) -> None:
+        self.job = job
+        self.build()
+
+    def build(self) -> None:
+        '''
+        Rebuild the topological order and the in-edge lists from job.stages and job.edges,
+        then compute every distance from scratch.
+        '''
+        instrumentation.count("critical_path.builds")
+        nodes = self.job.stages
+        edges = self.job.edges
+        self.weights = edge_weights(self.job)
+
+        # same traversal as longest_path_dag_with_weights_and_path
+        self.order: List[int] = []
+        self.in_edges: Dict[int, List[Tuple[int, int]]] = {node: [] for node in nodes.keys()}
+        for edge, node, ready in relaxation_order(nodes, edges):
+            if edge is not None:
+                self.in_edges[node].append(edge)
+            if ready:
+                self.order.append(node)
+
+        # stages never ready sit on (or behind) a cycle and never propagate
+        num_stages = len(nodes)
+        self.position = {node: num_stages for node in nodes.keys()}
+        for i, node in enumerate(self.order):
+            self.position[node] = i
+        self.out_edges: Dict[int, List[Tuple[int, int]]] = {node: [] for node in nodes.keys()}
+        for edge in edges.keys():
+            if self.position[edge[0]] < num_stages:
+                self.out_edges[edge[0]].append(edge)
+        self.is_root = {node: not self.in_edges[node] and self.position[node] < num_stages for node in nodes.keys()}
+        self.index = {node: i for i, node in enumerate(nodes.keys())}
+
+        self.num_stages = num_stages
+        self.num_edges = len(edges)
+        self.edge_version = self.job.edge_version
+        self.dirty: Set[int] = set()
+        self.recompute()
+
+    def recompute(self) -> None:
+        '''
+        Recompute every node cost, distance and predecessor in topological order.
+        '''
+        instrumentation.count("critical_path.recomputes")
+        nodes = self.job.stages
+        self.node_costs = stage_costs(nodes)
+        self.distance: Dict[int, float] = {}
+        # pred[v] is None when v has no path, v itself when the path starts at v
+        self.pred: Dict[int, Optional[int]] = {}
+        for node in self.order:
+            self.relax(node)
+        for node in nodes.keys():
+            if self.position[node] == self.num_stages:
+                self.relax(node)
+
+        self.heap = [(-distance, self.index[node], node) for node, distance in self.distance.items()]
+        self.heap.sort()
+        self.dirty.clear()
+
+    def relax(self, node: int) -> bool:
+        '''
+        Recompute the distance and predecessor of node from its in-edges.
+        return: bool is whether either of them changed
+        '''
+        if self.is_root[node]:
+            distance, pred = self.node_costs[node], node
+        else:
+            distance, pred = 0, None
+            edges = self.weights
+            node_cost = self.node_costs[node]
+            for edge in self.in_edges[node]:
+                new_distance = self.distance[edge[0]] + edges[edge] + node_cost
+                if new_distance > distance:
+                    distance, pred = new_distance, edge[0]
+
+        if self.distance.get(node) == distance and self.pred.get(node, -1) == pred:
+            return False
+        self.distance[node] = distance
+        self.pred[node] = pred
+        return True
+
+    def edge_changed(self, edge: Tuple[int, int]) -> None:
+        self.dirty.add(edge[1])
+
+    def stage_changed(self, node: int) -> None:
+        self.dirty.add(node)
+
+    def invalidate(self) -> None:
+        self.num_edges = -1
+
+    def refresh(self) -> None:
+        '''
+        Bring distances up to date: rebuild if the edge set changed, otherwise propagate
+        from the dirty stages downstream in topological order.
+        '''
+        if (self.job.edge_version != self.edge_version or len(self.job.edges) != self.num_edges
+                or len(self.job.stages) != self.num_stages):
+            self.build()
+            return
+        if not self.dirty:
+            return
+        if len(self.dirty) * 4 > len(self.order):
+            self.recompute()
+            return
+
+        instrumentation.count("critical_path.updates")
+        for node in self.dirty:
+            stage = self.job.stages[node]
+            self.node_costs[node] = stage.alpha / stage.nslot + stage.beta
+        queue = [(self.position[node], node) for node in self.dirty]
+        queue.sort()
+        queued = set(self.dirty)
+        self.dirty.clear()
+        relaxed = 0
+        while queue:
+            _, node = heappop(queue)
+            queued.discard(node)
+            relaxed += 1
+            if not self.relax(node):
+                continue
+            heappush(self.heap, (-self.distance[node], self.index[node], node))
+            for edge in self.out_edges[node]:
+                if edge[1] not in queued:
+                    queued.add(edge[1])
+                    heappush(queue, (self.position[edge[1]], edge[1]))
+        instrumentation.count("critical_path.relaxed", relaxed)
+
+        if len(self.heap) > 4 * self.num_stages:
+            self.heap = [(-distance, self.index[node], node) for node, distance in self.distance.items()]
+            self.heap.sort()
+
+    def path(self) -> List[int]:
+        '''
+        return: List[int] is the stages on the current critical path
+        '''
+        self.refresh()
+        while -self.heap[0][0] != self.distance[self.heap[0][2]]:
+            heappop(self.heap)
+
+        return trace_path(self.pred, self.heap[0][2])
+
+    def edge_attributes(self) -> List[Tuple[int, int, float]]:
+        '''
+        return : list[(si, sj, w)] along the current critical path
+        '''
+        path = self.path()
+        return [(path[i], path[i+1], self.weights[(path[i], path[i+1])]) for i in range(len(path) - 1)]
+
+    def copy(self, job: Job):
+        other = CriticalPath.__new__(CriticalPath)
+        other.__dict__.update(self.__dict__)
+        other.job = job
+        other.node_costs = self.node_costs.copy()
+        other.distance = self.distance.copy()
+        other.pred = self.pred.copy()
+        other.heap = self.heap.copy()
+        other.dirty = self.dirty.copy()
+        other.weights = edge_weights(job)
+        if job.shuffle_cost is not None or self.job.shuffle_cost is not None:
+            # priced by a cost model on one side only: distances must be rebuilt
+            other.invalidate()
+        return other
+
+
+def relaxation_order(nodes: Dict[int, Stage], edges: Dict[Tuple[int, int], float]) -> Iterator[Tuple[Optional[Tuple[int, int]], int, bool]]:
+    '''
+    Walk the DAG depth first from every start node without recursion.
+    yield : (edge, node, ready) for every start node (edge is None) and every edge into node,
+            ready is True once every in-edge of node has been seen
+    Edges into a stage come out after the stage they leave is ready, so distances can be
+    relaxed in this order in a single pass.
+    '''
+    adjacency = getattr(edges, "adjacency", None)
+    if adjacency is not None:
+        # the edge views of a CompactJob slice their CSR arrays
+        graph, in_degree = adjacency()
+    else:
+        graph = {node: [] for node in nodes.keys()}
+        in_degree = {node: 0 for node in nodes.keys()}
+        for edge in edges.keys():
+            in_degree[edge[1]] += 1
+            graph[edge[0]].append(edge)
+
+    for root_node in [node for node in nodes.keys() if in_degree[node] == 0]:
+        yield None, root_node, True
+        stack = [iter(graph[root_node])]
+        while stack:
+            for edge in stack[-1]:
+                neighbor = edge[1]
+                in_degree[neighbor] -= 1
+                ready = in_degree[neighbor] == 0
+                yield edge, neighbor, ready
+                if ready:
+                    stack.append(iter(graph[neighbor]))
+                    break
+            else:
+                stack.pop()
+
+
+def trace_path(pred: Dict[int, Optional[int]], node: int) -> List[int]:
+    '''
+    pred[v] is None when v has no path, v itself when the path starts at v
+    return: List[int] is the path ending at node
+    '''
+    path = []
+    while True:
+        p = pred[node]
+        if p is None:
+            break
+        path.append(node)
+        if p == node:
+            break
+        node = p
+    path.reverse()
+    return path
+
+
+def edge_weights(job: Job) -> Dict[Tuple[int, int], float]:
+    '''
+    return: the cost of every edge, from job.shuffle_cost if attached, else the edge weights
+    '''
+    if job.shuffle_cost is not None:
+        return job.shuffle_cost.costs
+    # the edge views of a CompactJob keep a plain dict for this
+    weight_dict = getattr(job.edges, "weight_dict", None)
+    return job.edges if weight_dict is None else weight_dict()
+
+
+def get_critical_path(job: Job) -> CriticalPath:
+    '''
+    Return the critical path attached to job, creating it on first use.
+    '''
+    if job.critical_path is None:
+        job.critical_path = CriticalPath(job)
+    return job.critical_path
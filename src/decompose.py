@@ -0,0 +1,310 @@
+'''
+Decomposition of a job into parts planned independently.
+
+A job is split into its weakly connected components, and every component into segments
+at its cut stages: a stage alone in its depth layer with no edge passing over that layer
+separates the stages above it from the stages below it. Segments are kept to at least
+`min_stages` stages, and components smaller than that are packed together, so a part is
+a series segment or a forest of small components.
+
+Every part is merged into one VirtualStage (alpha merged bottom up like bottom_up_dop) to
+split the DoP budget at the top level: parallel parts get slots in proportion to alpha,
+the segments of a chain in proportion to sqrt(alpha), the same rules merge_stage uses.
+The free slots of the servers are dealt to the parts in proportion to their budgets, then
+every part is planned with DITTO on its share, in parallel on a process pool. The plans
+are recombined onto the job and the servers, and the edges between parts are grouped
+last, heaviest first, when their stages can share a server.
+'''
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from bottom_up_dop import get_depth, get_layers, merge_rates, merge_stage
+from joint_optimization import *
+
+def components(job: Job) -> List[List[int]]:
+    '''
+    return: List[List[int]], the weakly connected components of job, stages in job order
+    '''
+    parent = {stage_id: stage_id for stage_id in job.stages.keys()}
+    def find(v: int) -> int:
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+    for i, j in job.edges.keys():
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[rj] = ri
+
+    groups: Dict[int, List[int]] = {}
+    for stage_id in job.stages.keys():
+        groups.setdefault(find(stage_id), []).append(stage_id)
+    return list(groups.values())
+
+
+def segments(component: List[int], out_edges: Dict[int, List[int]], depth: Dict[int, int], min_stages: int) -> List[List[int]]:
+    '''
+    Split a component at its cut stages into segments of at least min_stages stages
+    return: List[List[int]], the segments from the top of the component down
+    '''
+    layers: Dict[int, List[int]] = {}
+    for stage_id in component:
+        layers.setdefault(depth[stage_id], []).append(stage_id)
+    top, bottom = min(layers.keys()), max(layers.keys())
+
+    # edges passing over every depth, by difference
+    passing = [0] * (bottom - top + 2)
+    for i in component:
+        for j in out_edges[i]:
+            if depth[j] - depth[i] > 1:
+                passing[depth[i] + 1 - top] += 1
+                passing[depth[j] - top] -= 1
+
+    result = [[]]
+    over = 0
+    left = len(component)
+    for d in range(top, bottom + 1):
+        over += passing[d - top]
+        layer = layers.get(d, [])
+        result[-1].extend(layer)
+        left -= len(layer)
+        is_cut = len(layer) == 1 and over == 0
+        if is_cut and len(result[-1]) >= min_stages and left >= min_stages:
+            result.append([])
+    return result
+
+
+def split_parts(job: Job, min_stages: int) -> List[List[List[int]]]:
+    '''
+    return: List[List[List[int]]], chains of parts: the parts of a chain run in series,
+            chains run in parallel
+    '''
+    depth = get_depth(job.stages, job.edges)
+    out_edges: Dict[int, List[int]] = {stage_id: [] for stage_id in job.stages.keys()}
+    for i, j in job.edges.keys():
+        out_edges[i].append(j)
+
+    chains = []
+    small = []
+    for component in components(job):
+        if len(component) < min_stages:
+            small.extend(component)
+            if len(small) >= min_stages:
+                chains.append([small])
+                small = []
+            continue
+        chains.append(segments(component, out_edges, depth, min_stages))
+    if small:
+        chains.append([small])
+
+    # stages of a part in job order, so a single part plans exactly like the whole job
+    order = {stage_id: i for i, stage_id in enumerate(job.stages.keys())}
+    return [[sorted(part, key=order.get) for part in chain] for chain in chains]
+
+
+def sub_jobs(job: Job, parts: List[List[int]]) -> Tuple[List[Job], List[Tuple[int, int]]]:
+    '''
+    return: (a Job per part with its stages and inner edges, edges between parts)
+    '''
+    part_of = {}
+    subs = []
+    for k, part in enumerate(parts):
+        for stage_id in part:
+            part_of[stage_id] = k
+        subs.append(Job({stage_id: Stage(job.stages[stage_id].alpha, job.stages[stage_id].beta, 0,
+                                         job.stages[stage_id].memory, job.stages[stage_id].disk) for stage_id in part}, {}, 0))
+    between = []
+    for edge, weight in job.edges.items():
+        k = part_of[edge[0]]
+        if k == part_of[edge[1]]:
+            subs[k].add_edge(edge, weight)
+        else:
+            between.append(edge)
+    return subs, between
+
+
+def share(nslot: int, weights: List[float], minimums: List[int]) -> List[int]:
+    '''
+    Split nslot slots in proportion to weights, every share at least its minimum
+    '''
+    spare = nslot - sum(minimums)
+    if spare < 0:
+        raise NotEnoughSlots(f"{nslot} slots are not enough for {sum(minimums)} stages")
+    total = sum(weights)
+    exact = [spare * weight / total if total > 0 else spare / len(weights) for weight in weights]
+    shares = [int(x) for x in exact]
+    # the slots lost to rounding go to the largest remainders
+    for k in sorted(range(len(exact)), key=lambda k: shares[k] - exact[k])[:spare - sum(shares)]:
+        shares[k] += 1
+    return [minimum + n for minimum, n in zip(minimums, shares)]
+
+
+def top_level_dop(nslot: int, chains: List[List[VirtualStage]]) -> None:
+    '''
+    Set the nslot of every virtual stage: chains in parallel, the parts of a chain in series
+    '''
+    chain_alpha = []
+    for chain in chains:
+        alpha = chain[0].alpha
+        for stage in chain[1:]:
+            alpha, _ = merge_stage(alpha, stage.alpha, True)
+        chain_alpha.append(alpha)
+    chain_slots = share(nslot, chain_alpha, [sum(len(stage.stages) for stage in chain) for chain in chains])
+    for chain, chain_nslot in zip(chains, chain_slots):
+        part_slots = share(chain_nslot, [pow(stage.alpha, 0.5) for stage in chain], [len(stage.stages) for stage in chain])
+        for stage, part_nslot in zip(chain, part_slots):
+            stage.nslot = part_nslot
+
+
+def deal_slots(servers: ServerPool, budgets: List[int]) -> List[List[Tuple[int, int]]]:
+    '''
+    Lay the free slots of servers end to end and cut them in proportion to budgets
+    return: List[List[Tuple[int, int]]], per part the (server index, slots) of its share
+    '''
+    free = [server.available_slots for server in servers.servers]
+    total_free = sum(free)
+    total_budget = sum(budgets)
+    bounds = [0]
+    for budget in budgets:
+        bounds.append(bounds[-1] + budget)
+    bounds = [total_free * bound // total_budget for bound in bounds]
+
+    shares = []
+    i = 0
+    offset = 0      # first slot of server i
+    for k in range(len(budgets)):
+        lo, hi = bounds[k], bounds[k + 1]
+        while i < len(free) and offset + free[i] <= lo:
+            offset += free[i]
+            i += 1
+        part = []
+        j, start = i, offset
+        while j < len(free) and start < hi:
+            n = min(start + free[j], hi) - max(start, lo)
+            if n > 0:
+                part.append((j, n))
+            start += free[j]
+            j += 1
+        shares.append(part)
+    return shares
+
+
+def part_servers(servers: ServerPool, part_share: List[Tuple[int, int]]) -> List[Tuple[int, Optional[float], Optional[float]]]:
+    '''
+    return: (slots, memory, disk) of every server share of a part, memory and disk in
+            proportion to the slots of the share
+    '''
+    result = []
+    for i, n in part_share:
+        slots, memory, disk = servers.servers[i].free()
+        fraction = n / slots
+        result.append((n, None if memory is None else memory * fraction, None if disk is None else disk * fraction))
+    return result
+
+
+def plan_part(task: Tuple[Job, List[Tuple[int, Optional[float], Optional[float]]], Optional[float], Optional[int]]) -> Tuple[Dict[int, int], List[Tuple[int, int]], Dict[int, int], bool]:
+    '''
+    task: (part, (slots, memory, disk) of its servers, seconds left, iteration limit)
+    return: (nslot per stage, grouped edges, server index per placed stage, budget hit)
+    '''
+    sub, slots, seconds, iterations = task
+    budget = None
+    if seconds is not None or iterations is not None:
+        budget = Budget(seconds, iterations)
+    servers = ServerPool([Server(*free) for free in slots])
+    grouped = []
+    if sub.edges:
+        plan = AnytimePlan(sub, servers, Strategy.DITTO)
+        plan.refine(budget)
+        grouped = plan.grouped
+    else:
+        # a forest of single stages is one layer, split like the stages of a layer
+        nslots = share(sub.nslot, [stage.alpha for stage in sub.stages.values()], [1] * len(sub.stages))
+        for stage_id, nslot in zip(list(sub.stages.keys()), nslots):
+            sub.set_stage_nslot(stage_id, nslot)
+    dop = {stage_id: stage.nslot for stage_id, stage in sub.stages.items()}
+    placements = {stage_id: servers.position[id(server)] for stage_id, server in servers.stage_server.items()}
+    return dop, grouped, placements, budget is not None and budget.hit
+
+
+def decomposed_plan(job: Job, servers: List[Server], min_stages: int = 32, workers: int = 0, budget: Budget = None) -> float:
+    '''
+    Plan job like joint_optimization(job, servers, Strategy.DITTO), one part at a time.
+    min_stages: smallest part, a job smaller than twice this is planned whole
+    workers: size of the process pool, 0 to plan the parts in this process
+    return: float is the estimated JCT of the recombined plan, which is applied to job and servers
+    '''
+    if not isinstance(servers, ServerPool):
+        servers = ServerPool(servers)
+    if job.undo_log is None:
+        job.undo_log = servers.undo_log or UndoLog()
+    if servers.undo_log is None:
+        servers.undo_log = job.undo_log
+    log = job.undo_log
+
+    with instrumentation.phase("dop"):
+        chains = split_parts(job, min_stages)
+        parts = [part for chain in chains for part in chain]
+        subs, between = sub_jobs(job, parts)
+        virtual = []
+        k = 0
+        for chain in chains:
+            virtual.append([])
+            for part in chain:
+                alpha = merge_rates(subs[k], get_layers(subs[k]))[0][0]
+                virtual[-1].append(VirtualStage(alpha, 0, part))
+                k += 1
+        top_level_dop(job.nslot, virtual)
+        for sub, stage in zip(subs, [stage for chain in virtual for stage in chain]):
+            sub.nslot = stage.nslot
+    instrumentation.count("decompose.parts", len(parts))
+
+    shares = deal_slots(servers, [sub.nslot for sub in subs])
+    seconds = None
+    if budget is not None and budget.deadline is not None:
+        seconds = max(budget.deadline - time.perf_counter(), 0)
+    tasks = [(sub, part_servers(servers, part_share), seconds, None if budget is None else budget.iterations)
+             for sub, part_share in zip(subs, shares)]
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(plan_part, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    else:
+        results = [plan_part(task) for task in tasks]
+
+    with instrumentation.phase("placement"):
+        for (dop, grouped, placements, hit), part_share in zip(results, shares):
+            for stage_id, nslot in dop.items():
+                job.set_stage_nslot(stage_id, nslot)
+            for stage_id, k in placements.items():
+                servers.reserve(servers.servers[part_share[k][0]], (stage_id, job.stages[stage_id]))
+            for edge in grouped:
+                job.set_edge_weight(edge, 0)
+            if hit:
+                budget.hit = True
+
+        # recombine: group the edges between parts whose stages can share a server
+        for edge in sorted(between, key=lambda edge: job.edges[edge], reverse=True):
+            if job.edges[edge] == 0:
+                continue
+            start, end = servers.locate(edge[0]), servers.locate(edge[1])
+            if start is not None and end is not None and start is not end:
+                continue
+            mark = log.checkpoint()
+            job.set_edge_weight(edge, 0)
+            if place(servers, job, edge):
+                log.commit(mark)
+            else:
+                log.rollback(mark)
+    return estimate_jct(job)
+
+
+def decompose_planner(min_stages: int, workers: int):
+    '''
+    return: a planner for plan_isolated, decomposed_plan for DITTO and joint_optimization otherwise
+    '''
+    def planner(job: Job, servers: ServerPool, strategy: Strategy, budget: Budget = None) -> float:
+        if strategy != Strategy.DITTO:
+            return joint_optimization(job, servers, strategy, budget)
+        return decomposed_plan(job, servers, min_stages, workers, budget)
+    return planner
@@ -0,0 +1,139 @@
+'''
+DoP sweep: the JCT-vs-slots curve of a job.
+
+bottom_up_dop splits job.nslot slots over the stages one layer at a time, rounds the shares
+down and hands the slots left to the critical path. The sweep runs the split for a whole
+array of budgets at once (continuous_dop over an array, the same operations as for one
+budget), rounds down with NumPy and hands the slots left of every budget out with the
+PathSlots of bottom_up_dop, built once for the job; budgets whose minimums take too many
+slots are rounded by round_dops (compact_job.py) like bottom_up_dop does. So every budget
+gets the DoP the planner would give it. The JCT of every budget is the longest path
+(alpha / nslot + beta per stage, plus edge weights), relaxed in topological order with
+NumPy operations over the budgets.
+
+    sweep = dop_sweep(job, np.arange(10, 501))
+    sweep.knee, sweep.frontier, sweep.cheapest(max_jct=150)
+
+Needs NumPy.
+'''
+
+import numpy as np
+from typing import Optional
+from bottom_up_dop import PathSlots, continuous_dop
+from compact_job import round_dops
+from critical_path import relaxation_order
+from job import *
+
+def split_slots(job: Job, budgets: np.ndarray) -> Dict[int, np.ndarray]:
+    '''
+    return: Dict[int, np.ndarray], the nslot bottom_up_dop gives every stage for each budget,
+            0 for budgets below one slot per stage
+    '''
+    ids = list(job.stages.keys())
+    alphas = np.array([job.stages[v].alpha for v in ids], dtype=float)
+    enough = budgets >= len(ids)
+    split = continuous_dop(job, budgets[enough])
+    shares = np.stack([split[v] for v in ids], axis=1).reshape(int(enough.sum()), len(ids))
+    rounded = np.maximum(1, shares.astype(np.int64))
+    left = budgets[enough] - rounded.sum(axis=1)
+    over = left < 0
+    if over.any():
+        rounded[over] = round_dops(alphas, shares[over], budgets[enough][over])
+    if (left > 0).any():
+        paths = PathSlots(job)
+        for row in np.nonzero(left > 0)[0].tolist():
+            nslot = rounded[row].tolist()
+            paths.deal(nslot, int(left[row]))
+            rounded[row] = nslot
+    dop = np.zeros((len(budgets), len(ids)), dtype=np.int64)
+    dop[enough] = rounded
+    return {v: dop[:, k] for k, v in enumerate(ids)}
+
+
+def longest_paths(job: Job, dop: Dict[int, np.ndarray]) -> np.ndarray:
+    '''
+    return: np.ndarray, the critical path length for each budget (inf where a stage got no slot)
+    '''
+    stages = job.stages
+    edges = job.edges
+    distance = {}
+    jct = None
+    with np.errstate(divide="ignore"):
+        for edge, node, ready in relaxation_order(stages, edges):
+            if edge is not None:
+                arrival = distance[edge[0]] + edges[edge]
+                if node in distance:
+                    np.maximum(distance[node], arrival, out=distance[node])
+                else:
+                    distance[node] = arrival
+            if ready:
+                cost = stages[node].alpha / dop[node] + stages[node].beta
+                distance[node] = cost if edge is None else distance[node] + cost
+                jct = distance[node] if jct is None else np.maximum(jct, distance[node])
+    return jct
+
+
+def pareto_frontier(slots: np.ndarray, jct: np.ndarray) -> np.ndarray:
+    '''
+    return: np.ndarray, indices of the points no other point beats on both slots and JCT,
+            by ascending slots
+    '''
+    order = np.lexsort((jct, slots))
+    best = np.minimum.accumulate(jct[order])
+    improves = np.ones(len(order), dtype=bool)
+    improves[1:] = best[1:] < best[:-1]
+    frontier = order[improves & np.isfinite(jct[order])]
+    return frontier
+
+
+def knee_point(slots: np.ndarray, jct: np.ndarray, frontier: np.ndarray) -> Optional[int]:
+    '''
+    return: the index of the frontier point farthest from the chord between its two ends,
+            both axes scaled to [0, 1]; None for an empty frontier
+    '''
+    if len(frontier) == 0:
+        return None
+    x = slots[frontier].astype(float)
+    y = jct[frontier]
+    x = (x - x[0]) / max(x[-1] - x[0], 1e-12)
+    y = (y - y[-1]) / max(y[0] - y[-1], 1e-12)
+    # the chord runs from (0, 1) to (1, 0)
+    return int(frontier[np.argmax(1 - x - y)])
+
+
+class DopSweep:
+    def __init__(self, budgets: np.ndarray, slots: np.ndarray, jct: np.ndarray) -> None:
+        '''
+        budgets: np.ndarray are the swept job.nslot values, ascending
+        slots: np.ndarray are the slots used for each budget
+        jct: np.ndarray is the JCT for each budget
+        '''
+        self.budgets = budgets
+        self.slots = slots
+        self.jct = jct
+        self.frontier = pareto_frontier(slots, jct)
+        self.knee = knee_point(slots, jct, self.frontier)
+
+    def cheapest(self, max_jct: float) -> Optional[int]:
+        '''
+        return: the smallest budget with a JCT of at most max_jct, None if there is none
+        '''
+        fits = np.nonzero(self.jct[self.frontier] <= max_jct)[0]
+        if len(fits) == 0:
+            return None
+        return int(self.budgets[self.frontier[fits[0]]])
+
+
+def dop_sweep(job: Job, budgets: np.ndarray, chunk: int = 1024) -> DopSweep:
+    '''
+    The bottom_up_dop JCT of job for every budget, computed chunk budgets at a time
+    '''
+    budgets = np.unique(np.asarray(budgets, dtype=np.int64))
+    slots = np.empty(len(budgets), dtype=np.int64)
+    jct = np.empty(len(budgets))
+    for start in range(0, len(budgets), chunk):
+        part = budgets[start:start + chunk]
+        dop = split_slots(job, part)
+        slots[start:start + chunk] = sum(dop.values())
+        jct[start:start + chunk] = longest_paths(job, dop)
+    return DopSweep(budgets, slots, jct)
@@ -0,0 +1,166 @@
+'''
+Alpha/beta fitting from stage execution logs.
+
+A stage run with DoP n takes alpha / n + beta (see job.stage_costs). Every execution record
+(job, stage, dop, duration) is a point (1 / dop, duration) on that line, so alpha and beta
+of a stage are the least squares fit of its points. The fit only needs five sums per
+stage (count, x, y, x^2, xy); they are accumulated chunk by chunk with np.bincount, so the
+logs are streamed once and memory is bounded by the number of stages. All stages are then
+solved at once.
+
+A stage seen at one DoP only cannot separate alpha from beta: its beta stays as in the
+DAG file and alpha is fitted alone. Fits are kept non-negative the same way, by fitting
+the other parameter alone.
+
+Logs are CSV with a header naming the columns job, stage, dop and duration (in any order)
+or NDJSON with one {"job", "stage", "dop", "duration"} object per line.
+
+    python3 ./src/ fit queries/dags.json runs.csv more_runs.ndjson -o queries/fitted.json
+
+Needs NumPy.
+'''
+
+import csv
+import json
+import numpy as np
+from itertools import chain
+from workload import iter_job_records
+from typing import Dict, Iterator, List, Tuple
+
+CHUNK = 1 << 16
+COLUMNS = ["job", "stage", "dop", "duration"]
+
+def read_chunks(path: str, chunk: int = CHUNK) -> Iterator[Tuple[List[Tuple[str, str]], np.ndarray, np.ndarray]]:
+    '''
+    yield : ((job, stage) keys, DoPs, durations) of up to chunk records at a time
+    '''
+    with open(path, "r", newline="") as f:
+        first = f.readline()
+        if first.lstrip().startswith("{"):
+            rows = (json.loads(line) for line in chain([first], f) if line.strip())
+            records = ((row["job"], row["stage"], row["dop"], row["duration"]) for row in rows)
+        else:
+            header = next(csv.reader([first]))
+            missing = [column for column in COLUMNS if column not in header]
+            if missing:
+                raise Exception(f"Columns {missing} missing from the header of {path}")
+            columns = [header.index(column) for column in COLUMNS]
+            records = ((row[columns[0]], row[columns[1]], row[columns[2]], row[columns[3]]) for row in csv.reader(f) if row)
+
+        keys, dops, durations = [], [], []
+        for job, stage, dop, duration in records:
+            keys.append((job, stage))
+            dops.append(dop)
+            durations.append(duration)
+            if len(keys) == chunk:
+                yield chunk_arrays(path, keys, dops, durations)
+                keys, dops, durations = [], [], []
+        if keys:
+            yield chunk_arrays(path, keys, dops, durations)
+
+
+def chunk_arrays(path: str, keys: List[Tuple[str, str]], dops: List, durations: List) -> Tuple[List[Tuple[str, str]], np.ndarray, np.ndarray]:
+    dop = np.asarray(dops, dtype=np.float64)
+    duration = np.asarray(durations, dtype=np.float64)
+    if (dop <= 0).any() or (duration < 0).any() or not np.isfinite(duration).all():
+        raise Exception(f"Records in {path} need a DoP above 0 and a finite duration of at least 0")
+    return keys, dop, duration
+
+
+class ProfileFit:
+    def __init__(self) -> None:
+        self.index: Dict[Tuple[str, str], int] = {}     # (job, stage) -> row of the sums
+        self.sums = np.zeros((5, 0))                      # count, x, y, xx, xy of every stage
+        self.records = 0
+
+    def add(self, keys: List[Tuple[str, str]], dop: np.ndarray, duration: np.ndarray) -> None:
+        index = self.index
+        rows = np.fromiter((index.setdefault(key, len(index)) for key in keys), dtype=np.int64, count=len(keys))
+        if len(index) > self.sums.shape[1]:
+            sums = np.zeros((5, max(len(index), 2 * self.sums.shape[1])))
+            sums[:, :self.sums.shape[1]] = self.sums
+            self.sums = sums
+        x = 1 / dop
+        size = self.sums.shape[1]
+        for k, weights in enumerate([None, x, duration, x * x, x * duration]):
+            self.sums[k] += np.bincount(rows, weights=weights, minlength=size)
+        self.records += len(keys)
+
+    def add_file(self, path: str, chunk: int = CHUNK) -> None:
+        for keys, dop, duration in read_chunks(path, chunk):
+            self.add(keys, dop, duration)
+
+    def fit(self, prior_beta: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        prior_beta: np.ndarray is the beta of every stage before fitting, in index order
+        return: (alpha, beta) of every stage, in index order
+        '''
+        n, sx, sy, sxx, sxy = self.sums[:, :len(self.index)]
+        det = n * sxx - sx * sx
+        # one DoP only (or rounding noise): no slope to fit, keep beta
+        solvable = det > 1e-12 * np.maximum(n * sxx, 1e-300)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            alpha = np.where(solvable, (n * sxy - sx * sy) / det, (sxy - prior_beta * sx) / sxx)
+            beta = np.where(solvable, (sy - alpha * sx) / n, prior_beta)
+
+            # non-negative: a negative parameter is 0 and the other one is fitted alone
+            negative_beta = beta < 0
+            alpha = np.where(negative_beta, sxy / sxx, alpha)
+            beta = np.where(negative_beta, 0.0, beta)
+            negative_alpha = alpha < 0
+            beta = np.where(negative_alpha, sy / n, beta)
+            alpha = np.where(negative_alpha, 0.0, alpha)
+        return alpha, beta
+
+
+def fit_workload(source: str, logs: List[str], output: str, chunk: int = CHUNK) -> Dict[str, int]:
+    '''
+    Fit alpha and beta of the stages of the DAG file source from the execution logs and
+    write the DAG file with the fitted values to output (NDJSON for a .ndjson output, a
+    JSON array otherwise). Stages without records keep their values.
+    return: {"records", "stages_fitted", "stages_kept", "unknown_stages"}
+    '''
+    profile = ProfileFit()
+    for path in logs:
+        profile.add_file(path, chunk)
+
+    # beta of the DAG file, for the stages seen at one DoP only
+    prior_beta = np.zeros(len(profile.index))
+    with open(source, "r") as f:
+        for record in iter_job_records(f):
+            for stage in record["stages"]:
+                row = profile.index.get((record["name"], stage["name"]))
+                if row is not None:
+                    prior_beta[row] = stage["beta"]
+    alpha, beta = profile.fit(prior_beta)
+
+    fitted = 0
+    kept = 0
+    matched = np.zeros(len(profile.index), dtype=bool)
+    ndjson = output.endswith(".ndjson")
+    with open(source, "r") as f, open(output, "w") as out:
+        if not ndjson:
+            out.write("[\n")
+        for i, record in enumerate(iter_job_records(f)):
+            for stage in record["stages"]:
+                row = profile.index.get((record["name"], stage["name"]))
+                if row is None:
+                    kept += 1
+                    continue
+                stage["alpha"] = float(alpha[row])
+                stage["beta"] = float(beta[row])
+                matched[row] = True
+                fitted += 1
+            if ndjson:
+                out.write(json.dumps(record) + "\n")
+            else:
+                out.write((",\n" if i > 0 else "") + json.dumps(record, indent=4))
+        if not ndjson:
+            out.write("\n]\n")
+
+    return {
+        "records": profile.records,
+        "stages_fitted": fitted,
+        "stages_kept": kept,
+        "unknown_stages": int((~matched).sum()),
+    }
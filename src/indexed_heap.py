@@ -0,0 +1,112 @@
+from typing import Dict, Hashable, Iterator, List, Tuple
+from heapq import heappush, heappop
+
+'''
+Indexed binary max-heap.
+
+Every key has one priority and a known slot in the heap, so the priority of a key can be
+raised or lowered in place (increase-key / decrease-key) in O(log n). Equal priorities keep
+insertion order. Iterating yields the keys by descending priority without changing the
+heap, in O(k log k) for the first k keys, so a caller can stop early.
+'''
+
+class IndexedHeap:
+    def __init__(self, items: List[Tuple[Hashable, float]] = ()) -> None:
+        '''
+        items: (key, priority) pairs, heapified in O(n)
+        '''
+        # entries are [-priority, insertion number, key], smallest first
+        self.entries: List[list] = [[-priority, i, key] for i, (key, priority) in enumerate(items)]
+        self.position: Dict[Hashable, int] = {}
+        self.counter = len(self.entries)
+        for i in range(len(self.entries) // 2 - 1, -1, -1):
+            self.sift_down(i)
+        for i, entry in enumerate(self.entries):
+            self.position[entry[2]] = i
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.position
+
+    def priority(self, key: Hashable) -> float:
+        return -self.entries[self.position[key]][0]
+
+    def peek(self) -> Tuple[Hashable, float]:
+        return self.entries[0][2], -self.entries[0][0]
+
+    def push(self, key: Hashable, priority: float) -> None:
+        if key in self.position:
+            raise Exception(f"Key {key} is already in the heap")
+        self.entries.append([-priority, self.counter, key])
+        self.counter += 1
+        self.position[key] = len(self.entries) - 1
+        self.sift_up(len(self.entries) - 1)
+
+    def pop(self) -> Tuple[Hashable, float]:
+        key, priority = self.peek()
+        self.remove(key)
+        return key, priority
+
+    def remove(self, key: Hashable) -> None:
+        i = self.position.pop(key)
+        last = self.entries.pop()
+        if i < len(self.entries):
+            self.entries[i] = last
+            self.position[last[2]] = i
+            self.sift_down(i)
+            self.sift_up(self.position[last[2]])
+
+    def update(self, key: Hashable, priority: float) -> None:
+        '''
+        Change the priority of key, moving it up or down the heap
+        '''
+        i = self.position[key]
+        old = self.entries[i][0]
+        self.entries[i][0] = -priority
+        if -priority < old:
+            self.sift_up(i)
+        else:
+            self.sift_down(i)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        # the heap order is a tree: expand it from the root, best entry first
+        frontier = []
+        if self.entries:
+            frontier.append((self.entries[0][0], self.entries[0][1], 0))
+        while frontier:
+            _, _, i = heappop(frontier)
+            yield self.entries[i][2]
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.entries):
+                    heappush(frontier, (self.entries[child][0], self.entries[child][1], child))
+
+    def less(self, i: int, j: int) -> bool:
+        return self.entries[i][0] < self.entries[j][0] or \
+            (self.entries[i][0] == self.entries[j][0] and self.entries[i][1] < self.entries[j][1])
+
+    def swap(self, i: int, j: int) -> None:
+        self.entries[i], self.entries[j] = self.entries[j], self.entries[i]
+        self.position[self.entries[i][2]] = i
+        self.position[self.entries[j][2]] = j
+
+    def sift_up(self, i: int) -> None:
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self.less(i, parent):
+                break
+            self.swap(i, parent)
+            i = parent
+
+    def sift_down(self, i: int) -> None:
+        n = len(self.entries)
+        while True:
+            best = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self.less(child, best):
+                    best = child
+            if best == i:
+                break
+            self.swap(i, best)
+            i = best
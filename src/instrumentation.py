@@ -0,0 +1,130 @@
+'''
+Planner instrumentation: counters, phase timers and callbacks.
+
+Nothing is recorded until a Recorder is enabled. The hooks in the planner go through
+count() and phase(), which only look up the module level recorder when it is None, so a
+disabled hook costs one function call.
+
+Phases nest: a phase started inside another one is timed as "outer;inner", the stack
+format of flamegraph.pl (see Recorder.folded).
+
+Counters
+    ditto.iterations            outer iterations of the DITTO plan
+    ditto.budget_hit            plans stopped by their Budget
+    grouping.trials             edges tried for grouping
+    grouping.rollbacks          trial groupings undone because place failed
+    greedy_group.grouped        edges zeroed by greedy_group
+    place.attempts, place.failed
+    beam.levels, beam.states    levels and new plans of a beam search
+    decompose.parts             parts of a decomposed plan
+    dop.walked                  stages and edges walked finding critical paths for the DoP
+    critical_path.builds        critical path rebuilt from the edge set
+    critical_path.recomputes    every distance recomputed
+    critical_path.updates       incremental updates from dirty stages
+    critical_path.relaxed       stages relaxed by incremental updates
+    replan.moved                stages displaced by a pool change and placed again
+    replan.ungrouped, replan.shrunk, replan.grown
+Phases
+    dop, grouping, placement, jct, replan
+'''
+
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List
+
+class Recorder:
+    def __init__(self) -> None:
+        self.counters: Dict[str, int] = defaultdict(int)
+        # phase stack "a;b" -> total seconds / number of calls
+        self.timers: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.stack: List[str] = []
+        self.callbacks: Dict[str, List[Callable]] = defaultdict(list)
+
+    def on(self, event: str, callback: Callable[[str, float], None]) -> None:
+        '''
+        Call callback(event, value) on every count of a counter (value is the increment)
+        and at the end of every run of a phase (value is the elapsed seconds).
+        '''
+        self.callbacks[event].append(callback)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+        if name in self.callbacks:
+            for callback in self.callbacks[name]:
+                callback(name, n)
+
+    @contextmanager
+    def phase(self, name: str):
+        self.stack.append(name)
+        key = ";".join(self.stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            self.timers[key] += elapsed
+            self.calls[key] += 1
+            if name in self.callbacks:
+                for callback in self.callbacks[name]:
+                    callback(name, elapsed)
+
+    def merge(self, other: "Recorder") -> None:
+        for name, n in other.counters.items():
+            self.counters[name] += n
+        for key, seconds in other.timers.items():
+            self.timers[key] += seconds
+            self.calls[key] += other.calls[key]
+
+    def trace(self) -> Dict:
+        '''
+        return: JSON-ready counters and phases ({stack: {"seconds", "calls"}})
+        '''
+        return {
+            "counters": dict(self.counters),
+            "phases": {key: {"seconds": self.timers[key], "calls": self.calls[key]} for key in self.timers.keys()},
+        }
+
+    def folded(self) -> List[str]:
+        '''
+        return: List[str] of "stack microseconds" lines with the self time of every phase
+                stack, the input format of flamegraph.pl
+        '''
+        self_time = dict(self.timers)
+        for key, seconds in self.timers.items():
+            parent = key.rpartition(";")[0]
+            if parent in self_time:
+                self_time[parent] -= seconds
+        return [f"{key} {max(round(seconds * 1e6), 0)}" for key, seconds in self_time.items()]
+
+
+# the enabled Recorder, None when instrumentation is off
+recorder: Recorder = None
+NO_PHASE = nullcontext()
+
+def enable(new_recorder: Recorder = None) -> Recorder:
+    global recorder
+    recorder = new_recorder or Recorder()
+    return recorder
+
+
+def disable() -> Recorder:
+    '''
+    return: the Recorder that was enabled
+    '''
+    global recorder
+    old, recorder = recorder, None
+    return old
+
+
+def count(name: str, n: int = 1) -> None:
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def phase(name: str):
+    if recorder is None:
+        return NO_PHASE
+    return recorder.phase(name)
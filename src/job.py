@@ -1,15 +1,78 @@
 from typing import List, Tuple, Dict
 
+class NotEnoughSlots(Exception):
+    '''
+    The DoP budget cannot give every stage its minimum number of slots
+    '''
+
 class Stage:
-    def __init__(self, alpha: float, beta: float, nslot: int = 0) -> None:
+    __slots__ = ("alpha", "beta", "nslot", "memory", "disk")
+
+    def __init__(self, alpha: float, beta: float, nslot: int = 0, memory: float = 0, disk: float = 0) -> None:
         self.alpha = alpha  # This implementation splits A[s] here
         self.beta = beta
         self.nslot = nslot  # This is Dop
+        self.memory = memory    # memory and scratch disk held on its server, whatever the DoP
+        self.disk = disk
+
+    def copy(self):
+        return Stage(self.alpha, self.beta, self.nslot, self.memory, self.disk)
 
 class VirtualStage(Stage):
-    def __init__(self, alpha: float, beta: float) -> None:
+    '''
+    A subgraph of a job merged into one stage (see decompose.py): alpha is the merged
+    alpha of the subgraph and nslot the DoP budget of all of its stages.
+    '''
+    __slots__ = ("stages",)
+
+    def __init__(self, alpha: float, beta: float, stages: List[int] = None) -> None:
         super().__init__(alpha, beta)
-        # TODO: Add more fields
+        self.stages = stages or []  # ids of the merged stages
+
+    def copy(self):
+        stage = VirtualStage(self.alpha, self.beta, list(self.stages))
+        stage.nslot, stage.memory, stage.disk = self.nslot, self.memory, self.disk
+        return stage
+
+class UndoLog:
+    '''
+    Undo records shared by a Job and its ServerPool. Every change made through
+    Job.set_edge_weight, Job.set_stage_nslot, ServerPool.reserve and
+    ServerPool.release records how to revert it, so a trial can be rolled
+    back in O(changes) instead of copying the job and the servers.
+
+        mark = log.checkpoint()
+        ... try something ...
+        log.rollback(mark)  # or log.commit(mark) to keep it
+    '''
+    def __init__(self) -> None:
+        self.records = []
+        self.depth = 0          # number of open checkpoints
+        self.replaying = False
+
+    def record(self, undo, *args) -> None:
+        if self.depth and not self.replaying:
+            self.records.append((undo, args))
+
+    def checkpoint(self) -> int:
+        self.depth += 1
+        return len(self.records)
+
+    def rollback(self, mark: int) -> None:
+        self.depth -= 1
+        self.replaying = True
+        try:
+            while len(self.records) > mark:
+                undo, args = self.records.pop()
+                undo(*args)
+        finally:
+            self.replaying = False
+
+    def commit(self, mark: int) -> None:
+        # an enclosing checkpoint may still roll these changes back
+        self.depth -= 1
+        if self.depth == 0:
+            self.records.clear()
 
 class Job:
     def __init__(self, stages: Dict[int, Stage], edges: Dict[Tuple[int, int], float], nslot: int) -> None:
@@ -24,6 +87,63 @@ class Job:
         self.stages = stages    # This is V
         self.edges = edges      # This is E
         self.nslot = nslot      # This is Dop
+        self.critical_path = None   # CriticalPath kept up to date by the setters below
+        self.layers = None          # stages grouped by depth, see bottom_up_dop.get_layers
+        self.layers_key = None      # (#stages, edge_version) the layers were computed for
+        self.edge_version = 0       # bumped by add_edge and remove_edge
+        self.undo_log = None        # UndoLog recording the setters below, if any
+        self.volumes = None         # bytes shuffled over every edge, if known
+        self.shuffle_cost = None    # ShuffleCost pricing the edges, see shuffle_cost.py
+
+    def set_edge_weight(self, edge: Tuple[int, int], weight: float) -> None:
+        if self.undo_log is not None:
+            self.undo_log.record(self.set_edge_weight, edge, self.edges[edge])
+        self.edges[edge] = weight
+        if self.shuffle_cost is not None:
+            self.shuffle_cost.edge_changed(edge)
+        if self.critical_path is not None:
+            self.critical_path.edge_changed(edge)
+
+    def add_edge(self, edge: Tuple[int, int], weight: float) -> None:
+        if self.undo_log is not None:
+            self.undo_log.record(self.remove_edge, edge)
+        self.edges[edge] = weight
+        self.edge_version += 1
+        if self.critical_path is not None:
+            self.critical_path.invalidate()
+
+    def remove_edge(self, edge: Tuple[int, int]) -> None:
+        if self.undo_log is not None:
+            self.undo_log.record(self.add_edge, edge, self.edges[edge])
+        del self.edges[edge]
+        self.edge_version += 1
+        if self.critical_path is not None:
+            self.critical_path.invalidate()
+
+    def set_stage_nslot(self, id: int, nslot: int) -> None:
+        if self.undo_log is not None:
+            self.undo_log.record(self.set_stage_nslot, id, self.stages[id].nslot)
+        self.stages[id].nslot = nslot
+        if self.critical_path is not None:
+            self.critical_path.stage_changed(id)
 
     def copy(self):
-        return Job(self.stages.copy(), self.edges.copy(), self.nslot)
+        stages = {id: stage.copy() for id, stage in self.stages.items()}
+        return self.copy_caches(Job(stages, self.edges.copy(), self.nslot))
+
+    def copy_caches(self, job):
+        if self.critical_path is not None:
+            job.critical_path = self.critical_path.copy(job)
+        job.layers, job.layers_key, job.edge_version = self.layers, self.layers_key, self.edge_version
+        job.volumes = self.volumes
+        return job
+
+
+def stage_costs(stages: Dict[int, Stage]) -> Dict[int, float]:
+    '''
+    Node cost alpha / nslot + beta of every stage
+    '''
+    costs = getattr(stages, "costs", None)
+    if costs is not None:
+        return costs()
+    return {id: stage.alpha / stage.nslot + stage.beta for id, stage in stages.items()}
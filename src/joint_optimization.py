@@ -24,16 +24,21 @@ order are computed based on the cost model, as described in § 4.2
 and § 4.3, respectively.
 '''
 
+import time
+import instrumentation
 from job import *
-from bottom_up_dop import bottom_up_dop
-from server import Server
-from typing import List, Set
+from bottom_up_dop import bottom_up_dop, round_dop
+from server import Server, ServerPool
+from critical_path import get_critical_path, relaxation_order, trace_path
+from indexed_heap import IndexedHeap
+from typing import Iterator, List, Set
 from enum import Enum
 
 class Strategy(Enum):
     DITTO = 0,
     AVERAGE = 1,
-    RATIO = 2
+    RATIO = 2,
+    DITTO_COST = 3      # DITTO with the greedy grouping order of the cost objective
 
 '''
 Let V be the set of all stages and E be the set of all data dependencies in the DAG.
@@ -64,87 +69,264 @@ function JOINT_ITERATIVE_OPTIMIZATION(V, E, R)
 21: break
 '''
 
-def joint_optimization(job: Job, servers: List[Server], strategy: Strategy) -> float:
+class Budget:
+    '''
+    Limit on one round of planning: wall clock seconds from now and/or DITTO iterations,
+    None for no limit. hit is set once the budget stopped a planner.
+    '''
+    def __init__(self, seconds: float = None, iterations: int = None) -> None:
+        self.deadline = None if seconds is None else time.perf_counter() + seconds
+        self.iterations = iterations
+        self.hit = False
+
+    def expired(self) -> bool:
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.hit = True
+        return self.hit
+
+    def spent(self, iterations: int) -> bool:
+        '''
+        iterations: int is the number of iterations run under this budget so far
+        '''
+        if self.iterations is not None and iterations >= self.iterations:
+            self.hit = True
+        return self.expired()
+
+
+class AnytimePlan:
+    '''
+    joint_optimization that stops when a Budget is spent and can be resumed with refine.
+
+    Between calls the job and the servers hold a valid plan: the budget is only checked
+    once a trial grouping has been kept (placed) or rolled back. Grouping only zeroes edge
+    weights, so the plan held is the best one found so far. Resuming needs the job and
+    the servers as the last call left them (no rollback in between).
+    '''
+    def __init__(self, job: Job, servers: List[Server], strategy: Strategy) -> None:
+        '''
+        job: Job is the job to be scheduled
+        servers: List[Server] or ServerPool, stages are placed into these servers
+        '''
+        if not isinstance(servers, ServerPool):
+            servers = ServerPool(servers)
+
+        # trial groupings are reverted through the undo log instead of copies
+        if job.undo_log is None:
+            job.undo_log = servers.undo_log or UndoLog()
+        if servers.undo_log is None:
+            servers.undo_log = job.undo_log
+
+        self.job = job
+        self.servers = servers
+        self.strategy = strategy
+        self.started = False
+        self.converged = False
+        self.iterations = 0     # DITTO iterations over all calls
+        self.grouped: List[Tuple[int, int]] = []    # edges grouped by DITTO, in order
+        self.order: IndexedHeap = None      # cost order of the edges for DITTO_COST, see cost_order
+        self.parked: Dict[int, List[Tuple[int, int]]] = {}     # stage -> edges parked by park()
+
+    def refine(self, budget: Budget = None) -> float:
+        '''
+        Keep planning until the plan converges or budget is spent.
+        return: float is the total execution time of the plan held
+        '''
+        if not self.converged:
+            self.plan(budget)
+        if budget is not None and budget.hit:
+            instrumentation.count("ditto.budget_hit")
+        return estimate_jct(self.job)
+
+    def plan(self, budget: Budget) -> None:
+        job = self.job
+        servers = self.servers
+        strategy = self.strategy
+        log = job.undo_log
+
+        if strategy == Strategy.DITTO or strategy == Strategy.DITTO_COST:
+
+            if not self.started:
+                # Initialize 𝐷𝑜𝑃 and update the parameters (𝐴, 𝜔) based on 𝐷𝑜𝑃
+                with instrumentation.phase("dop"):
+                    bottom_up_dop(job)
+                if strategy == Strategy.DITTO_COST:
+                    self.order = cost_order(job)
+                self.started = True
+
+            # E𝑔 and E𝑢 store grouped and ungrouped edges, respectively
+            Eg = None
+            Eu = list(job.edges.keys())
+            # stage_ids = list(job.stages.keys())
+            # grouped_stages = [[id] for id in stage_ids]
+
+            first_iteration = self.iterations
+            while Eu:
+                if budget is not None and budget.spent(self.iterations - first_iteration):
+                    return
+                self.iterations += 1
+                instrumentation.count("ditto.iterations")
+
+                # Sort E𝑢 in greedy grouping order mentioned in § 4.3
+                with instrumentation.phase("grouping"):
+                    if self.order is None:
+                        mark = log.checkpoint()
+                        Eu = greedy_group(job, budget)
+                        log.rollback(mark)
+                    else:
+                        Eu = self.candidates()
+                if budget is not None and budget.hit:
+                    return
+                grouped = False
+
+                with instrumentation.phase("placement"):
+                    for edge in Eu:
+                        # Try grouping 𝑠𝑖 and 𝑠𝑗
+                        tmp = job.edges[edge]
+                        if tmp == 0: break
+                        if budget is not None and budget.expired():
+                            return
+
+                        instrumentation.count("grouping.trials")
+                        mark = log.checkpoint()
+                        job.set_edge_weight(edge, 0)
+                        Eg = edge
+                        # si = edge[0]
+                        # sj = edge[1]
+
+                        # Update Dop ???
+                        # new_grouped_stages = grouped_stages.copy()
+                        # for grouped_stage in new_grouped_stages:
+                        # pass
+
+                        # place check if current grouped_stages can be placed into the server list
+                        # can put them into the server if possible
+                        if place(servers, job, Eg):
+                            log.commit(mark)
+                            self.grouped.append(edge)
+                            if self.order is None:
+                                Eu.remove(edge)
+                            else:
+                                self.group(edge)
+                            grouped = True
+                            break
+                        else:
+                            # Undo grouping 𝑠𝑖 and 𝑠𝑗, and restore 𝐷𝑜𝑃
+                            # Undo line 11 and 12
+                            instrumentation.count("grouping.rollbacks")
+                            log.rollback(mark)
+                            Eg = None
+                            if self.order is not None:
+                                self.park(edge)
+
+                # if No edge in E𝑢 is grouped in the above loop then break
+                if not grouped:
+                    break
+
+        elif strategy == Strategy.AVERAGE:
+
+            # All stages have the same Dop
+            set_exact_dop(job, [job.nslot / len(job.stages)] * len(job.stages))
+            with instrumentation.phase("placement"):
+                for id, stage in job.stages.items():
+                    # Place each stage into the best fitting available server
+                    servers.place((id, stage))
+
+        elif strategy == Strategy.RATIO:
+
+            # Compute k, which is the propotion
+            total_alpha = 0
+            for id, stage in job.stages.items():
+                total_alpha += stage.alpha
+
+            # Stage Dop is propotional to the stage alpha value
+            if total_alpha > 0:
+                set_exact_dop(job, [job.nslot * stage.alpha / total_alpha for stage in job.stages.values()])
+            else:
+                set_exact_dop(job, [job.nslot / len(job.stages)] * len(job.stages))
+            with instrumentation.phase("placement"):
+                for id, stage in job.stages.items():
+                    # Place each stage into the best fitting available server
+                    servers.place((id, stage))
+
+        self.converged = True
+
+    def candidates(self) -> Iterator[Tuple[int, int]]:
+        '''
+        Edges in the cost order: the first one again and again, until it is grouped or parked
+        '''
+        while len(self.order):
+            edge, weight = self.order.peek()
+            if weight <= 0:
+                return
+            yield edge
+
+    def group(self, edge: Tuple[int, int]) -> None:
+        # decrease-key: a grouped edge weighs 0
+        self.order.update(edge, 0)
+        for stage_id in edge:
+            for parked in self.parked.pop(stage_id, []):
+                if self.order.priority(parked) < 0:
+                    self.order.update(parked, cost_weight(self.job, parked))
+
+    def park(self, edge: Tuple[int, int]) -> None:
+        '''
+        Take an edge that failed to place out of the order until a grouping touches one of
+        its stages: servers only fill up while planning, so until one of its stages gets
+        placed, placing it fails again.
+        '''
+        self.order.update(edge, -1)
+        for stage_id in edge:
+            self.parked.setdefault(stage_id, []).append(edge)
+
+
+def set_exact_dop(job: Job, shares: List[float]) -> None:
+    '''
+    Set the DoP of the stages (in job order) from their shares of job.nslot, rounded so
+    that the stages use exactly job.nslot slots
+    '''
+    stages = list(job.stages.items())
+    dop = round_dop([stage.alpha for _, stage in stages], shares, job.nslot, [1] * len(stages))
+    for (id, _), nslot in zip(stages, dop):
+        job.set_stage_nslot(id, nslot)
+
+
+def joint_optimization(job: Job, servers: List[Server], strategy: Strategy, budget: Budget = None) -> float:
     '''
     job: Job is the job to be scheduled
+    servers: List[Server] or ServerPool, stages are placed into these servers
+    budget: Budget stopping DITTO early with the best plan so far, if given (see AnytimePlan)
     return: float is the total execution time of the job
     '''
-    if strategy == Strategy.DITTO:
-
-        # Initialize 𝐷𝑜𝑃 and update the parameters (𝐴, 𝜔) based on 𝐷𝑜𝑃
-        bottom_up_dop(job)
-
-        # E𝑔 and E𝑢 store grouped and ungrouped edges, respectively
-        Eg = None
-        Eu = list(job.edges.keys())
-        # stage_ids = list(job.stages.keys())
-        # grouped_stages = [[id] for id in stage_ids]
-
-        while Eu:
-            # Sort E𝑢 in greedy grouping order mentioned in § 4.3
-            Eu = greedy_group(job.copy())
-            Eu_len = len(Eu)
-
-            for edge in Eu:
-                # Try grouping 𝑠𝑖 and 𝑠𝑗
-                tmp = job.edges[edge]
-                if tmp == 0: break
-
-                job.edges[edge] = 0
-                Eg = edge
-                # si = edge[0]
-                # sj = edge[1]
-
-                # Update Dop ???
-                # new_grouped_stages = grouped_stages.copy()
-                # for grouped_stage in new_grouped_stages:
-                # pass
-
-                # place check if current grouped_stages can be placed into the server list
-                # can put them into the server if possible
-                if place(servers, job, Eg):
-                    Eu.remove(edge)
-                    break
-                else:
-                    # Undo grouping 𝑠𝑖 and 𝑠𝑗, and restore 𝐷𝑜𝑃
-                    # Undo line 11 and 12
-                    job.edges[edge] = tmp
-                    Eg = None
-
-            # if No edge in E𝑢 is grouped in the above loop then break
-            if len(Eu) == Eu_len:
-                break
-
-    elif strategy == Strategy.AVERAGE:
-
-        # All stages have the same Dop
-        for id, stage in job.stages.items():
-            stage.nslot = round(job.nslot / len(list(job.stages.keys())))
-
-            # Randomly place each stage into available server
-            for server in servers:
-                if server.can_place((id, stage)):
-                    server.place((id, stage))
-
-    elif strategy == Strategy.RATIO:
-
-        # Compute k, which is the propotion
-        total_alpha = 0
-        for id, stage in job.stages.items():
-            total_alpha += stage.alpha
-
-        # Stage Dop is propotional to the stage alpha value
-        for id, stage in job.stages.items():
-            try:
-                stage.nslot = round(job.nslot * stage.alpha / total_alpha)
-            except ZeroDivisionError:
-                stage.nslot = 1
-
-            # Randomly place each stage into available server
-            for server in servers:
-                if server.can_place((id, stage)):
-                    server.place((id, stage))
+    return AnytimePlan(job, servers, strategy).refine(budget)
+
+
+def cost_weight(job: Job, edge: Tuple[int, int]) -> float:
+    '''
+    Edge weight for cost optimization, 𝑀(𝑠𝑖)𝑊(𝑠𝑖) + 𝑀(𝑠𝑗)𝑅(𝑠𝑗): the slots of each end times
+    its half of the transfer time
+    '''
+    return (job.stages[edge[0]].nslot + job.stages[edge[1]].nslot) * job.edges[edge] / 2
 
+
+def cost_order(job: Job) -> IndexedHeap:
+    '''
+    return: IndexedHeap of every edge by cost weight, the greedy grouping order for cost
+            (the edge with the largest weight first, ties in job order)
+    '''
+    return IndexedHeap([(edge, cost_weight(job, edge)) for edge in job.edges.keys()])
+
+
+def estimate_cost(job: Job) -> float:
+    '''
+    Cost of the plan: 𝑀(𝑠𝑖)𝐶(𝑠𝑖) of every stage plus the cost weight of every edge, with
+    the slots of a stage as 𝑀(𝑠𝑖)
+    '''
+    costs = stage_costs(job.stages)
+    return sum(stage.nslot * costs[id] for id, stage in job.stages.items()) + \
+        sum(cost_weight(job, edge) for edge in job.edges.keys())
+
+
+def estimate_jct(job: Job) -> float:
     '''
     For JCT optimization, the weight of node 𝑠𝑖 is 𝐶(𝑠𝑖), and the weight of (𝑠𝑖, 𝑠𝑗) is 𝑊 (𝑠𝑖) + 𝑅(𝑠𝑗).
     For cost optimization, the node weight is 𝑀(𝑠𝑖)𝐶(𝑠𝑖), and the edge weight is 𝑀(𝑠𝑖)𝑊 (𝑠𝑖) + 𝑀(𝑠𝑗)𝑅(𝑠𝑗). 
@@ -153,10 +335,17 @@ def joint_optimization(job: Job, servers: List[Server], strategy: Strategy) -> f
     total_execution_time = 0
 
     # Find current graph critical path to compute total time
-    critical_path_edge_attributes = longest_path_dag_with_weights_and_path(job.stages, job.edges)
+    with instrumentation.phase("jct"):
+        critical_path = get_critical_path(job)
+        critical_path_edge_attributes = critical_path.edge_attributes()
+
+    # a critical path of one stage has no edges
+    if not critical_path_edge_attributes:
+        stage = job.stages[critical_path.path()[0]]
+        return stage.alpha / stage.nslot + stage.beta
 
     for i in range(len(critical_path_edge_attributes)):
-        start_stage = job.stages[critical_path_edge_attributes[i][1]]
+        start_stage = job.stages[critical_path_edge_attributes[i][0]]
         end_stage = job.stages[critical_path_edge_attributes[i][1]]
         weight = critical_path_edge_attributes[i][2]
 
@@ -170,6 +359,34 @@ def joint_optimization(job: Job, servers: List[Server], strategy: Strategy) -> f
     return total_execution_time
 
 
+def plan_isolated(job: Job, servers: ServerPool, strategy: Strategy, cache = None, inspect = None, budget: Budget = None,
+                  planner = None) -> float:
+    '''
+    Plan the job with one strategy, then roll the job and the servers back
+    so the next strategy starts from the same state.
+    cache: PlanCache to answer repeated plans from, if given
+    inspect: called as inspect(job, servers) on the plan before it is rolled back, if given
+    budget: Budget for joint_optimization, if given
+    planner: called as planner(job, servers, strategy, budget) instead of joint_optimization,
+             if given (the cache is not used then)
+    '''
+    if job.undo_log is None:
+        job.undo_log = servers.undo_log = UndoLog()
+    mark = job.undo_log.checkpoint()
+    try:
+        if planner is not None:
+            jct = planner(job, servers, strategy, budget)
+        elif cache is not None:
+            jct = cache.plan(job, servers, strategy, budget)
+        else:
+            jct = joint_optimization(job, servers, strategy, budget)
+        if inspect is not None:
+            inspect(job, servers)
+        return jct
+    finally:
+        job.undo_log.rollback(mark)
+
+
 def build_group_stages(job : Job, Eg : List[Tuple[int, int]]) -> Set[Stage]:
     group_stages = set()
     for edge in Eg:
@@ -184,57 +401,44 @@ def build_group_stages(job : Job, Eg : List[Tuple[int, int]]) -> Set[Stage]:
     job: current job
     Eg: current grouped stages represented with edges
 '''
-def place(servers : List[Server], job : Job, Eg : Tuple[int, int]) -> bool:
-
-    # sort server based on the curret available slots:
-    sorted_servers = sorted(servers, key=lambda server: server.available_slots, reverse=True)
+def place(servers : ServerPool, job : Job, Eg : Tuple[int, int]) -> bool:
 
-    start_placed_server = -1
-    end_placed_server = -1
+    instrumentation.count("place.attempts")
     start_stage = job.stages[Eg[0]]
     end_stage = job.stages[Eg[1]]
 
     # Check if stage is placed somewhere in the server list
-    for i, server in enumerate(servers):
-        if Eg[0] in server.placed_stages:
-            start_placed_server = i
-        if Eg[1] in server.placed_stages:
-            end_placed_server = i
-
-    chosen_server = None
-    if start_placed_server >= 0 and end_placed_server >= 0:
+    start_placed_server = servers.locate(Eg[0])
+    end_placed_server = servers.locate(Eg[1])
+
+    if start_placed_server is not None and end_placed_server is not None:
         return True
 
-    elif start_placed_server < 0 and end_placed_server < 0:
+    elif start_placed_server is None and end_placed_server is None:
         total_slots_need = start_stage.nslot + end_stage.nslot
 
         # Place the group into the server with the nearest function slot number
-        for server in sorted_servers:
-            if server.available_slots >= total_slots_need:
-                chosen_server = server
-            else:
-                if chosen_server:
-                    chosen_server.available_slots -= total_slots_need
-                    chosen_server.placed_stages[Eg[0]] = start_stage
-                    chosen_server.placed_stages[Eg[1]] = end_stage
-
-    elif start_placed_server >= 0 and end_placed_server < 0:
-        total_slots_need = end_stage.nslot
-
-        if servers[start_placed_server].available_slots >= total_slots_need:
-            chosen_server = servers[start_placed_server]
-            chosen_server.available_slots -= total_slots_need
-            chosen_server.placed_stages[Eg[1]] = end_stage
+        # (that also has the memory and disk of both stages)
+        chosen_server = servers.best_fit(total_slots_need, start_stage.memory + end_stage.memory,
+                                         start_stage.disk + end_stage.disk)
+        if chosen_server is None:
+            instrumentation.count("place.failed")
+            return False
+        servers.reserve(chosen_server, (Eg[0], start_stage))
+        servers.reserve(chosen_server, (Eg[1], end_stage))
+
+    elif end_placed_server is None:
+        if not start_placed_server.can_place((Eg[1], end_stage)):
+            instrumentation.count("place.failed")
+            return False
+        servers.reserve(start_placed_server, (Eg[1], end_stage))
+
+    else:
+        if not end_placed_server.can_place((Eg[0], start_stage)):
+            instrumentation.count("place.failed")
+            return False
+        servers.reserve(end_placed_server, (Eg[0], start_stage))
 
-    elif start_placed_server < 0 and end_placed_server >= 0:
-        total_slots_need = start_stage.nslot
-
-        if servers[end_placed_server].available_slots >= total_slots_need:
-            chosen_server = servers[end_placed_server]
-            chosen_server.available_slots -= total_slots_need
-            chosen_server.placed_stages[Eg[0]] = start_stage
-
-    if not chosen_server: return False
     return True
 
 
@@ -254,31 +458,38 @@ function GREEDY_GROUP(V, E, R, 𝑜𝑏 𝑗 , 𝐷𝑜𝑃)
 13: E𝑔 ← E𝑔 − { (𝑠𝑖 , 𝑠𝑗 ) }
 14: E ← E − { (𝑠𝑖 , 𝑠𝑗 ) }
 '''
-def greedy_group(job : Job):
+def greedy_group(job : Job, budget : Budget = None):
 
     Eg = []
     E = job.edges.copy()
 
+    # the critical path attached to the job is updated incrementally as edges are zeroed
+    critical_path = get_critical_path(job)
+
     while E:
         # find the critical path of the DAG (V, E)
-        critical_path_edge_attributes = longest_path_dag_with_weights_and_path(job.stages, job.edges)
+        critical_path_edge_attributes = critical_path.edge_attributes()
 
         # find the edge with the largest weight in 𝐶𝑃
         max_weight = 0
         max_edge = (-1, -1)
         for edge in critical_path_edge_attributes:
-            if edge[2] > max_weight:
+            # a grouped edge placed over two servers still costs, but is grouped already
+            if edge[2] > max_weight and job.edges[(edge[0], edge[1])] != 0:
                 max_weight = edge[2]
                 max_edge = (edge[0], edge[1])
         
         if max_weight == 0 : break
+        # out of time: the caller drops this partial order
+        if budget is not None and budget.expired(): break
 
         # Try grouping 𝑠𝑖 and 𝑠𝑗 , and 𝜔𝑖 𝑗 is the weight of (𝑠𝑖 , 𝑠𝑗 )
         Eg.append(max_edge)
-        job.edges[max_edge] = 0
+        job.set_edge_weight(max_edge, 0)
 
         E.pop(max_edge)
 
+    instrumentation.count("greedy_group.grouped", len(Eg))
     return Eg
 
 
@@ -289,28 +500,30 @@ def greedy_group(job : Job):
 '''
 def longest_path_dag_with_weights_and_path(nodes : Dict[int, Stage], edges : Dict[Tuple[int, int], float]) -> List[Tuple[int, int, float]]:
 
-    # find path starting points
-    graph = {node: [] for node in nodes.keys()}
-    in_degree = {node: 0 for node in nodes.keys()}
-    edge_costs = {node: [] for node in nodes.keys()}
-    node_costs = {node: stage.alpha / stage.nslot + stage.beta for node, stage in nodes.items()}
-
-    for edge, weight in edges.items():
-        in_degree[edge[1]] += 1
-        graph[edge[0]].append(edge[1])
-        edge_costs[edge[0]].append(weight)
+    node_costs = stage_costs(nodes)
+    # edges of a CompactJob walk their CSR arrays instead
+    longest_path = getattr(edges, "longest_path", None)
+    if longest_path is not None:
+        return longest_path(node_costs)
 
-    path = {node: [] for node in nodes.keys()}
+    # walk the DAG in topological order and keep one predecessor per node
     distance_with_cost = {node: 0 for node in nodes.keys()}
-    start_nodes = [node for node in nodes.keys() if in_degree[node] == 0]
+    pred = {node: None for node in nodes.keys()}
 
-    for root_node in start_nodes:
-        path[root_node].append(root_node)
-        distance_with_cost[root_node] = node_costs[root_node]
-        dfs_with_weights_and_path(root_node, graph, edge_costs, node_costs, in_degree, path, distance_with_cost)
+    for edge, node, _ in relaxation_order(nodes, edges):
+        if edge is None:
+            distance_with_cost[node] = node_costs[node]
+            pred[node] = node
+            continue
+
+        new_distance = distance_with_cost[edge[0]] + edges[edge] + node_costs[node]
+
+        if new_distance > distance_with_cost[node]:
+            pred[node] = edge[0]
+            distance_with_cost[node] = new_distance
 
     max_node = max(distance_with_cost, key=distance_with_cost.get)
-    critical_path = path[max_node]
+    critical_path = trace_path(pred, max_node)
 
     critical_path_edge_attributes = []
     for i in range(len(critical_path) - 1):
@@ -320,26 +533,6 @@ def longest_path_dag_with_weights_and_path(nodes : Dict[int, Stage], edges : Dic
     return critical_path_edge_attributes
 
 
-def dfs_with_weights_and_path(root_node, graph, edge_costs, node_costs, in_degree, path, distance_with_cost):
-
-    for i, neighbor in enumerate(graph[root_node]):
-
-        # print(in_degree)
-        # print(root_node)
-        # print(neighbor, graph[root_node])
-        # print(neighbor, in_degree[neighbor])
-        in_degree[neighbor] -= 1
-
-        new_distance = distance_with_cost[root_node] + edge_costs[root_node][i] + node_costs[neighbor]
-
-        if new_distance > distance_with_cost[neighbor]:
-            path[neighbor] = path[root_node] + [neighbor]
-            distance_with_cost[neighbor] = new_distance
-
-        if in_degree[neighbor] == 0:
-            dfs_with_weights_and_path(neighbor, graph, edge_costs, node_costs, in_degree, path, distance_with_cost)
-
-
 '''
     Issues:
         1. greedy grouping and placement without considering edge dependency relation
@@ -0,0 +1,214 @@
+'''
+Plan cache in front of joint_optimization.
+
+A plan is keyed by a fingerprint of everything joint_optimization reads: the stages
+(alpha, beta, nslot) and edges (weights) in job order, the job DoP budget, the slot
+vector of the server pool (with memory and disk when servers limit them), the stages the
+pool already holds and their servers (planning skips them), the shuffle cost
+model if one is attached and the strategy. The cached value is the plan itself (per
+stage DoP, grouped edges, placements and JCT), which is replayed onto the job and the
+servers on a hit, leaving them exactly as planning would have.
+
+Entries live in an in-memory LRU and, optionally, one JSON file per plan in a directory.
+The files hold plain numbers only, so a shared directory cannot run code on load. The
+directory keeps at most max_disk_entries plans: a hit touches its file, and the files
+touched longest ago are deleted first.
+PLANNER_VERSION is part of the fingerprint: bump it when planning changes, so plans kept on
+disk by an older planner are not replayed.
+'''
+
+import hashlib
+import json
+import os
+import struct
+from collections import OrderedDict
+from joint_optimization import *
+
+# 2: slot-exact DoP rounding
+# 3: the JCT estimate starts at the first stage of the critical path, one-stage paths count
+# 4: bottom_up_dop hands the slots left after rounding down to the critical path
+# 5: the critical path rounding finds the path a bounded number of times
+# 6: a grouped edge placed over two servers is priced by the shuffle cost model
+PLANNER_VERSION = 6
+
+class Plan:
+    def __init__(self, dop: Dict[int, int], grouped_edges: List[Tuple[int, int]], placements: Dict[int, int], jct: float) -> None:
+        '''
+        dop: Dict[int, int] is the nslot of every stage
+        grouped_edges: List[Tuple[int, int]] is the edges whose weight planning set to 0
+        placements: Dict[int, int] maps a stage id to the index of its server in the pool
+        jct: float is the estimated job completion time
+        '''
+        self.dop = dop
+        self.grouped_edges = grouped_edges
+        self.placements = placements
+        self.jct = jct
+
+    def to_json(self) -> str:
+        return json.dumps({"dop": list(self.dop.items()), "grouped_edges": self.grouped_edges,
+                           "placements": list(self.placements.items()), "jct": self.jct})
+
+    @classmethod
+    def from_json(cls, text: str):
+        '''
+        Raise ValueError unless text is a plan written by to_json
+        '''
+        try:
+            record = json.loads(text)
+            plan = cls({int(i): int(n) for i, n in record["dop"]},
+                       [(int(i), int(j)) for i, j in record["grouped_edges"]],
+                       {int(i): int(k) for i, k in record["placements"]},
+                       float(record["jct"]))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Not a cached plan: {e}") from e
+        return plan
+
+
+def fingerprint(job: Job, servers: ServerPool, strategy: Strategy) -> str:
+    h = hashlib.sha256()
+    h.update(struct.pack("<qqq", PLANNER_VERSION, job.nslot, len(job.stages)))
+    alpha = getattr(job, "alpha", None)
+    if alpha is not None:
+        # CompactJob: hash the arrays directly
+        for array in [job.alpha, job.beta, job.nslot_array, job.offsets, job.targets, job.weights]:
+            h.update(array.tobytes())
+    else:
+        stage_format = struct.Struct("<qddq")
+        for stage_id, stage in job.stages.items():
+            h.update(stage_format.pack(stage_id, stage.alpha, stage.beta, stage.nslot))
+        edge_format = struct.Struct("<qqd")
+        for (i, j), weight in job.edges.items():
+            h.update(edge_format.pack(i, j, weight))
+    h.update(struct.pack(f"<{2 * len(servers.servers)}q", *[n for server in servers.servers for n in (server.total_slots, server.available_slots)]))
+    placed = sorted((stage_id, servers.position[id(server)]) for stage_id, server in servers.stage_server.items())
+    h.update(struct.pack(f"<q{2 * len(placed)}q", len(placed), *[n for pair in placed for n in pair]))
+    if servers.limited:
+        # memory and disk only matter on servers that limit them
+        h.update(repr([(server.total_memory, server.available_memory, server.total_disk, server.available_disk)
+                       for server in servers.servers]).encode("utf-8"))
+        h.update(repr([(stage.memory, stage.disk) for stage in job.stages.values()]).encode("utf-8"))
+    if job.shuffle_cost is not None:
+        h.update(job.shuffle_cost.key())
+    h.update(strategy.name.encode("utf-8"))
+    return h.hexdigest()
+
+
+class PlanCache:
+    def __init__(self, max_entries: int = 1024, directory: str = None, max_disk_entries: int = 4096) -> None:
+        '''
+        max_entries: int is the size of the in-memory LRU
+        directory: str keeps plans on disk as well, if given
+        max_disk_entries: int is the most plans kept in directory
+        '''
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.entries: OrderedDict[str, Plan] = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_entries = 0   # files in directory, as far as this cache knows
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_entries = len(self.disk_files())
+
+    def disk_files(self) -> List[str]:
+        return [name for name in os.listdir(self.directory) if name.endswith(".json")]
+
+    def get(self, key: str) -> Plan:
+        plan = self.entries.get(key)
+        if plan is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return plan
+        if self.directory is not None:
+            path = os.path.join(self.directory, key + ".json")
+            try:
+                with open(path, "r") as f:
+                    plan = Plan.from_json(f.read())
+                # the files touched longest ago are evicted first
+                os.utime(path)
+            except (FileNotFoundError, ValueError):
+                plan = None
+            if plan is not None:
+                self.disk_hits += 1
+                self.remember(key, plan)
+                return plan
+        self.misses += 1
+        return None
+
+    def remember(self, key: str, plan: Plan) -> None:
+        self.entries[key] = plan
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, key: str, plan: Plan) -> None:
+        self.remember(key, plan)
+        if self.directory is not None:
+            path = os.path.join(self.directory, key + ".json")
+            exists = os.path.exists(path)
+            # workers share the directory: every process writes its own temporary file
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(plan.to_json())
+            os.replace(tmp, path)
+            if not exists:
+                self.disk_entries += 1
+                if self.disk_entries > self.max_disk_entries:
+                    self.evict()
+
+    def evict(self) -> None:
+        '''
+        Delete the files touched longest ago, down to 3/4 of max_disk_entries so that the
+        directory is only listed once every max_disk_entries / 4 new plans
+        '''
+        files = []
+        for name in self.disk_files():
+            try:
+                files.append((os.stat(os.path.join(self.directory, name)).st_mtime_ns, name))
+            except FileNotFoundError:
+                pass    # evicted by another process
+        files.sort()
+        keep = self.max_disk_entries * 3 // 4
+        for _, name in files[:max(len(files) - keep, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        self.disk_entries = min(len(files), keep)
+
+    def plan(self, job: Job, servers: List[Server], strategy: Strategy, budget: Budget = None) -> float:
+        '''
+        Same as joint_optimization(job, servers, strategy, budget), answered from the cache when
+        possible. Plans cut short by the budget are not cached.
+        '''
+        if not isinstance(servers, ServerPool):
+            servers = ServerPool(servers)
+        key = fingerprint(job, servers, strategy)
+
+        plan = self.get(key)
+        if plan is not None:
+            for stage_id, nslot in plan.dop.items():
+                job.set_stage_nslot(stage_id, nslot)
+            for edge in plan.grouped_edges:
+                job.set_edge_weight(edge, 0)
+            for stage_id, server_index in plan.placements.items():
+                servers.reserve(servers.servers[server_index], (stage_id, job.stages[stage_id]))
+            return plan.jct
+
+        weights = dict(job.edges.items())
+        placed = set(servers.stage_server.keys())
+        jct = joint_optimization(job, servers, strategy, budget)
+        if budget is not None and budget.hit:
+            return jct
+
+        plan = Plan({stage_id: stage.nslot for stage_id, stage in job.stages.items()},
+                    [edge for edge, weight in job.edges.items() if weight == 0 and weights[edge] != 0],
+                    {stage_id: servers.position[id(server)] for stage_id, server in servers.stage_server.items() if stage_id not in placed},
+                    jct)
+        self.put(key, plan)
+        return jct
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self.entries)}
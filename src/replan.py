@@ -0,0 +1,220 @@
+'''
+Incremental replanning when the server pool changes.
+
+A plan lives in the job (nslot of every stage, grouped edges at weight 0) and in the
+ServerPool (placements). When servers fail, join or are resized, replan only touches the
+stages the change displaced: the stages of removed servers and the largest stages of
+shrunk servers. Displaced stages joined by grouped edges move together, to the server of a
+grouped neighbour when it has room, else to the best fit. A grouped edge is only ungrouped
+(its weight restored) when its two stages were on one server before and are not anymore,
+and the nslot of a stage is only lowered when no server has room for it.
+
+When the delta adds slots (new or grown servers), the slots added, up to what the job has
+left of its DoP budget, go to the critical path of the current DoP the way bottom_up_dop
+hands out the slots left after rounding (critical_path_targets). Only the stages that get
+some grow: they take the free slots of their server, or move to a server with room for
+all of it when they have no grouped edge.
+
+The work is proportional to the displaced stages, their edges and the number of servers,
+plus a bounded number of passes over the job to find the critical path when slots were
+added; the JCT comes from the incremental critical path. Pool changes, stage moves and job changes
+all go through the undo log: when a displaced stage fits on no server (not even with fewer
+slots), replan rolls everything back, pool delta included, and raises.
+
+    weights = dict(job.edges)
+    joint_optimization(job, pool, Strategy.DITTO)
+    replan(job, pool, PoolDelta(removed=[3], added=[32]), weights)
+'''
+
+from typing import Iterator
+from joint_optimization import *
+from bottom_up_dop import critical_path_targets
+
+class PoolDelta:
+    def __init__(self, added: List = None, removed: List[int] = None, resized: Dict[int, int] = None) -> None:
+        '''
+        added: the total slots, or (slots, memory, disk), of every new server
+        removed: List[int] is the indices of the lost servers in the pool
+        resized: Dict[int, int] maps the index of a server in the pool to its new total slots
+        Indices refer to the pool before the delta.
+        '''
+        self.added = added or []
+        self.removed = removed or []
+        self.resized = resized or {}
+
+
+def apply_delta(servers: ServerPool, delta: PoolDelta) -> Dict[int, Tuple[Stage, Server]]:
+    '''
+    return: Dict[int, Tuple[Stage, Server]] maps every displaced stage id to the stage and
+            the server it was on
+    '''
+    displaced = {}
+    removed = [servers.servers[i] for i in delta.removed]
+    for i, total_slots in delta.resized.items():
+        server = servers.servers[i]
+        for stage_id, stage in servers.resize_server(server, total_slots):
+            displaced[stage_id] = (stage, server)
+    for server in removed:
+        for stage_id, stage in servers.remove_server(server):
+            displaced[stage_id] = (stage, server)
+    for resources in delta.added:
+        servers.add_server(Server(*resources) if isinstance(resources, (tuple, list)) else Server(resources))
+    return displaced
+
+
+def grouped_neighbours(job: Job, stage_id: int) -> Iterator[Tuple[Tuple[int, int], int]]:
+    '''
+    return: (edge, other stage) for every edge of stage_id with weight 0
+    '''
+    critical_path = get_critical_path(job)
+    for edge in critical_path.in_edges[stage_id]:
+        if job.edges[edge] == 0:
+            yield edge, edge[0]
+    for edge in critical_path.out_edges[stage_id]:
+        if job.edges[edge] == 0:
+            yield edge, edge[1]
+
+
+def displaced_groups(job: Job, displaced: Dict[int, Tuple[Stage, Server]]) -> List[List[int]]:
+    '''
+    return: List[List[int]], the displaced stages split into groups connected by grouped
+            edges, largest slot total first, each in breadth first order
+    '''
+    groups = []
+    seen = set()
+    for stage_id in displaced.keys():
+        if stage_id in seen:
+            continue
+        seen.add(stage_id)
+        group = [stage_id]
+        for member in group:
+            for _, other in grouped_neighbours(job, member):
+                if other in displaced and other not in seen:
+                    seen.add(other)
+                    group.append(other)
+        groups.append(group)
+    groups.sort(key=lambda group: sum(displaced[stage_id][0].nslot for stage_id in group), reverse=True)
+    return groups
+
+
+def replace_stage(job: Job, servers: ServerPool, stage_id: int) -> bool:
+    '''
+    Place a displaced stage next to a grouped neighbour if one has room, else at its best fit,
+    lowering its nslot to the most free slots of a server with its memory and disk if nothing fits.
+    return: bool is whether the nslot was lowered
+    '''
+    stage = job.stages[stage_id]
+    for _, other in grouped_neighbours(job, stage_id):
+        server = servers.locate(other)
+        if server is not None and server.can_place((stage_id, stage)):
+            servers.reserve(server, (stage_id, stage))
+            return False
+    if servers.place((stage_id, stage)):
+        return False
+    roomy = [server for server in servers.servers if server.fits(1, stage.memory, stage.disk)]
+    if not roomy:
+        raise Exception(f"No server has a free slot, the memory and the disk of stage {stage_id}")
+    server = max(roomy, key=lambda server: server.available_slots)
+    job.set_stage_nslot(stage_id, server.available_slots)
+    servers.reserve(server, (stage_id, stage))
+    return True
+
+
+def grow_stages(job: Job, servers: ServerPool, added: int) -> int:
+    '''
+    Hand the added slots, as far as the DoP budget of the job allows, to the critical path
+    of the current DoP (critical_path_targets) and raise only the stages that get some: on
+    their server as far as its free slots allow, or on a server with room for all of it
+    when they have no grouped edge.
+    return: int is the number of stages grown
+    '''
+    left = min(added, job.nslot - sum(stage.nslot for stage in job.stages.values()))
+    with instrumentation.phase("dop"):
+        targets = critical_path_targets(job, left)
+
+    grown = 0
+    for stage_id, want in targets.items():
+        stage = job.stages[stage_id]
+        server = servers.locate(stage_id)
+        if server is None:
+            continue
+        nslot = stage.nslot + min(want - stage.nslot, server.available_slots)
+        if next(grouped_neighbours(job, stage_id), None) is None and nslot < want:
+            roomy = servers.best_fit(want, stage.memory, stage.disk)
+            if roomy is not None and roomy is not server:
+                server, nslot = roomy, want
+        if nslot == stage.nslot:
+            continue
+        servers.release(stage_id)
+        job.set_stage_nslot(stage_id, nslot)
+        servers.reserve(server, (stage_id, stage))
+        grown += 1
+    return grown
+
+
+def replan(job: Job, servers: ServerPool, delta: PoolDelta, weights: Dict[Tuple[int, int], float]) -> Dict[str, float]:
+    '''
+    Apply delta to servers and repair the plan of job on them.
+    servers: ServerPool holding the placements of the plan
+    weights: Dict[Tuple[int, int], float] is the edge weights before grouping, restored on
+             the edges replan ungroups
+    return: {"jct": estimated JCT of the repaired plan, "moved": displaced stages placed
+             again, "ungrouped": edges ungrouped, "shrunk": stages whose nslot was lowered,
+             "grown": stages whose nslot was raised with the added slots}
+    '''
+    if job.undo_log is None:
+        job.undo_log = servers.undo_log or UndoLog()
+    if servers.undo_log is None:
+        servers.undo_log = job.undo_log
+    mark = job.undo_log.checkpoint()
+    try:
+        result = repair(job, servers, delta, weights)
+    except Exception:
+        job.undo_log.rollback(mark)
+        raise
+    job.undo_log.commit(mark)
+    return result
+
+
+def repair(job: Job, servers: ServerPool, delta: PoolDelta, weights: Dict[Tuple[int, int], float]) -> Dict[str, float]:
+    with instrumentation.phase("replan"):
+        servers_before = {i: servers.servers[i].total_slots for i in delta.resized.keys()}
+        displaced = apply_delta(servers, delta)
+        groups = displaced_groups(job, displaced)
+
+        shrunk = 0
+        ungrouped = 0
+        for group in groups:
+            # the whole group on one server keeps all of its grouped edges
+            stages = [job.stages[stage_id] for stage_id in group]
+            server = servers.best_fit(sum(stage.nslot for stage in stages), sum(stage.memory for stage in stages),
+                                      sum(stage.disk for stage in stages))
+            for stage_id in group:
+                if server is not None:
+                    servers.reserve(server, (stage_id, job.stages[stage_id]))
+                elif replace_stage(job, servers, stage_id):
+                    shrunk += 1
+
+            for stage_id in group:
+                before = displaced[stage_id][1]
+                for edge, other in list(grouped_neighbours(job, stage_id)):
+                    other_before = displaced[other][1] if other in displaced else servers.locate(other)
+                    if other_before is before and servers.locate(other) is not servers.locate(stage_id):
+                        job.set_edge_weight(edge, weights[edge])
+                        ungrouped += 1
+
+        added = sum(resources[0] if isinstance(resources, (tuple, list)) else resources for resources in delta.added)
+        added += sum(max(0, total_slots - servers_before[i]) for i, total_slots in delta.resized.items())
+        grown = grow_stages(job, servers, added) if added > 0 else 0
+
+        instrumentation.count("replan.moved", len(displaced))
+        instrumentation.count("replan.ungrouped", ungrouped)
+        instrumentation.count("replan.shrunk", shrunk)
+        instrumentation.count("replan.grown", grown)
+        return {
+            "jct": estimate_jct(job),
+            "moved": len(displaced),
+            "ungrouped": ungrouped,
+            "shrunk": shrunk,
+            "grown": grown,
+        }
@@ -1,20 +1,325 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
+from bisect import bisect_left, insort
+from heapq import heapify, heappop, heappush
 from job import Stage
+import instrumentation
 
 class Server:
-    def __init__(self, total_slots: int) -> None:
+    def __init__(self, total_slots: int, memory: float = None, disk: float = None, bandwidth: float = None) -> None:
+        '''
+        memory, disk: memory and scratch disk of the server, None when not limited
+        bandwidth: NIC bandwidth for shuffle costs, None for the default of the cost model
+        '''
         self.total_slots = total_slots
         self.available_slots = total_slots
+        self.total_memory = memory
+        self.available_memory = memory
+        self.total_disk = disk
+        self.available_disk = disk
+        self.bandwidth = bandwidth
         self.placed_stages: Dict[int, Stage] = {}
         # I suppose the resourse contraints is available_slots 
-    
+
+    def fits(self, nslot: int, memory: float = 0, disk: float = 0) -> bool:
+        return self.available_slots >= nslot \
+            and (self.available_memory is None or self.available_memory >= memory) \
+            and (self.available_disk is None or self.available_disk >= disk)
+
     def can_place(self, stage: Tuple[int, Stage]) -> bool:
-        return self.available_slots >= stage[1].nslot
+        return self.fits(stage[1].nslot, stage[1].memory, stage[1].disk)
     
     def place(self, stage: Tuple[int, Stage]) -> None:
         assert self.can_place(stage)
         self.available_slots -= stage[1].nslot
+        if self.available_memory is not None:
+            self.available_memory -= stage[1].memory
+        if self.available_disk is not None:
+            self.available_disk -= stage[1].disk
         self.placed_stages[stage[0]] = stage[1]
+
+    def remove(self, id: int) -> Stage:
+        stage = self.placed_stages.pop(id)
+        self.available_slots += stage.nslot
+        if self.available_memory is not None:
+            self.available_memory += stage.memory
+        if self.available_disk is not None:
+            self.available_disk += stage.disk
+        return stage
+
+    def free(self) -> Tuple[int, Optional[float], Optional[float]]:
+        '''
+        return: the available (slots, memory, disk)
+        '''
+        return self.available_slots, self.available_memory, self.available_disk
+
+    def residual(self, nslot: int, memory: float, disk: float) -> float:
+        '''
+        return: the fractions of slots, memory and disk left after taking the given amounts, summed
+        '''
+        left = (self.available_slots - nslot) / max(self.total_slots, 1)
+        if self.available_memory is not None:
+            left += (self.available_memory - memory) / max(self.total_memory, 1e-12)
+        if self.available_disk is not None:
+            left += (self.available_disk - disk) / max(self.total_disk, 1e-12)
+        return left
     
     def copy(self):
-        return Server(self.total_slots)
+        return Server(self.total_slots, self.total_memory, self.total_disk, self.bandwidth)
+
+
+INF = float("inf")
+
+class ServerPool:
+    '''
+    Servers indexed by available slots for best fit lookups, plus a map from
+    stage id to the server holding it. Only change the servers through
+    reserve / release and add_server / remove_server / resize_server so the
+    index stays in sync (and the undo log, if any, can revert them).
+
+    When servers also limit memory or disk, every bucket keeps max-heaps of the memory and
+    disk its servers have left, so best_fit skips the buckets where nothing fits. Entries
+    of servers that left the bucket are dropped lazily, when they reach the top (cap()).
+    '''
+    def __init__(self, servers: List[Server]) -> None:
+        self.servers = servers
+        self.undo_log = None
+        self.owner = None       # set on views, see view()
+        self.shuffle_cost = None    # ShuffleCost told about every stage moved, see shuffle_cost.py
+        self.position = {id(server): i for i, server in enumerate(servers)}
+        self.buckets: Dict[int, Dict[int, Server]] = {}   # available slots -> {position: server}
+        self.keys: List[int] = []                          # sorted keys of buckets
+        self.limited = any(server.total_memory is not None or server.total_disk is not None for server in servers)
+        self.caps: Dict[int, Tuple[list, list]] = {}      # available slots -> heaps of (-memory, position), (-disk, position), if limited
+        self.stage_server: Dict[int, Server] = {}
+        for i, server in enumerate(servers):
+            self.add_to_bucket(i, server)
+            for stage_id in server.placed_stages.keys():
+                self.stage_server[stage_id] = server
+
+    def add_to_bucket(self, i: int, server: Server) -> None:
+        bucket = self.buckets.get(server.available_slots)
+        if bucket is None:
+            bucket = self.buckets[server.available_slots] = {}
+            insort(self.keys, server.available_slots)
+        bucket[i] = server
+        if self.limited:
+            heaps = self.caps.get(server.available_slots)
+            if heaps is None or len(heaps[0]) > 2 * len(bucket) + 8:
+                # start over once stale entries outnumber the servers
+                heaps = self.caps[server.available_slots] = (
+                    [(-limit(other.available_memory), k) for k, other in bucket.items()],
+                    [(-limit(other.available_disk), k) for k, other in bucket.items()])
+                heapify(heaps[0])
+                heapify(heaps[1])
+            else:
+                heappush(heaps[0], (-limit(server.available_memory), i))
+                heappush(heaps[1], (-limit(server.available_disk), i))
+
+    def remove_from_bucket(self, i: int, server: Server) -> None:
+        # the entries of server in the heaps of caps go stale, cap() drops them
+        bucket = self.buckets[server.available_slots]
+        del bucket[i]
+        if not bucket:
+            del self.buckets[server.available_slots]
+            del self.keys[bisect_left(self.keys, server.available_slots)]
+            self.caps.pop(server.available_slots, None)
+
+    def cap(self, key: int) -> Tuple[float, float]:
+        '''
+        return: the most memory and the most disk left on a server of bucket key, in
+            O(log n) amortized
+        '''
+        bucket = self.buckets[key]
+        memory, disk = self.caps[key]
+        return top(memory, bucket, "available_memory"), top(disk, bucket, "available_disk")
+
+    def best_fit(self, nslot: int, memory: float = 0, disk: float = 0) -> Optional[Server]:
+        '''
+        return: the server with the fewest available slots that still has nslot (and
+            memory and disk), the one with the least left over of every resource
+            among those; None if no server fits
+        '''
+        k = bisect_left(self.keys, nslot)
+        if k == len(self.keys):
+            return None
+        if not self.limited or (memory <= 0 and disk <= 0):
+            return next(iter(self.buckets[self.keys[k]].values()))
+
+        for key in self.keys[k:]:
+            most_memory, most_disk = self.cap(key)
+            if most_memory < memory or most_disk < disk:
+                continue
+            fits = [server for server in self.buckets[key].values() if server.fits(nslot, memory, disk)]
+            if fits:
+                return min(fits, key=lambda server: server.residual(nslot, memory, disk))
+        return None
+
+    def locate(self, stage_id: int) -> Optional[Server]:
+        return self.stage_server.get(stage_id)
+
+    def server_key(self, stage_id: int):
+        return stage_id if self.owner is None else (self.owner, stage_id)
+
+    def reserve(self, server: Server, stage: Tuple[int, Stage]) -> None:
+        i = self.position[id(server)]
+        self.remove_from_bucket(i, server)
+        server.place((self.server_key(stage[0]), stage[1]))
+        self.add_to_bucket(i, server)
+        self.stage_server[stage[0]] = server
+        if self.undo_log is not None:
+            self.undo_log.record(self.release, stage[0])
+        if self.shuffle_cost is not None:
+            self.shuffle_cost.stage_moved(stage[0])
+
+    def release(self, stage_id: int) -> Stage:
+        server = self.stage_server.pop(stage_id)
+        i = self.position[id(server)]
+        self.remove_from_bucket(i, server)
+        stage = server.remove(self.server_key(stage_id))
+        self.add_to_bucket(i, server)
+        if self.undo_log is not None:
+            self.undo_log.record(self.reserve, server, (stage_id, stage))
+        if self.shuffle_cost is not None:
+            self.shuffle_cost.stage_moved(stage_id)
+        return stage
+
+    def place(self, stage: Tuple[int, Stage]) -> bool:
+        instrumentation.count("place.attempts")
+        server = self.best_fit(stage[1].nslot, stage[1].memory, stage[1].disk)
+        if server is None:
+            instrumentation.count("place.failed")
+            return False
+        self.reserve(server, stage)
+        return True
+
+    def reindex(self) -> None:
+        # in place, views share these
+        self.position.clear()
+        self.position.update((id(server), i) for i, server in enumerate(self.servers))
+        self.buckets.clear()
+        self.keys.clear()
+        self.caps.clear()
+        for i, server in enumerate(self.servers):
+            self.add_to_bucket(i, server)
+
+    def stages_on(self, server: Server) -> List[int]:
+        '''
+        return: List[int] is the ids of the stages placed on server through this pool
+        '''
+        if self.owner is None:
+            return list(server.placed_stages.keys())
+        return [key[1] for key in server.placed_stages.keys() if isinstance(key, tuple) and key[0] == self.owner]
+
+    def add_server(self, server: Server) -> None:
+        self.insert_server(len(self.servers), server)
+
+    def insert_server(self, i: int, server: Server) -> None:
+        '''
+        Put server into the pool at index i
+        '''
+        if self.undo_log is not None:
+            self.undo_log.record(self.remove_server, server)
+        if i < len(self.servers):
+            self.servers.insert(i, server)
+            self.limited = self.limited or server.total_memory is not None or server.total_disk is not None
+            self.reindex()
+            return
+        self.position[id(server)] = len(self.servers)
+        self.servers.append(server)
+        if not self.limited and (server.total_memory is not None or server.total_disk is not None):
+            self.limited = True
+            self.reindex()
+            return
+        self.add_to_bucket(len(self.servers) - 1, server)
+
+    def remove_server(self, server: Server) -> List[Tuple[int, Stage]]:
+        '''
+        Take server out of the pool, releasing the stages placed on it through this pool.
+        return: List[Tuple[int, Stage]] is the released stages
+        '''
+        displaced = [(stage_id, self.release(stage_id)) for stage_id in self.stages_on(server)]
+        if server.placed_stages:
+            raise Exception(f"Server {self.position[id(server)]} still holds stages of other pools")
+        i = self.position[id(server)]
+        del self.servers[i]
+        self.reindex()
+        if self.undo_log is not None:
+            self.undo_log.record(self.insert_server, i, server)
+        return displaced
+
+    def resize_server(self, server: Server, total_slots: int) -> List[Tuple[int, Stage]]:
+        '''
+        Change the slots of server, releasing its largest stages until the rest fit.
+        return: List[Tuple[int, Stage]] is the released stages
+        '''
+        placed = sorted(self.stages_on(server), key=lambda stage_id: server.placed_stages[self.server_key(stage_id)].nslot)
+        displaced = []
+        while server.total_slots - server.available_slots > total_slots:
+            if not placed:
+                raise Exception(f"Server {self.position[id(server)]} holds more than {total_slots} slots of other pools")
+            stage_id = placed.pop()
+            displaced.append((stage_id, self.release(stage_id)))
+
+        i = self.position[id(server)]
+        if self.undo_log is not None:
+            self.undo_log.record(self.resize_server, server, server.total_slots)
+        self.remove_from_bucket(i, server)
+        server.available_slots += total_slots - server.total_slots
+        server.total_slots = total_slots
+        self.add_to_bucket(i, server)
+        return displaced
+
+    def view(self, owner) -> "ServerPool":
+        '''
+        A pool sharing these servers and their index, with its own stage ids: stages are
+        kept in Server.placed_stages under (owner, stage id), so the stages of several jobs
+        can be placed on the same servers.
+        '''
+        view = ServerPool.__new__(ServerPool)
+        view.__dict__.update(self.__dict__)
+        view.owner = owner
+        view.stage_server = {}
+        view.undo_log = None
+        return view
+
+    def copy(self):
+        return ServerPool([server.copy() for server in self.servers])
+
+    def detached(self) -> "ServerPool":
+        '''
+        A pool of copies of the servers, with the same totals, free resources and bucket
+        order but no stages: best_fit picks the same servers on it as on this pool.
+        '''
+        copies = []
+        for server in self.servers:
+            copy = server.copy()
+            copy.available_slots, copy.available_memory, copy.available_disk = server.free()
+            copies.append(copy)
+        pool = ServerPool(copies)
+        pool.limited = self.limited
+        # best_fit takes the first server of a bucket that fits: keep the order of ours
+        pool.buckets.clear()
+        pool.keys.clear()
+        pool.caps.clear()
+        for key in self.keys:
+            for i in self.buckets[key].keys():
+                pool.add_to_bucket(i, copies[i])
+        return pool
+
+
+def limit(amount: Optional[float]) -> float:
+    return INF if amount is None else amount
+
+
+def top(heap: list, bucket: Dict[int, Server], attribute: str) -> float:
+    '''
+    Pop the entries of servers no longer in bucket, or whose amount changed since,
+    and return the largest amount left
+    '''
+    while heap:
+        amount, i = heap[0]
+        server = bucket.get(i)
+        if server is not None and limit(getattr(server, attribute)) == -amount:
+            return -amount
+        heappop(heap)
+    return -INF
@@ -0,0 +1,293 @@
+'''
+Planner service.
+
+`serve` keeps the jobs of a workload and the server configurations resident and answers
+plan requests on a local socket (a Unix socket or localhost TCP), one JSON object per line:
+
+    {"id": 1, "job": "q1", "strategy": "DITTO", "servers": 0}
+    {"id": 2, "dag": {...DAG record...}, "nslot": 120, "servers": [16, 29, 25], "deadline": 0.01}
+    {"id": 3, "op": "jobs"}
+
+"servers" is the index of a server configuration or the slots (or [slots, memory, disk])
+of every server, "strategy" defaults to DITTO. A plan is answered with {"id", "jct", "dop", "grouped", "placements"}, a
+failed request with {"id", "error"} ("id" is null when the line is not a JSON object); answers
+on one connection can come out of order. A "deadline" in seconds counts from the moment the
+service read the request, so time spent waiting for a worker is part of it. A request line
+holds at most line_limit bytes (LINE_LIMIT by default, room for DAGs of many thousands of
+stages inline); a longer one is answered with an error and skipped.
+
+The event loop only parses and routes lines. Plans run on a process pool: a request goes
+to an idle worker at once, and requests arriving while every worker is busy are batched
+(up to batch_size) into one round trip. Each worker parsed the workload once when it
+started and keeps a PlanCache, so a request costs the plan itself and one round trip.
+
+`loadgen` replays requests for the resident jobs over a number of connections, each
+sending its next request when the previous one is answered, and prints the latency
+percentiles and the throughput.
+'''
+
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from joint_optimization import *
+from workload import build_job, load_jobs
+
+# the longest request line the service reads, in bytes
+LINE_LIMIT = 1 << 26
+
+# resident state of a worker process, see init_worker
+worker_jobs: Dict[str, Job] = {}
+worker_configs: List[List[int]] = []
+worker_nslots = 0
+worker_cache = None
+
+def init_worker(workload: str, nslots: int, server_configs: List[List[int]], cache_size: int) -> None:
+    global worker_jobs, worker_configs, worker_nslots, worker_cache
+    worker_jobs = dict(load_jobs(workload, nslots))
+    worker_configs = server_configs
+    worker_nslots = nslots
+    if cache_size > 0:
+        from plan_cache import PlanCache
+        worker_cache = PlanCache(cache_size)
+
+
+def plan_request(request: Dict, arrival: float = None) -> Dict:
+    '''
+    arrival: time.time() when the service received the request, the deadline counts from it
+    return: the answer to one plan request
+    '''
+    if "dag" in request:
+        job = build_job(request["dag"], request.get("nslot", worker_nslots))
+    elif request.get("job") in worker_jobs:
+        job = worker_jobs[request["job"]]
+    else:
+        raise Exception(f"Unknown job: {request.get('job')}")
+
+    servers = request.get("servers", 0)
+    server_slots = worker_configs[servers] if isinstance(servers, int) else servers
+    server_pool = ServerPool([Server(*n) if isinstance(n, list) else Server(n) for n in server_slots])
+    job.undo_log = server_pool.undo_log = UndoLog()
+    budget = None
+    if request.get("deadline") is not None:
+        waited = 0.0 if arrival is None else max(0.0, time.time() - arrival)
+        budget = Budget(request["deadline"] - waited)
+
+    answer = {"id": request.get("id")}
+    weights = dict(job.edges)
+    def inspect(job: Job, servers: ServerPool) -> None:
+        answer["dop"] = {stage_id: stage.nslot for stage_id, stage in job.stages.items()}
+        answer["grouped"] = [edge for edge, weight in job.edges.items() if weight == 0 and weights[edge] != 0]
+        answer["placements"] = {stage_id: servers.position[id(server)] for stage_id, server in servers.stage_server.items()}
+    answer["jct"] = plan_isolated(job, server_pool, Strategy[request.get("strategy", "DITTO")], worker_cache, inspect, budget)
+    return answer
+
+
+def plan_batch(requests: List[Tuple[Dict, float]]) -> List[Dict]:
+    '''
+    requests: (request, arrival time) pairs
+    '''
+    answers = []
+    for request, arrival in requests:
+        try:
+            answers.append(plan_request(request, arrival))
+        except Exception as e:
+            answers.append({"id": request.get("id"), "error": f"{type(e).__name__}: {e}"})
+    return answers
+
+
+class PlannerService:
+    def __init__(self, workload: str, nslots: int, server_configs: List[List[int]], workers: int,
+                 batch_size: int = 16, cache_size: int = 1024, line_limit: int = LINE_LIMIT) -> None:
+        '''
+        workers: size of the planning process pool
+        batch_size: most requests planned by a worker in one round trip
+        cache_size: entries of the PlanCache of every worker, 0 for none
+        line_limit: the longest request line read, in bytes
+        '''
+        self.line_limit = line_limit
+        self.job_names = [name for name, _ in load_jobs(workload, nslots)]
+        self.workers = workers
+        self.batch_size = batch_size
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                            initargs=(workload, nslots, server_configs, cache_size))
+        self.queue: asyncio.Queue = None
+        self.served = 0
+        self.batches = 0
+
+    async def batcher(self) -> None:
+        idle = asyncio.Semaphore(self.workers)
+        while True:
+            batch = [await self.queue.get()]
+            # requests queue up while every worker is busy, and leave together
+            await idle.acquire()
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            task = asyncio.create_task(self.dispatch(batch))
+            task.add_done_callback(lambda _: idle.release())
+
+    async def dispatch(self, batch: List[Tuple[Dict, float, asyncio.Future]]) -> None:
+        self.batches += 1
+        try:
+            answers = await asyncio.get_running_loop().run_in_executor(
+                self.executor, plan_batch, [(request, arrival) for request, arrival, _ in batch])
+        except Exception as e:
+            answers = [{"id": request.get("id"), "error": f"{type(e).__name__}: {e}"} for request, _, _ in batch]
+        for (_, _, future), answer in zip(batch, answers):
+            if not future.done():
+                future.set_result(answer)
+
+    async def answer(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        # queueing counts against the deadline of a request
+        arrival = time.time()
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            answer = {"id": None, "error": f"Bad request: {e}"}
+        else:
+            if not isinstance(request, dict):
+                answer = {"id": None, "error": f"Bad request: expected a JSON object, got {type(request).__name__}"}
+            elif request.get("op") == "jobs":
+                answer = {"id": request.get("id"), "jobs": self.job_names}
+            elif request.get("op") == "stats":
+                answer = {"id": request.get("id"), "served": self.served, "batches": self.batches}
+            else:
+                future = asyncio.get_running_loop().create_future()
+                await self.queue.put((request, arrival, future))
+                answer = await future
+                self.served += 1
+        await self.reply(answer, writer)
+
+    async def reply(self, answer: Dict, writer: asyncio.StreamWriter) -> None:
+        if writer.is_closing():
+            return
+        try:
+            writer.write(json.dumps(answer).encode("utf-8") + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass    # the client left, connection() closes the writer
+
+    async def connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks = set()
+
+        def start(reply) -> None:
+            task = asyncio.create_task(reply)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    line = e.partial    # the end of the stream
+                except asyncio.LimitOverrunError:
+                    await skip_line(reader)
+                    start(self.reply({"id": None, "error": f"Bad request: line longer than {self.line_limit} bytes"}, writer))
+                    continue
+                if not line:
+                    break
+                if line.strip():
+                    start(self.answer(line, writer))
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str = None, port: int = 7070) -> None:
+        '''
+        Serve on the Unix socket socket_path, or on localhost:port without one, until cancelled
+        '''
+        self.queue = asyncio.Queue()
+        # start every worker now so the first requests do not pay for loading the workload
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, plan_batch, []) for _ in range(self.workers)])
+        batcher = loop.create_task(self.batcher())
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.connection, path=socket_path, limit=self.line_limit)
+        else:
+            server = await asyncio.start_server(self.connection, host="127.0.0.1", port=port, limit=self.line_limit)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.executor.shutdown()
+
+
+async def skip_line(reader: asyncio.StreamReader) -> None:
+    '''
+    Drop the rest of a line longer than the limit of reader, newline included
+    '''
+    while True:
+        try:
+            await reader.readuntil(b"\n")
+            return
+        except asyncio.IncompleteReadError:
+            return
+        except asyncio.LimitOverrunError as e:
+            # up to the newline if it was found, else everything buffered
+            await reader.readexactly(e.consumed)
+
+
+async def open_connection(socket_path: str = None, port: int = 7070):
+    if socket_path is not None:
+        return await asyncio.open_unix_connection(socket_path, limit=LINE_LIMIT)
+    return await asyncio.open_connection("127.0.0.1", port, limit=LINE_LIMIT)
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, message: Dict) -> Dict:
+    writer.write(json.dumps(message).encode("utf-8") + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def load_test(socket_path: str = None, port: int = 7070, nrequests: int = 1000, concurrency: int = 8,
+                    strategy: str = "DITTO", nconfigs: int = 2, seed: int = 0) -> Dict[str, float]:
+    '''
+    Send nrequests plan requests for random resident jobs over concurrency connections
+    return: {"requests", "errors", "seconds", "throughput_per_s", "p50_ms", "p90_ms", "p99_ms", "max_ms"}
+    '''
+    reader, writer = await open_connection(socket_path, port)
+    job_names = (await request(reader, writer, {"op": "jobs"}))["jobs"]
+    writer.close()
+
+    rng = random.Random(seed)
+    messages = [{"id": i, "job": rng.choice(job_names), "strategy": strategy, "servers": rng.randrange(nconfigs)}
+                for i in range(nrequests)]
+    latencies = []
+    errors = 0
+
+    async def client(k: int) -> None:
+        nonlocal errors
+        reader, writer = await open_connection(socket_path, port)
+        try:
+            for message in messages[k::concurrency]:
+                start = time.perf_counter()
+                answer = await request(reader, writer, message)
+                latencies.append(time.perf_counter() - start)
+                if "error" in answer:
+                    errors += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(k) for k in range(concurrency)])
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p: float) -> float:
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1e3 if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "throughput_per_s": len(latencies) / seconds if seconds > 0 else 0.0,
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": percentile(1.0),
+    }
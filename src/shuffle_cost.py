@@ -0,0 +1,112 @@
+from typing import Dict, List, Optional, Tuple
+from job import Job
+from server import Server, ServerPool
+
+'''
+Shuffle cost model for critical paths.
+
+Without a model every edge costs its static weight, 0 once grouped. A ShuffleCost prices
+every edge from where its two stages sit instead: `price(weight, volume, source, target)`
+gets the measured edge weight (kept when grouping zeroes it), the bytes it shuffles (None if
+unknown) and the servers of its two stages (None while a stage is not placed). NicPrice, the
+default, makes an edge free when both stages share a server, and otherwise sends its bytes
+through the slower of the two NICs. A grouped edge is free until both of its stages are
+placed, as grouping plans them on one server; one placed across two servers is priced.
+
+The cost of every edge is kept in `costs`, which the critical path reads in place of the
+edge weights. Job.set_edge_weight and ServerPool.reserve / release refresh only the edges of
+the touched stages, and only edges whose cost changed reach the critical path, so pricing
+costs nothing per planner iteration.
+
+    ShuffleCost(job, pool, NicPrice())     # attach, then plan as usual
+'''
+
+class NicPrice:
+    def __init__(self, bandwidth: float = 1.0) -> None:
+        '''
+        bandwidth: NIC bandwidth of servers without their own, and the bandwidth the edge
+            weights were measured at: an edge without a volume moves weight * bandwidth bytes
+        '''
+        self.bandwidth = bandwidth
+
+    def __call__(self, weight: float, volume: Optional[float], source: Optional[Server], target: Optional[Server]) -> float:
+        if source is not None and source is target:
+            return 0.0
+        if volume is None:
+            volume = weight * self.bandwidth
+        return volume / min(self.nic(source), self.nic(target))
+
+    def nic(self, server: Optional[Server]) -> float:
+        if server is None or server.bandwidth is None:
+            return self.bandwidth
+        return server.bandwidth
+
+    def __repr__(self) -> str:
+        return f"NicPrice({self.bandwidth!r})"
+
+
+class ShuffleCost:
+    def __init__(self, job: Job, servers: ServerPool, price = None, volumes: Dict[Tuple[int, int], float] = None) -> None:
+        '''
+        price: called as price(weight, volume, source server, target server), NicPrice() by default
+        volumes: bytes shuffled over every edge, job.volumes by default
+        Attaches the model to job and servers; detach() restores the static weights.
+        '''
+        self.job = job
+        self.servers = servers
+        self.price = price or NicPrice()
+        self.volumes = volumes if volumes is not None else job.volumes
+        self.stage_edges: Dict[int, List[Tuple[int, int]]] = {}
+        self.weights: Dict[Tuple[int, int], float] = {}     # measured weight, kept while grouped
+        self.costs: Dict[Tuple[int, int], float] = {}
+        for edge in job.edges.keys():
+            self.add_edge(edge)
+        job.shuffle_cost = self
+        servers.shuffle_cost = self
+        if job.critical_path is not None:
+            job.critical_path.invalidate()
+
+    def detach(self) -> None:
+        self.job.shuffle_cost = None
+        self.servers.shuffle_cost = None
+        if self.job.critical_path is not None:
+            self.job.critical_path.invalidate()
+
+    def add_edge(self, edge: Tuple[int, int]) -> None:
+        self.stage_edges.setdefault(edge[0], []).append(edge)
+        self.stage_edges.setdefault(edge[1], []).append(edge)
+        self.weights[edge] = self.job.edges[edge]
+        self.costs[edge] = self.edge_cost(edge)
+
+    def edge_cost(self, edge: Tuple[int, int]) -> float:
+        source, target = self.servers.locate(edge[0]), self.servers.locate(edge[1])
+        if self.job.edges[edge] == 0 and (source is None or target is None):
+            return 0.0      # grouped, to be placed together
+        volume = None if self.volumes is None else self.volumes.get(edge)
+        return self.price(self.weights[edge], volume, source, target)
+
+    def edge_changed(self, edge: Tuple[int, int]) -> None:
+        # the job tells its critical path itself
+        if edge not in self.costs:
+            self.add_edge(edge)
+            return
+        if self.job.edges[edge] != 0:
+            self.weights[edge] = self.job.edges[edge]
+        self.costs[edge] = self.edge_cost(edge)
+
+    def stage_moved(self, stage_id: int) -> None:
+        critical_path = self.job.critical_path
+        for edge in self.stage_edges.get(stage_id, ()):
+            cost = self.edge_cost(edge)
+            if cost != self.costs[edge]:
+                self.costs[edge] = cost
+                if critical_path is not None:
+                    critical_path.edge_changed(edge)
+
+    def key(self) -> bytes:
+        '''
+        return: bytes identifying the price, the volumes and the NICs, for plan fingerprints
+        '''
+        volumes = None if self.volumes is None else list(self.volumes.items())
+        nics = [getattr(server, "bandwidth", None) for server in self.servers.servers]
+        return repr((self.price, volumes, nics)).encode("utf-8")
@@ -0,0 +1,164 @@
+'''
+Discrete-event simulation of planned jobs.
+
+A stage becomes ready once every parent finished and its data arrived: grouped edges
+(weight 0) are local transfers and cost nothing, every other edge is a remote shuffle
+taking its weight, or its ShuffleCost price when the job has a cost model attached. A
+ready stage starts when its server has nslot free slots; servers serve ready stages first
+come first served. A stage runs for alpha / nslot + beta. Stages without a placement run
+on slots (and a NIC) of their own, as the JCT estimate assumes.
+
+The JCT estimate prices every shuffle as if it had the NICs to itself. Here the shuffles
+leaving or entering one server share its NIC: they go through it one at a time, first come
+first served, so shuffles that overlap on a server delay each other (nic_wait). Without
+such overlaps the simulated JCT of one plan is its estimate: a plan reserves the slots of
+all of its stages at once, so it never waits for slots by itself. Slot waits only come
+from several jobs sharing servers (simulate with the admissions of a Cluster) once NIC
+waits make them run longer than planned.
+
+Events are (time, kind, stage) in one heap, finishes before starts at equal times so
+freed slots are reused at once. Every job is flattened into lists first, which keeps
+100k-stage DAGs and thousands of jobs to a few seconds.
+'''
+
+from collections import deque
+from heapq import heappush, heappop
+from job import *
+from server import ServerPool
+
+FINISH = 0
+READY = 1
+
+def simulate(jobs: List[Tuple[float, Job, Dict[int, int]]], server_slots: List[int], timeline: bool = False,
+             shared_nics: bool = True) -> Dict:
+    '''
+    jobs: List of (release time, job, placements), placements maps a stage id to the index
+          of its server in server_slots; the jobs share the servers
+    timeline: also return (job index, stage id, server index or None, start, finish) of every stage
+    shared_nics: shuffles through one server wait for its NIC, False to give each its own
+    return: {"jct": job finish - release per job, "makespan", "slot_wait": total time stages
+             waited for slots, "nic_wait": total time shuffles waited for NICs, "timeline" if asked}
+    '''
+    # flatten every stage of every job into global indices
+    duration: List[float] = []
+    nslot: List[int] = []
+    server: List[int] = []
+    owner: List[int] = []
+    children: List[List[Tuple[int, float]]] = []
+    pending: List[int] = []
+    ready_time: List[float] = []
+    stage_ids: List[int] = []
+    remaining: List[int] = []
+    events = []
+
+    for k, (release, job, placements) in enumerate(jobs):
+        base = len(duration)
+        index = {}
+        for stage_id, stage in job.stages.items():
+            g = base + len(index)
+            index[stage_id] = g
+            if stage.nslot <= 0:
+                raise Exception(f"Stage {stage_id} of job {k} has no slot")
+            s = placements.get(stage_id, -1)
+            if s >= 0 and stage.nslot > server_slots[s]:
+                raise Exception(f"Stage {stage_id} of job {k} needs {stage.nslot} slots, server {s} has {server_slots[s]}")
+            duration.append(stage.alpha / stage.nslot + stage.beta)
+            nslot.append(stage.nslot)
+            server.append(s)
+            owner.append(k)
+            children.append([])
+            pending.append(0)
+            ready_time.append(release)
+            stage_ids.append(stage_id)
+        weights = job.shuffle_cost.costs if job.shuffle_cost is not None else job.edges
+        for (i, j), weight in weights.items():
+            children[index[i]].append((index[j], weight))
+            pending[index[j]] += 1
+        remaining.append(len(index))
+        for g in range(base, len(duration)):
+            if pending[g] == 0:
+                heappush(events, (release, READY, g))
+
+    free = list(server_slots)
+    waiting = [deque() for _ in server_slots]
+    start = [0.0] * len(duration)
+    finish = [0.0] * len(duration)
+    job_finish = [release for release, _, _ in jobs]
+    slot_wait = 0.0
+    nic_free = [0.0] * len(server_slots)    # when the NIC of every server is done with its shuffles
+    nic_wait = 0.0
+
+    while events:
+        t, kind, g = heappop(events)
+        s = server[g]
+        if kind == READY:
+            if s < 0 or (not waiting[s] and free[s] >= nslot[g]):
+                if s >= 0:
+                    free[s] -= nslot[g]
+                start[g] = t
+                heappush(events, (t + duration[g], FINISH, g))
+            else:
+                waiting[s].append(g)
+            continue
+
+        finish[g] = t
+        if s >= 0:
+            free[s] += nslot[g]
+            queue = waiting[s]
+            while queue and free[s] >= nslot[queue[0]]:
+                h = queue.popleft()
+                free[s] -= nslot[h]
+                start[h] = t
+                slot_wait += t - ready_time[h]
+                heappush(events, (t + duration[h], FINISH, h))
+        for child, weight in children[g]:
+            arrival = t + weight
+            if shared_nics and weight > 0:
+                nics = {n for n in (s, server[child]) if n >= 0}
+                begin = max([t] + [nic_free[n] for n in nics])
+                arrival = begin + weight
+                for n in nics:
+                    nic_free[n] = arrival
+                nic_wait += begin - t
+            if arrival > ready_time[child]:
+                ready_time[child] = arrival
+            pending[child] -= 1
+            if pending[child] == 0:
+                heappush(events, (ready_time[child], READY, child))
+        k = owner[g]
+        remaining[k] -= 1
+        if remaining[k] == 0:
+            job_finish[k] = t
+
+    if any(remaining):
+        raise Exception("Simulation stalled: a job has a cycle")
+
+    result = {
+        "jct": [job_finish[k] - jobs[k][0] for k in range(len(jobs))],
+        "makespan": max(job_finish, default=0.0),
+        "slot_wait": slot_wait,
+        "nic_wait": nic_wait,
+    }
+    if timeline:
+        result["timeline"] = [(owner[g], stage_ids[g], server[g] if server[g] >= 0 else None, start[g], finish[g])
+                              for g in range(len(duration))]
+    return result
+
+
+def placements_of(servers: ServerPool) -> Dict[int, int]:
+    '''
+    return: Dict[int, int] maps every stage placed through servers to the index of its server
+    '''
+    return {stage_id: servers.position[id(server)] for stage_id, server in servers.stage_server.items()}
+
+
+def simulate_plan(job: Job, servers: ServerPool) -> float:
+    '''
+    Simulated JCT of a planned job alone on its servers. Stages the plan left unplaced are
+    placed at their best fit first (through servers, so an undo log can revert it).
+    '''
+    for stage_id, stage in job.stages.items():
+        if servers.locate(stage_id) is None:
+            servers.place((stage_id, stage))
+    slots = [server.total_slots for server in servers.servers]
+    return simulate([(0.0, job, placements_of(servers))], slots)["jct"][0]
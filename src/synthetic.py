@@ -0,0 +1,133 @@
+'''
+Seeded synthetic jobs and server pools.
+
+Every generator takes the number of stages and a seed and returns a Job whose DoP budget
+is SLOTS_PER_STAGE slots per stage; the same arguments always give the same job. Alpha,
+beta and edge weights are drawn from about the ranges of queries/dags.json, with alpha
+kept above 50 so that Strategy.RATIO never rounds a stage down to 0 slots.
+'''
+
+import random
+from collections import deque
+from job import *
+from server import Server
+
+SLOTS_PER_STAGE = 8
+
+def new_stage(rng: random.Random) -> Stage:
+    return Stage(rng.uniform(50, 400), rng.uniform(1, 10))
+
+
+def new_weight(rng: random.Random) -> float:
+    return rng.uniform(1, 25)
+
+
+def make_job(stages: Dict[int, Stage], edges: Dict[Tuple[int, int], float]) -> Job:
+    return Job(stages, edges, SLOTS_PER_STAGE * len(stages))
+
+
+def chain(nstages: int, seed: int = 0) -> Job:
+    '''
+    s0 -> s1 -> ... -> s(n-1)
+    '''
+    rng = random.Random(seed)
+    stages = {i: new_stage(rng) for i in range(nstages)}
+    edges = {(i, i + 1): new_weight(rng) for i in range(nstages - 1)}
+    return make_job(stages, edges)
+
+
+def fan_in(nstages: int, seed: int = 0) -> Job:
+    '''
+    A wide join: n-1 scans all feeding the last stage
+    '''
+    rng = random.Random(seed)
+    stages = {i: new_stage(rng) for i in range(nstages)}
+    edges = {(i, nstages - 1): new_weight(rng) for i in range(nstages - 1)}
+    return make_job(stages, edges)
+
+
+def diamonds(nstages: int, seed: int = 0, width: int = 4) -> Job:
+    '''
+    Diamonds in series: every split stage feeds `width` stages that merge into the next split stage
+    '''
+    rng = random.Random(seed)
+    stages = {i: new_stage(rng) for i in range(nstages)}
+    edges: Dict[Tuple[int, int], float] = {}
+    split = 0
+    while split < nstages - 1:
+        merge = min(split + width + 1, nstages - 1)
+        for middle in range(split + 1, merge):
+            edges[(split, middle)] = new_weight(rng)
+            edges[(middle, merge)] = new_weight(rng)
+        edges[(split, merge)] = new_weight(rng)
+        split = merge
+    return make_job(stages, edges)
+
+
+def tpcds_tree(nstages: int, seed: int = 0) -> Job:
+    '''
+    TPC-DS-like plan: scans joined two or three at a time up a tree, the last stage is the
+    final aggregate.
+    Stage ids are in topological order, as in the query DAGs.
+    '''
+    rng = random.Random(seed)
+    stages = {i: new_stage(rng) for i in range(nstages)}
+    edges: Dict[Tuple[int, int], float] = {}
+    # every stage but the root feeds a later join, which takes two or three inputs
+    frontier = deque([0])
+    next_id = 1
+    parents = {}
+    while next_id < nstages:
+        node = frontier.popleft()
+        for _ in range(rng.randint(2, 3)):
+            if next_id == nstages:
+                break
+            parents[next_id] = node
+            frontier.append(next_id)
+            next_id += 1
+    # build the tree in reverse so inputs come before the joins consuming them
+    for child, parent in sorted(parents.items(), reverse=True):
+        edges[(nstages - 1 - child, nstages - 1 - parent)] = new_weight(rng)
+    return make_job({i: stages[i] for i in range(nstages)}, edges)
+
+
+def layered(nstages: int, seed: int = 0, width: int = 8) -> Job:
+    '''
+    Layers of `width` stages, each feeding one to three stages of the next layer,
+    with one final stage collecting the last layer.
+    '''
+    rng = random.Random(seed)
+    stages = {i: new_stage(rng) for i in range(nstages)}
+    edges: Dict[Tuple[int, int], float] = {}
+    last = nstages - 1
+    for i in range(last):
+        layer_start = (i // width + 1) * width
+        layer_end = min(layer_start + width, last)
+        if layer_start >= last:
+            edges[(i, last)] = new_weight(rng)
+            continue
+        for j in rng.sample(range(layer_start, layer_end), min(rng.randint(1, 3), layer_end - layer_start)):
+            edges[(i, j)] = new_weight(rng)
+    return make_job(stages, edges)
+
+
+SHAPES = {
+    "chain": chain,
+    "fan_in": fan_in,
+    "diamonds": diamonds,
+    "tpcds_tree": tpcds_tree,
+    "layered": layered,
+}
+
+
+def server_pool(total_slots: int, seed: int = 0, min_slots: int = 8, max_slots: int = 64) -> List[Server]:
+    '''
+    Servers of min_slots..max_slots slots each, at least total_slots in all
+    '''
+    rng = random.Random(seed)
+    servers = []
+    while total_slots > 0:
+        nslot = rng.randint(min_slots, max_slots)
+        servers.append(Server(nslot))
+        total_slots -= nslot
+    return servers
@@ -0,0 +1,136 @@
+import json
+from job import *
+from typing import Iterator, IO
+
+'''
+Streaming workload loader.
+
+A workload file is either a JSON array of DAG records (queries/dags.json), NDJSON with
+one DAG record per line, or a compiled workload (compiled.py). Records are decoded one at a time, so planning starts as soon as
+the first job is read and memory stays bounded by the largest single job.
+'''
+
+READ_SIZE = 1 << 16
+MAX_RECORD_SIZE = 1 << 28   # characters one record may span before it is rejected
+DECODE_MARGIN = 64          # a decode error further from the end of the buffer is not a cut record
+COMPILED_MAGIC = b"DITTODAG"
+
+def iter_job_records(f: IO[str]) -> Iterator[Dict]:
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    read_size = READ_SIZE
+    eof = False
+    in_array = None
+    after = "["     # in an array: what came last, "[", "record" or ","
+
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                if in_array:
+                    raise Exception("Unterminated JSON array of jobs")
+                return
+            buf = f.read(read_size)
+            pos = 0
+            eof = not buf
+            continue
+
+        if in_array is None:
+            in_array = buf[pos] == "["
+            if in_array:
+                pos += 1
+            continue
+        if in_array:
+            # exactly one comma between two records, none after the last one
+            if buf[pos] == "]":
+                if after == ",":
+                    raise Exception("Trailing comma in the JSON array of jobs")
+                return
+            if buf[pos] == ",":
+                if after != "record":
+                    raise Exception("Missing job record before a comma in the JSON array of jobs")
+                after = ","
+                pos += 1
+                continue
+            if after == "record":
+                raise Exception("Missing comma between job records in the JSON array of jobs")
+
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            # an error well before the end of the buffer is malformed input, not a record cut
+            # by the read (only an unterminated string can start that far back)
+            if eof or (e.pos + DECODE_MARGIN < len(buf) and not e.msg.startswith("Unterminated string")):
+                raise
+            if len(buf) - pos > MAX_RECORD_SIZE:
+                raise Exception(f"Job record longer than {MAX_RECORD_SIZE} characters") from e
+            # the record continues past the buffer: read more, in larger steps for big records
+            more = f.read(read_size)
+            read_size *= 2
+            buf = buf[pos:] + more
+            pos = 0
+            eof = not more
+            continue
+        read_size = READ_SIZE
+        pos = end
+        after = "record"
+        yield record
+
+
+def build_job(job_record: Dict, nslots: int, compact: bool = False) -> Job:
+    '''
+    Build a Job from one DAG record of the workload file.
+    Stage ids follow the order of job_record["stages"]; stage names are checked in the
+    same pass, children naming a later stage are resolved once all names are known.
+    '''
+    stages: Dict[int, Stage] = {}
+    stage_lookup: Dict[str, int] = {}
+    children: List[Tuple[int, str, float]] = []
+    volumes: Dict[Tuple[int, str], float] = {}     # optional "bytes" of children
+    
+    for stage in job_record["stages"]:
+        stage_name = stage["name"]
+        if stage_name in stage_lookup:
+            raise Exception(f"Duplicate stage name: {stage_name}")
+        stage_id = len(stages)
+        stage_lookup[stage_name] = stage_id
+        stages[stage_id] = Stage(stage["alpha"], stage["beta"], 0, stage.get("memory", 0), stage.get("disk", 0))
+        for child in stage["children"]:
+            children.append((stage_id, child["name"], child["weight"]))
+            if "bytes" in child:
+                volumes[(stage_id, child["name"])] = child["bytes"]
+
+    edges: Dict[Tuple[int, int], float] = {}
+    for stage_id, child_name, weight in children:
+        child_id = stage_lookup.get(child_name)
+        if child_id is None:
+            raise Exception(f"Stage {child_name} not found")
+        edges[(stage_id, child_id)] = weight
+
+    job = Job(stages, edges, nslots)
+    if compact:
+        from compact_job import CompactJob
+        job = CompactJob.from_job(job, list(stage_lookup.keys()))
+    if volumes:
+        # stage ids are dense in both representations
+        job.volumes = {(stage_id, stage_lookup[child_name]): volume for (stage_id, child_name), volume in volumes.items()}
+    return job
+
+
+def load_jobs(path: str, nslots: int, compact: bool = False) -> Iterator[Tuple[str, Job]]:
+    '''
+    yield : (job name, Job) for every DAG record in the file, in file order
+    A compiled workload (see compiled.py) is mapped instead of parsed.
+    '''
+    with open(path, "rb") as f:
+        compiled = f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+    if compiled:
+        from compiled import load_compiled
+        yield from load_compiled(path, nslots)
+        return
+
+    with open(path, "r") as f:
+        for job_record in iter_job_records(f):
+            yield job_record["name"], build_job(job_record, nslots, compact)
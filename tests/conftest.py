@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the planner modules are flat in src/, imported as in src/__main__.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,47 @@
+import pytest
+from joint_optimization import *
+import synthetic
+
+
+def plan_state(job: Job, pool: ServerPool):
+    return (dict(job.edges), [stage.nslot for stage in job.stages.values()],
+            {stage_id: pool.position[id(server)] for stage_id, server in pool.stage_server.items()})
+
+
+def setup():
+    job = synthetic.tpcds_tree(60, seed=4)
+    pool = ServerPool(synthetic.server_pool(job.nslot, seed=4))
+    return job, pool
+
+
+@pytest.mark.parametrize("strategy", [Strategy.DITTO, Strategy.DITTO_COST])
+@pytest.mark.parametrize("step", [1, 3])
+def test_resumed_plan_matches_unbounded_run(strategy, step):
+    job, pool = setup()
+    jct = joint_optimization(job, pool, strategy)
+    expected = plan_state(job, pool)
+
+    job, pool = setup()
+    plan = AnytimePlan(job, pool, strategy)
+    rounds = 0
+    while not plan.converged:
+        budget = Budget(iterations=step)
+        resumed_jct = plan.refine(budget)
+        rounds += 1
+        assert budget.hit or plan.converged
+    assert rounds > 1
+    assert resumed_jct == pytest.approx(jct)
+    assert plan_state(job, pool) == expected
+    assert plan.refine(Budget(iterations=step)) == pytest.approx(jct)
+
+
+def test_spent_budget_keeps_a_valid_plan():
+    job, pool = setup()
+    plan = AnytimePlan(job, pool, Strategy.DITTO)
+    budget = Budget(seconds=0)
+    jct = plan.refine(budget)
+    assert budget.hit and not plan.converged
+    assert jct == pytest.approx(estimate_jct(job))
+    assert all(stage.nslot >= 1 for stage in job.stages.values())
+    for server in pool.servers:
+        assert server.available_slots >= 0
@@ -0,0 +1,30 @@
+from batch import batch_plan, plan_job
+from joint_optimization import *
+import synthetic
+
+STRATEGIES = [Strategy.DITTO, Strategy.RATIO]
+
+
+def jobs(n: int):
+    return [synthetic.tpcds_tree(20 + 5 * k, seed=k) for k in range(n)]
+
+
+def test_results_in_input_order():
+    configs = [[server.total_slots for server in synthetic.server_pool(200, seed=0)], [32, 32, 64, 96]]
+    expected = [plan_job(job.copy(), configs, STRATEGIES) for job in jobs(9)]
+    assert list(batch_plan(jobs(9), configs, STRATEGIES, workers=3)) == expected
+
+
+def test_in_flight_jobs_are_bounded():
+    taken = []
+
+    def stream():
+        for k, job in enumerate(jobs(12)):
+            taken.append(k)
+            yield job
+
+    results = batch_plan(stream(), [[64, 64, 128]], STRATEGIES, workers=1)
+    next(results)
+    # the first result comes back once 4 jobs per worker are in flight
+    assert len(taken) == 4
+    assert len(list(results)) == 11
@@ -0,0 +1,76 @@
+import random
+import pytest
+import instrumentation
+from beam_search import beam_planner, beam_search
+from joint_optimization import *
+import synthetic
+
+
+def plan(budget: Budget = None) -> instrumentation.Recorder:
+    job = synthetic.tpcds_tree(60, seed=2)
+    job.nslot = 200
+    recorder = instrumentation.enable()
+    try:
+        beam_search(job, [Server(32) for _ in range(8)], width=4, k=3, budget=budget)
+    finally:
+        instrumentation.disable()
+    return recorder
+
+
+def test_max_iterations_stops_the_beam():
+    unlimited = plan().counters
+    # enough for DITTO to converge, not for the whole beam
+    budget = Budget(iterations=unlimited["ditto.iterations"] + 3)
+    limited = plan(budget).counters
+    assert budget.hit
+    assert limited["beam.levels"] < unlimited["beam.levels"]
+    assert limited["beam.states"] <= 3 + 3 * 3
+
+
+def busy_pool(seed: int) -> ServerPool:
+    # other jobs hold part of every server, and buckets were reordered by their releases
+    rng = random.Random(seed)
+    pool = ServerPool([Server(rng.choice([32, 48, 64]), rng.uniform(200, 400), rng.uniform(200, 400)) for _ in range(10)])
+    other = pool.view("other")
+    for stage_id in range(30):
+        server = pool.servers[rng.randrange(10)]
+        stage = Stage(1.0, 0.0, rng.randint(1, 8), rng.uniform(0, 30), rng.uniform(0, 30))
+        if server.can_place((stage_id, stage)):
+            other.reserve(server, (stage_id, stage))
+    for stage_id in rng.sample(sorted(other.stage_server), 10):
+        other.release(stage_id)
+    return pool
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_detached_pool_fits_like_the_real_one(seed):
+    rng = random.Random(seed)
+    pool = busy_pool(seed).view("job")
+    detached = pool.detached()
+    for stage_id in range(60):
+        stage = Stage(1.0, 0.0, rng.randint(1, 6), rng.uniform(0, 20), rng.uniform(0, 20))
+        server = pool.best_fit(stage.nslot, stage.memory, stage.disk)
+        copy = detached.best_fit(stage.nslot, stage.memory, stage.disk)
+        assert (server is None) == (copy is None)
+        if server is None:
+            break
+        assert pool.position[id(server)] == detached.position[id(copy)]
+        pool.reserve(server, (stage_id, stage))
+        detached.reserve(copy, (stage_id, stage))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_best_plan_places_on_a_busy_pool(seed):
+    job = synthetic.tpcds_tree(40, seed=seed)
+    job.nslot = 150
+    for stage in job.stages.values():
+        stage.memory, stage.disk = 2.0, 2.0
+    pool = busy_pool(seed).view("job")
+    jct = beam_search(job, pool, width=3, k=2)
+    assert jct == pytest.approx(estimate_jct(job))
+    assert all(server.available_slots >= 0 and server.available_memory >= 0 for server in pool.servers)
+
+
+def test_beam_refuses_the_cost_objective():
+    with pytest.raises(ValueError):
+        beam_planner(2, 2, 0)(synthetic.chain(3), [Server(64)], Strategy.DITTO_COST)
@@ -0,0 +1,32 @@
+import pytest
+import cluster
+from cluster import Cluster
+from joint_optimization import *
+import synthetic
+
+
+def test_admit_rejects_when_rounding_runs_out_of_slots(monkeypatch):
+    def short(job, servers, strategy):
+        raise NotEnoughSlots(f"{job.nslot} slots are not enough")
+
+    job = synthetic.chain(4, seed=0)
+    requested = job.nslot
+    pool = Cluster([Server(16), Server(16)], Strategy.DITTO)
+    monkeypatch.setattr(cluster, "joint_optimization", short)
+    assert pool.admit(job) is None
+    assert job.nslot == requested
+    assert pool.free_slots == 32
+    assert all(server.available_slots == 16 for server in pool.pool.servers)
+
+    monkeypatch.undo()
+    assert pool.admit(job) is not None
+
+
+def test_admit_lets_planner_bugs_through(monkeypatch):
+    def broken(job, servers, strategy):
+        raise ZeroDivisionError("a stage with 0 slots")
+
+    pool = Cluster([Server(16), Server(16)], Strategy.DITTO)
+    monkeypatch.setattr(cluster, "joint_optimization", broken)
+    with pytest.raises(ZeroDivisionError):
+        pool.admit(synthetic.chain(4, seed=0))
@@ -0,0 +1,50 @@
+import pytest
+pytest.importorskip("numpy")
+from bottom_up_dop import bottom_up_dop, get_layers
+from compact_job import CompactJob
+from critical_path import CriticalPath
+from joint_optimization import longest_path_dag_with_weights_and_path
+from job import UndoLog
+import synthetic
+
+
+@pytest.mark.parametrize("make", [synthetic.chain, synthetic.fan_in, synthetic.diamonds, synthetic.layered, synthetic.tpcds_tree])
+def test_same_plan_as_dict_job(make):
+    job = make(300, seed=4)
+    job.nslot = 700
+    compact = CompactJob.from_job(job)
+    bottom_up_dop(job)
+    bottom_up_dop(compact)
+    assert get_layers(compact) == get_layers(job)
+    assert [stage.nslot for stage in compact.stages.values()] == [stage.nslot for stage in job.stages.values()]
+    assert longest_path_dag_with_weights_and_path(compact.stages, compact.edges) == \
+        longest_path_dag_with_weights_and_path(job.stages, job.edges)
+    assert CriticalPath(compact).path() == CriticalPath(job).path()
+
+
+def test_edge_weights_stay_in_sync():
+    compact = CompactJob.from_job(synthetic.layered(100, seed=1))
+    compact.nslot = 300
+    bottom_up_dop(compact)
+    critical_path = CriticalPath(compact)
+    compact.critical_path = critical_path
+    for i, j, _ in critical_path.edge_attributes():
+        compact.set_edge_weight((i, j), 0)
+        assert compact.edges[(i, j)] == 0
+        assert compact.weights[compact.edges.index((i, j))] == 0
+    fresh = CriticalPath(CompactJob.from_job(compact))
+    assert critical_path.path() == fresh.path()
+
+
+def test_dop_rollback():
+    compact = CompactJob.from_job(synthetic.tpcds_tree(100, seed=1))
+    compact.nslot = 200
+    bottom_up_dop(compact)
+    before = compact.nslot_array.copy()
+    compact.undo_log = UndoLog()
+    mark = compact.undo_log.checkpoint()
+    compact.nslot = 400
+    bottom_up_dop(compact)
+    assert compact.nslot_array.sum() == 400
+    compact.undo_log.rollback(mark)
+    assert (compact.nslot_array == before).all()
@@ -0,0 +1,56 @@
+import json
+import os
+import pytest
+np = pytest.importorskip("numpy")
+from compiled import compile_workload, is_stale, load_compiled
+from workload import load_jobs
+
+DAGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "queries", "dags.json")
+
+
+def check_same(compiled_jobs, source_jobs):
+    assert [name for name, _ in compiled_jobs] == [name for name, _ in source_jobs]
+    for (_, compiled), (_, source) in zip(compiled_jobs, source_jobs):
+        assert list(compiled.names) == list(source.names)
+        for array in ["alpha", "beta", "memory", "disk", "offsets", "targets", "weights"]:
+            assert np.array_equal(getattr(compiled, array), getattr(source, array))
+        assert compiled.volumes == source.volumes
+
+
+def test_round_trip(tmp_path):
+    source = tmp_path / "dags.json"
+    source.write_text(open(DAGS).read())
+    compile_workload(str(source), str(tmp_path / "dags.bin"))
+    assert not is_stale(str(tmp_path / "dags.bin"))
+    check_same(list(load_compiled(str(tmp_path / "dags.bin"), 100)), list(load_jobs(str(source), 100, compact=True)))
+    # load_jobs maps a compiled file too
+    assert [name for name, _ in load_jobs(str(tmp_path / "dags.bin"), 100)] == [name for name, _ in load_jobs(str(source), 100)]
+
+
+def test_stale_file_is_rebuilt(tmp_path):
+    source = tmp_path / "dags.json"
+    records = json.load(open(DAGS))
+    source.write_text(json.dumps(records[:1]))
+    compile_workload(str(source), str(tmp_path / "dags.bin"))
+
+    source.write_text(json.dumps(records))
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert is_stale(str(tmp_path / "dags.bin"))
+    check_same(list(load_compiled(str(tmp_path / "dags.bin"), 100)), list(load_jobs(str(source), 100, compact=True)))
+    assert not is_stale(str(tmp_path / "dags.bin"))
+
+
+def test_volumes_round_trip(tmp_path):
+    source = tmp_path / "dags.json"
+    records = json.load(open(DAGS))
+    for record in records:
+        for i, stage in enumerate(record["stages"]):
+            for k, child in enumerate(stage["children"]):
+                if (i + k) % 2 == 0:
+                    child["bytes"] = 1000.0 * (i + 1) + k
+    source.write_text(json.dumps(records))
+    compile_workload(str(source), str(tmp_path / "dags.bin"))
+    compiled_jobs = list(load_compiled(str(tmp_path / "dags.bin"), 100))
+    check_same(compiled_jobs, list(load_jobs(str(source), 100, compact=True)))
+    assert all(job.volumes for _, job in compiled_jobs)
@@ -0,0 +1,34 @@
+import random
+import pytest
+from critical_path import CriticalPath, get_critical_path
+from joint_optimization import *
+
+
+def random_job(rng: random.Random, nstages: int) -> Job:
+    stages = {v: Stage(rng.uniform(1, 100), rng.uniform(0, 5), rng.randint(1, 8)) for v in range(nstages)}
+    edges = {}
+    for _ in range(rng.randint(nstages - 1, 3 * nstages)):
+        i, j = sorted(rng.sample(range(nstages), 2))
+        edges[(i, j)] = float(rng.randint(0, 20))
+    return Job(stages, edges, 8 * nstages)
+
+
+@pytest.mark.parametrize("seed", range(15))
+def test_incremental_matches_full_dfs(seed):
+    rng = random.Random(seed)
+    job = random_job(rng, rng.randint(2, 40))
+    critical_path = get_critical_path(job)
+    edges = list(job.edges.keys())
+    for _ in range(60):
+        if rng.random() < 0.5:
+            job.set_edge_weight(rng.choice(edges), float(rng.choice([0, rng.randint(1, 20)])))
+        else:
+            job.set_stage_nslot(rng.choice(list(job.stages.keys())), rng.randint(1, 8))
+        assert critical_path.edge_attributes() == longest_path_dag_with_weights_and_path(job.stages, job.edges)
+        assert critical_path.distance == CriticalPath(job).distance
+
+
+def test_estimate_is_critical_path_length():
+    job = random_job(random.Random(3), 30)
+    jct = joint_optimization(job, [Server(n) for n in (16, 29, 25, 13, 31, 47)], Strategy.DITTO)
+    assert jct == pytest.approx(max(CriticalPath(job).distance.values()))
@@ -0,0 +1,45 @@
+import random
+import pytest
+from decompose import deal_slots, decomposed_plan, split_parts
+from joint_optimization import *
+import synthetic
+
+
+def plan_state(job: Job, pool: ServerPool):
+    return (dict(job.edges), [stage.nslot for stage in job.stages.values()],
+            {stage_id: pool.position[id(server)] for stage_id, server in pool.stage_server.items()})
+
+
+@pytest.mark.parametrize("make", [synthetic.tpcds_tree, synthetic.layered, synthetic.diamonds])
+def test_one_part_plans_like_the_whole_job(make):
+    job = make(60, seed=3)
+    assert len(split_parts(job, 40)) == 1
+    pool = ServerPool(synthetic.server_pool(job.nslot, seed=3))
+    jct = decomposed_plan(job, pool, min_stages=40)
+
+    whole = make(60, seed=3)
+    whole_pool = ServerPool(synthetic.server_pool(whole.nslot, seed=3))
+    assert jct == pytest.approx(joint_optimization(whole, whole_pool, Strategy.DITTO))
+    assert plan_state(job, pool) == plan_state(whole, whole_pool)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_deal_slots_totals(seed):
+    rng = random.Random(seed)
+    pool = ServerPool([Server(rng.randint(8, 64)) for _ in range(rng.randint(1, 10))])
+    for server in pool.servers[::2]:
+        pool.reserve(server, (id(server), Stage(1.0, 0.0, rng.randint(0, server.total_slots))))
+    budgets = [rng.randint(1, 100) for _ in range(rng.randint(1, 8))]
+    shares = deal_slots(pool, budgets)
+
+    free = [server.available_slots for server in pool.servers]
+    total = sum(free)
+    assert sum(n for part in shares for _, n in part) == total
+    for i, slots in enumerate(free):
+        assert sum(n for part in shares for j, n in part if j == i) == slots
+    # every part gets its cut of the free slots laid end to end
+    bound = 0
+    for k, part in enumerate(shares):
+        assert all(n > 0 for _, n in part)
+        assert sum(n for _, n in part) == total * sum(budgets[:k + 1]) // sum(budgets) - bound
+        bound += sum(n for _, n in part)
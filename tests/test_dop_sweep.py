@@ -0,0 +1,59 @@
+import pytest
+np = pytest.importorskip("numpy")
+from dop_sweep import dop_sweep, knee_point, pareto_frontier
+
+
+def test_pareto_frontier():
+    slots = np.array([10, 20, 20, 30, 40, 50, 60])
+    jct = np.array([100.0, 80.0, 90.0, 85.0, 50.0, 50.0, np.inf])
+    # 20 slots at 90 and 30 at 85 lose to 20 at 80, 50 at 50 to 40 at 50, inf is never on it
+    assert pareto_frontier(slots, jct).tolist() == [0, 1, 4]
+
+
+def test_pareto_frontier_unsorted_input():
+    slots = np.array([40, 10, 30, 20])
+    jct = np.array([10.0, 40.0, 20.0, 30.0])
+    assert pareto_frontier(slots, jct).tolist() == [1, 3, 2, 0]
+
+
+def test_knee_point():
+    slots = np.array([10, 20, 30, 40, 50])
+    jct = np.array([100.0, 30.0, 20.0, 15.0, 12.0])
+    frontier = pareto_frontier(slots, jct)
+    assert knee_point(slots, jct, frontier) == 1
+    assert knee_point(slots, jct, frontier[:0]) is None
+
+
+def test_sweep_of_a_chain():
+    from job import Job, Stage
+    job = Job({0: Stage(100.0, 1.0), 1: Stage(400.0, 2.0)}, {(0, 1): 5.0}, 0)
+    sweep = dop_sweep(job, np.array([1, 2, 3, 30, 300, 30]))
+    assert sweep.budgets.tolist() == [1, 2, 3, 30, 300]
+    assert np.isinf(sweep.jct[0])
+    assert sweep.slots[1:].tolist() == [2, 3, 30, 300]
+    assert np.all(np.diff(sweep.jct[1:]) < 0)
+    assert sweep.cheapest(max_jct=sweep.jct[3]) == 30
+    assert sweep.cheapest(max_jct=0) is None
+
+
+def planned_jct(job, budget: int) -> float:
+    from bottom_up_dop import bottom_up_dop
+    from joint_optimization import estimate_jct
+    job = job.copy()
+    job.nslot = budget
+    bottom_up_dop(job)
+    return estimate_jct(job)
+
+
+def test_sweep_matches_the_planner():
+    import os
+    import synthetic
+    from workload import load_jobs
+    dags = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "queries", "dags.json")
+    jobs = [job for _, job in load_jobs(dags, 100)]
+    jobs += [make(80, seed=3) for make in (synthetic.chain, synthetic.fan_in, synthetic.layered, synthetic.tpcds_tree)]
+    for job in jobs:
+        budgets = np.array([len(job.stages), len(job.stages) + 3, 13, 57, 120, 333, 1000])
+        budgets = budgets[budgets >= len(job.stages)]
+        sweep = dop_sweep(job, budgets)
+        assert sweep.jct.tolist() == pytest.approx([planned_jct(job, int(budget)) for budget in sweep.budgets])
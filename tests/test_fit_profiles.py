@@ -0,0 +1,30 @@
+import pytest
+np = pytest.importorskip("numpy")
+from fit_profiles import ProfileFit
+
+
+def test_recovers_known_alpha_beta(tmp_path):
+    rng = np.random.default_rng(0)
+    truth = {("q1", "s1"): (120.0, 3.0), ("q1", "s2"): (40.0, 0.5), ("q2", "s1"): (300.0, 10.0)}
+    lines = ["job,stage,dop,duration"]
+    for (job, stage), (alpha, beta) in truth.items():
+        for dop in rng.integers(1, 64, 50):
+            lines.append(f"{job},{stage},{dop},{alpha / dop + beta}")
+    path = tmp_path / "runs.csv"
+    path.write_text("\n".join(lines) + "\n")
+
+    profile = ProfileFit()
+    profile.add_file(str(path), chunk=7)
+    alpha, beta = profile.fit(np.zeros(len(profile.index)))
+    for key, (true_alpha, true_beta) in truth.items():
+        row = profile.index[key]
+        assert alpha[row] == pytest.approx(true_alpha)
+        assert beta[row] == pytest.approx(true_beta, abs=1e-6)
+
+
+def test_one_dop_keeps_beta():
+    profile = ProfileFit()
+    profile.add([("q1", "s1")] * 3, np.array([4.0, 4.0, 4.0]), np.array([27.0, 27.0, 27.0]))
+    alpha, beta = profile.fit(np.array([2.0]))
+    assert beta[0] == 2.0
+    assert alpha[0] == pytest.approx(100.0)
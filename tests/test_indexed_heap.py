@@ -0,0 +1,59 @@
+import random
+import pytest
+from indexed_heap import IndexedHeap
+
+
+def expected_order(model):
+    # by descending priority, equal priorities in insertion order
+    return [key for key, _ in sorted(model.items(), key=lambda item: (-item[1][0], item[1][1]))]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_a_sorted_model(seed):
+    rng = random.Random(seed)
+    items = [(key, float(rng.randint(0, 20))) for key in range(rng.randint(0, 30))]
+    heap = IndexedHeap(items)
+    model = {key: (priority, i) for i, (key, priority) in enumerate(items)}
+    counter = len(items)
+    for _ in range(300):
+        op = rng.random()
+        if op < 0.3 or not model:
+            key = counter + 1000
+            priority = float(rng.randint(0, 20))
+            heap.push(key, priority)
+            model[key] = (priority, counter)
+            counter += 1
+        elif op < 0.6:
+            key = rng.choice(list(model))
+            priority = float(rng.randint(0, 20))
+            heap.update(key, priority)
+            model[key] = (priority, model[key][1])
+        elif op < 0.8:
+            key = rng.choice(list(model))
+            heap.remove(key)
+            del model[key]
+        else:
+            key, priority = heap.pop()
+            assert key == expected_order(model)[0]
+            assert priority == model.pop(key)[0]
+        assert len(heap) == len(model)
+        assert list(heap) == expected_order(model)
+        assert all(key in heap and heap.priority(key) == priority for key, (priority, _) in model.items())
+
+
+def test_iteration_stops_early_without_changing_the_heap():
+    heap = IndexedHeap([("a", 1.0), ("b", 5.0), ("c", 3.0), ("d", 5.0)])
+    keys = iter(heap)
+    assert [next(keys), next(keys)] == ["b", "d"]
+    assert heap.peek() == ("b", 5.0)
+    assert list(heap) == ["b", "d", "c", "a"]
+
+
+def test_push_twice_and_remove_missing():
+    heap = IndexedHeap([("a", 1.0)])
+    with pytest.raises(Exception):
+        heap.push("a", 2.0)
+    with pytest.raises(KeyError):
+        heap.remove("b")
+    heap.remove("a")
+    assert len(heap) == 0 and "a" not in heap
@@ -0,0 +1,58 @@
+import instrumentation
+from instrumentation import Recorder
+from joint_optimization import *
+import synthetic
+
+
+def test_phases_nest_as_stacks():
+    recorder = Recorder()
+    ends = []
+    recorder.on("inner", lambda name, seconds: ends.append(name))
+    with recorder.phase("outer"):
+        with recorder.phase("inner"):
+            pass
+        with recorder.phase("inner"):
+            with recorder.phase("leaf"):
+                pass
+    with recorder.phase("inner"):
+        pass
+    assert recorder.calls == {"outer;inner;leaf": 1, "outer;inner": 2, "outer": 1, "inner": 1}
+    assert ends == ["inner"] * 3
+    assert not recorder.stack
+    folded = dict(line.rsplit(" ", 1) for line in recorder.folded())
+    assert set(folded) == set(recorder.timers)
+    assert all(int(us) >= 0 for us in folded.values())
+
+
+def test_phase_stack_unwinds_on_error():
+    recorder = Recorder()
+    try:
+        with recorder.phase("outer"):
+            with recorder.phase("inner"):
+                raise ValueError
+    except ValueError:
+        pass
+    assert not recorder.stack
+    assert recorder.calls == {"outer;inner": 1, "outer": 1}
+
+
+def test_planner_hooks_record_only_when_enabled():
+    job = synthetic.tpcds_tree(40, seed=0)
+    recorder = instrumentation.enable()
+    try:
+        joint_optimization(job.copy(), [Server(n.total_slots) for n in synthetic.server_pool(job.nslot, seed=0)], Strategy.DITTO)
+    finally:
+        assert instrumentation.disable() is recorder
+    assert recorder.counters["ditto.iterations"] > 0
+    # every nested phase runs inside a recorded parent
+    assert all(";" not in key or key.rpartition(";")[0] in recorder.timers for key in recorder.timers)
+
+    merged = Recorder()
+    merged.merge(recorder)
+    merged.merge(recorder)
+    assert merged.counters["ditto.iterations"] == 2 * recorder.counters["ditto.iterations"]
+    assert merged.calls == {key: 2 * n for key, n in recorder.calls.items()}
+
+    counters = dict(recorder.counters)
+    joint_optimization(job.copy(), [Server(n.total_slots) for n in synthetic.server_pool(job.nslot, seed=0)], Strategy.DITTO)
+    assert recorder.counters == counters
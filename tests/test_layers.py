@@ -0,0 +1,57 @@
+from bottom_up_dop import get_depth, get_layers
+from critical_path import get_critical_path
+from job import Job, Stage, UndoLog
+import synthetic
+
+
+def check_layers(job: Job):
+    depth = get_depth(job.stages, job.edges)
+    layers = get_layers(job)
+    assert sorted(v for layer in layers for v in layer) == sorted(job.stages.keys())
+    for d, layer in enumerate(layers):
+        assert all(depth[v] == d for v in layer)
+
+
+def test_layers_follow_an_edge_swapped_at_the_same_count():
+    job = Job({v: Stage(1.0, 0.0, 1) for v in range(4)}, {(0, 1): 1.0, (1, 2): 1.0}, 4)
+    assert get_layers(job) == [[0, 3], [1], [2]]
+    job.remove_edge((1, 2))
+    job.add_edge((2, 3), 1.0)
+    check_layers(job)
+    assert get_layers(job) == [[0, 2], [1, 3]]
+
+
+def test_grouping_keeps_the_cached_layers():
+    job = synthetic.layered(60, seed=3)
+    layers = get_layers(job)
+    job.set_edge_weight(next(iter(job.edges)), 0)
+    assert get_layers(job) is layers
+
+
+def test_copy_shares_layers_until_its_edges_change():
+    job = synthetic.tpcds_tree(40, seed=4)
+    layers = get_layers(job)
+    other = job.copy()
+    assert get_layers(other) is layers
+    edge = next(iter(other.edges))
+    weight = other.edges[edge]
+    other.remove_edge(edge)
+    check_layers(other)
+    other.add_edge(edge, weight)
+    check_layers(other)
+    assert get_layers(job) is layers
+
+
+def test_edge_changes_roll_back():
+    job = Job({v: Stage(1.0, 0.0, 1) for v in range(3)}, {(0, 1): 2.0}, 3)
+    path = get_critical_path(job)
+    job.undo_log = UndoLog()
+    mark = job.undo_log.checkpoint()
+    job.add_edge((1, 2), 5.0)
+    assert path.path() == [0, 1, 2]
+    job.remove_edge((0, 1))
+    assert path.path() == [1, 2]
+    job.undo_log.rollback(mark)
+    assert job.edges == {(0, 1): 2.0}
+    check_layers(job)
+    assert path.path() == [0, 1]
@@ -0,0 +1,80 @@
+import random
+import pytest
+from replan import *
+
+
+def check_pool(pool: ServerPool):
+    for server in pool.servers:
+        assert server.available_slots >= 0
+        assert server.available_memory is None or server.available_memory >= 0
+        assert server.available_disk is None or server.available_disk >= 0
+        assert server.total_slots - server.available_slots == sum(stage.nslot for stage in server.placed_stages.values())
+    for key, bucket in pool.buckets.items():
+        assert all(server.available_slots == key for server in bucket.values())
+
+
+def brute_best_fit(pool: ServerPool, nslot, memory, disk):
+    fits = [server for server in pool.servers if server.fits(nslot, memory, disk)]
+    if not fits:
+        return None
+    fewest = min(server.available_slots for server in fits)
+    return min((server for server in fits if server.available_slots == fewest),
+               key=lambda server: server.residual(nslot, memory, disk))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_vector_best_fit_never_overcommits(seed):
+    rng = random.Random(seed)
+    pool = ServerPool([Server(rng.randint(4, 32), rng.choice([None, rng.uniform(16, 128)]), rng.choice([None, rng.uniform(50, 500)]))
+                       for _ in range(rng.randint(1, 12))])
+    placed = []
+    for stage_id in range(200):
+        stage = Stage(1.0, 0.0, rng.randint(1, 12), rng.uniform(0, 40), rng.uniform(0, 150))
+        expected = brute_best_fit(pool, stage.nslot, stage.memory, stage.disk)
+        found = pool.best_fit(stage.nslot, stage.memory, stage.disk)
+        assert (found is None) == (expected is None)
+        if found is not None:
+            assert found.available_slots == expected.available_slots
+            assert found.fits(stage.nslot, stage.memory, stage.disk)
+            pool.reserve(found, (stage_id, stage))
+            placed.append(stage_id)
+        if placed and rng.random() < 0.3:
+            pool.release(placed.pop(rng.randrange(len(placed))))
+        check_pool(pool)
+
+
+def vector_plan():
+    stages = {0: Stage(10, 1, 0, 60), 1: Stage(10, 1, 0, 60), 2: Stage(10, 1, 0, 10)}
+    job = Job(stages, {(0, 1): 5, (1, 2): 5}, 30)
+    pool = ServerPool([Server(20, 200), Server(20, 50), Server(25, 500)])
+    weights = dict(job.edges)
+    joint_optimization(job, pool, Strategy.DITTO)
+    return job, pool, weights
+
+
+def test_replanned_group_fits_memory():
+    job, pool, weights = vector_plan()
+    result = replan(job, pool, PoolDelta(removed=[0]), weights)
+    check_pool(pool)
+    assert result["moved"] == 2
+    # the 20 slots and 120 memory of the grouped pair only fit on the last server
+    assert pool.locate(0) is pool.locate(1) is pool.servers[1]
+
+
+def test_failed_repair_rolls_back():
+    job, pool, weights = vector_plan()
+    servers = list(pool.servers)
+    before = ([server.free() for server in servers], dict(job.edges), [stage.nslot for stage in job.stages.values()])
+    with pytest.raises(Exception):
+        replan(job, pool, PoolDelta(removed=[0, 2]), weights)
+    assert pool.servers == servers
+    assert ([server.free() for server in servers], dict(job.edges), [stage.nslot for stage in job.stages.values()]) == before
+    check_pool(pool)
+
+
+def test_added_server_vectors():
+    job, pool, weights = vector_plan()
+    replan(job, pool, PoolDelta(added=[(16, 100, None), 8], resized={2: 5}), weights)
+    assert pool.servers[-1].free() == (8, None, None)
+    assert pool.servers[3].total_memory == 100
+    check_pool(pool)
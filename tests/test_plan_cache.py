@@ -0,0 +1,79 @@
+import os
+import plan_cache
+from joint_optimization import *
+from plan_cache import Plan, PlanCache, fingerprint
+import synthetic
+
+
+def test_fingerprint_tells_placed_stages_apart():
+    job = synthetic.chain(3, seed=0)
+    for stage_id in job.stages.keys():
+        job.set_stage_nslot(stage_id, 2)
+    keys = set()
+    for placed in [None, 0, 1]:
+        pool = ServerPool([Server(8), Server(8)])
+        if placed is None:
+            pool.servers[0].available_slots -= 2
+            pool.reindex()
+        else:
+            pool.reserve(pool.servers[0], (placed, job.stages[placed]))
+        keys.add(fingerprint(job, pool, Strategy.DITTO))
+    assert len(keys) == 3
+
+
+def plan_twice(directory, **kwargs):
+    jcts = []
+    for _ in range(2):
+        job = synthetic.tpcds_tree(30, seed=1)
+        pool = ServerPool(synthetic.server_pool(job.nslot, seed=1))
+        cache = PlanCache(4, str(directory), **kwargs)
+        jcts.append(cache.plan(job, pool, Strategy.DITTO))
+        placements = {stage_id: pool.position[id(server)] for stage_id, server in pool.stage_server.items()}
+    return jcts, cache, job, placements
+
+
+def test_disk_tier_replays_the_plan(tmp_path):
+    jcts, cache, job, placements = plan_twice(tmp_path)
+    assert cache.stats()["disk_hits"] == 1
+    assert jcts[0] == jcts[1]
+    fresh = synthetic.tpcds_tree(30, seed=1)
+    pool = ServerPool(synthetic.server_pool(fresh.nslot, seed=1))
+    joint_optimization(fresh, pool, Strategy.DITTO)
+    assert [stage.nslot for stage in job.stages.values()] == [stage.nslot for stage in fresh.stages.values()]
+    assert job.edges == fresh.edges
+    assert placements == {stage_id: pool.position[id(server)] for stage_id, server in pool.stage_server.items()}
+
+
+def test_disk_tier_ignores_bad_files(tmp_path):
+    job = synthetic.chain(3, seed=0)
+    key = fingerprint(job, ServerPool([Server(64)]), Strategy.DITTO)
+    (tmp_path / (key + ".json")).write_text('{"dop": "not a plan"}')
+    (tmp_path / key).write_bytes(b"\x80\x04 an old pickle")
+    cache = PlanCache(4, str(tmp_path))
+    assert cache.get(key) is None
+    cache.plan(job, ServerPool([Server(64)]), Strategy.DITTO)
+    assert PlanCache(4, str(tmp_path)).get(key) is not None
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = PlanCache(1, str(tmp_path), max_disk_entries=8)
+    plan = Plan({0: 1}, [], {0: 0}, 1.0)
+    for k in range(8):
+        cache.put(f"{k:02}", plan)
+        os.utime(tmp_path / f"{k:02}.json", ns=(k * 10**9, k * 10**9))
+    cache.get("00")     # a disk hit makes 00 the most recently used
+    cache.put("08", plan)
+    left = sorted(name[:-5] for name in os.listdir(tmp_path))
+    assert left == ["00", "04", "05", "06", "07", "08"]
+
+
+def test_older_planner_version_misses(tmp_path, monkeypatch):
+    job = synthetic.tpcds_tree(30, seed=1)
+    monkeypatch.setattr(plan_cache, "PLANNER_VERSION", 2)
+    PlanCache(4, str(tmp_path)).plan(job, ServerPool(synthetic.server_pool(job.nslot, seed=1)), Strategy.DITTO)
+    monkeypatch.undo()
+
+    job = synthetic.tpcds_tree(30, seed=1)
+    cache = PlanCache(4, str(tmp_path))
+    cache.plan(job, ServerPool(synthetic.server_pool(job.nslot, seed=1)), Strategy.DITTO)
+    assert cache.stats()["disk_hits"] == 0 and cache.stats()["misses"] == 1
@@ -0,0 +1,68 @@
+import pytest
+from replan import *
+import synthetic
+
+
+def check_plan(job: Job, pool: ServerPool):
+    for server in pool.servers:
+        assert server.available_slots >= 0
+        assert server.total_slots - server.available_slots == sum(stage.nslot for stage in server.placed_stages.values())
+    assert sum(stage.nslot for stage in job.stages.values()) <= job.nslot
+
+
+@pytest.mark.parametrize("make", [synthetic.layered, synthetic.tpcds_tree, synthetic.diamonds])
+def test_replan_after_losing_busiest_server(make):
+    job = make(150, seed=1)
+    pool = ServerPool(synthetic.server_pool(job.nslot, seed=1))
+    weights = dict(job.edges)
+    joint_optimization(job, pool, Strategy.DITTO)
+    busiest = max(range(len(pool.servers)), key=lambda i: len(pool.servers[i].placed_stages))
+    together = [edge for edge, weight in job.edges.items()
+                if weight == 0 and pool.locate(edge[0]) is not None and pool.locate(edge[0]) is pool.locate(edge[1])]
+    result = replan(job, pool, PoolDelta(removed=[busiest], added=[16]), weights)
+    check_plan(job, pool)
+    assert result["jct"] == pytest.approx(estimate_jct(job))
+    # a grouped edge on one server either stays on one server or is ungrouped
+    for edge in together:
+        assert job.edges[edge] == weights[edge] or pool.locate(edge[0]) is pool.locate(edge[1])
+
+
+def test_added_servers_give_slots_back():
+    job = synthetic.tpcds_tree(60, seed=2)
+    pool = ServerPool([Server(n) for n in [64] * 8])
+    weights = dict(job.edges)
+    joint_optimization(job, pool, Strategy.DITTO)
+
+    shrunk = replan(job, pool, PoolDelta(removed=[0, 1, 2], resized={3: 40, 4: 40}), weights)
+    check_plan(job, pool)
+    assert shrunk["shrunk"] > 0 and shrunk["grown"] == 0
+
+    before = {stage_id: (stage.nslot, pool.locate(stage_id)) for stage_id, stage in job.stages.items()}
+    grown = replan(job, pool, PoolDelta(added=[64, 64, 64]), weights)
+    check_plan(job, pool)
+    assert grown["moved"] == 0 and grown["grown"] > 0
+    assert grown["jct"] < shrunk["jct"]
+    # only the grown stages change, each to more slots, and by at most the slots added
+    changed = [stage_id for stage_id, stage in job.stages.items() if (stage.nslot, pool.locate(stage_id)) != before[stage_id]]
+    assert len(changed) == grown["grown"]
+    assert all(job.stages[stage_id].nslot > before[stage_id][0] for stage_id in changed)
+    assert sum(job.stages[stage_id].nslot - before[stage_id][0] for stage_id in changed) <= 3 * 64
+
+
+def test_pool_changes_undo():
+    pool = ServerPool([Server(16), Server(8, 64), Server(32)])
+    pool.undo_log = UndoLog()
+    pool.reserve(pool.servers[0], (0, Stage(1.0, 0.0, 10)))
+    pool.reserve(pool.servers[2], (1, Stage(1.0, 0.0, 20, 30)))
+    servers = list(pool.servers)
+    free = [server.free() for server in servers]
+
+    mark = pool.undo_log.checkpoint()
+    pool.remove_server(servers[0])
+    pool.resize_server(servers[2], 8)
+    pool.add_server(Server(4))
+    pool.undo_log.rollback(mark)
+
+    assert pool.servers == servers
+    assert [server.free() for server in servers] == free
+    assert pool.locate(0) is servers[0] and pool.locate(1) is servers[2]
@@ -0,0 +1,148 @@
+import os
+import random
+import pytest
+from bottom_up_dop import PATH_WALKS, bottom_up_dop, continuous_dop, critical_path_slots, get_layers, merge_rates, round_dop
+from job import Job, NotEnoughSlots, Stage
+from joint_optimization import Strategy, estimate_jct, joint_optimization
+from server import Server
+from workload import load_jobs
+import instrumentation
+import synthetic
+
+DAGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "queries", "dags.json")
+# the server configurations of scripts/test.sh (src/__main__.py)
+CONFIGS = [[16, 29, 25, 13, 31, 47, 33, 24, 4, 26, 16, 1, 33, 20],
+           [12, 11, 15, 13, 18, 17, 19, 14, 24, 16, 16, 11, 13, 10]]
+
+
+def random_case(rng: random.Random, nstage: int):
+    alphas = [rng.choice([0.0, rng.expovariate(0.1)]) for _ in range(nstage)]
+    weights = [rng.random() for _ in range(nstage)]
+    nslot = rng.randint(nstage, 8 * nstage)
+    shares = [nslot * weight / sum(weights) for weight in weights]
+    return alphas, shares, nslot
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_sums_to_nslot(seed):
+    rng = random.Random(seed)
+    alphas, shares, nslot = random_case(rng, rng.randint(1, 40))
+    dop = round_dop(alphas, shares, nslot, [1] * len(alphas))
+    assert sum(dop) == nslot
+    assert min(dop) >= 1
+
+
+@pytest.mark.parametrize("make", [synthetic.chain, synthetic.fan_in, synthetic.layered, synthetic.tpcds_tree])
+def test_bottom_up_dop_uses_every_slot(make):
+    job = make(200, seed=1)
+    for nslot in (200, 201, 333, 1000):
+        job.nslot = nslot
+        bottom_up_dop(job)
+        assert sum(stage.nslot for stage in job.stages.values()) == nslot
+
+
+def test_budget_of_one_slot_per_stage():
+    alphas = [5.0, 1.0, 0.5, 20.0]
+    assert round_dop(alphas, [0.2, 0.3, 0.1, 3.4], 4, [1] * 4) == [1, 1, 1, 1]
+
+
+def test_too_few_slots():
+    with pytest.raises(NotEnoughSlots):
+        round_dop([1.0, 1.0, 1.0], [1.0, 1.0, 0.5], 2, [1] * 3)
+
+
+def test_all_zero_alphas():
+    dop = round_dop([0.0] * 4, [0.5, 2.5, 1.2, 2.8], 7, [1] * 4)
+    assert sum(dop) == 7
+    assert min(dop) >= 1
+
+
+def test_all_zero_alphas_job():
+    job = Job({v: Stage(0.0, 1.0) for v in range(3)}, {(0, 1): 1.0, (1, 2): 1.0}, 3)
+    bottom_up_dop(job)
+    assert [stage.nslot for stage in job.stages.values()] == [1, 1, 1]
+
+
+def test_spare_slots_go_to_largest_gain():
+    # floors are 1, 1, 1: both slots left go to the stage whose alpha / nslot drops the most
+    assert round_dop([1.0, 10.0, 1.0], [1.5, 1.5, 1.5], 5, [1] * 3) == [1, 3, 1]
+
+
+def test_continuous_shares_sum():
+    job = synthetic.tpcds_tree(100, seed=2)
+    job.nslot = 250
+    assert sum(continuous_dop(job).values()) == pytest.approx(250)
+
+
+def test_spare_slots_go_to_critical_path():
+    # 1 -> 2 is critical: the slots go to stage 1 although stage 0 gains more per slot
+    job = Job({0: Stage(10.0, 0.0), 1: Stage(1.0, 100.0), 2: Stage(0.1, 0.0)}, {(0, 2): 0.0, (1, 2): 0.0}, 5)
+    for stage in job.stages.values():
+        stage.nslot = 1
+    critical_path_slots(job, 2)
+    assert [stage.nslot for stage in job.stages.values()] == [1, 3, 1]
+
+
+@pytest.mark.parametrize("make", [synthetic.chain, synthetic.fan_in, synthetic.layered])
+def test_critical_path_walks_are_bounded(make):
+    # finding the critical path again for every slot made the rounding quadratic
+    job = make(20000, seed=1)
+    size = len(job.stages) + len(job.edges)
+    recorder = instrumentation.enable()
+    try:
+        bottom_up_dop(job)
+    finally:
+        instrumentation.disable()
+    assert sum(stage.nslot for stage in job.stages.values()) == job.nslot
+    assert 0 < recorder.counters["dop.walked"] <= max(2 * size, PATH_WALKS + size)
+
+
+def floor_and_distribute(job: Job):
+    # the rounding bottom_up_dop used before round_dop: int() each split, rest to the other side
+    def split(nslot, rate, min_a, min_b):
+        aslot = max(min_a, int(nslot * rate / (rate + 1)))
+        bslot = max(min_b, nslot - aslot)
+        return nslot - bslot, bslot
+
+    layers = get_layers(job)
+    _, rate_children, rate_inner = merge_rates(job, layers)
+    nslot, below = job.nslot, len(job.stages)
+    for depth, layer in enumerate(layers):
+        below -= len(layer)
+        if depth < len(layers) - 1:
+            aslot, nslot = split(nslot, rate_children[depth], len(layer), below)
+        else:
+            aslot = nslot
+        for j in range(len(layer) - 2, -1, -1):
+            aslot, jslot = split(aslot, rate_inner[depth][j], j + 1, 1)
+            job.set_stage_nslot(layer[j + 1], jslot)
+        job.set_stage_nslot(layer[0], aslot)
+
+
+def dop_jct(job: Job, dop) -> float:
+    job = job.copy()
+    dop(job)
+    assert sum(stage.nslot for stage in job.stages.values()) == job.nslot
+    return estimate_jct(job)
+
+
+@pytest.mark.parametrize("make", [synthetic.chain, synthetic.fan_in, synthetic.diamonds, synthetic.layered, synthetic.tpcds_tree])
+@pytest.mark.parametrize("seed", range(4))
+def test_no_worse_than_floor_and_distribute(make, seed):
+    job = make(60, seed=seed)
+    assert dop_jct(job, bottom_up_dop) <= dop_jct(job, floor_and_distribute) + 1e-9
+
+
+def test_queries_no_worse_than_floor_and_distribute():
+    for name, job in load_jobs(DAGS, 120):
+        assert dop_jct(job, bottom_up_dop) <= dop_jct(job, floor_and_distribute) + 1e-9, name
+
+
+@pytest.mark.parametrize("name", ["q1", "q95"])
+@pytest.mark.parametrize("config", CONFIGS)
+def test_ditto_no_worse_than_floor_and_distribute(monkeypatch, name, config):
+    import joint_optimization
+    job = dict(load_jobs(DAGS, 120))[name]
+    jct = joint_optimization.joint_optimization(job.copy(), [Server(n) for n in config], Strategy.DITTO)
+    monkeypatch.setattr(joint_optimization, "bottom_up_dop", floor_and_distribute)
+    assert jct <= joint_optimization.joint_optimization(job.copy(), [Server(n) for n in config], Strategy.DITTO) + 1e-9
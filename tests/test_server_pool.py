@@ -0,0 +1,57 @@
+import random
+import pytest
+from server import Server, ServerPool
+from job import Stage
+
+
+def check_index(pool: ServerPool):
+    assert pool.keys == sorted(pool.buckets.keys())
+    for i, server in enumerate(pool.servers):
+        assert pool.position[id(server)] == i
+        assert pool.buckets[server.available_slots][i] is server
+    assert sum(len(bucket) for bucket in pool.buckets.values()) == len(pool.servers)
+    for stage_id, server in pool.stage_server.items():
+        assert stage_id in server.placed_stages
+    for server in pool.servers:
+        assert server.available_slots >= 0
+        assert server.total_slots - server.available_slots == sum(stage.nslot for stage in server.placed_stages.values())
+    if pool.limited:
+        for key, bucket in pool.buckets.items():
+            memory = max(float("inf") if s.available_memory is None else s.available_memory for s in bucket.values())
+            disk = max(float("inf") if s.available_disk is None else s.available_disk for s in bucket.values())
+            assert pool.cap(key) == (memory, disk)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_best_fit_is_the_tightest_slot_fit(seed):
+    rng = random.Random(seed)
+    pool = ServerPool([Server(rng.randint(4, 32)) for _ in range(rng.randint(1, 12))])
+    placed = []
+    for stage_id in range(200):
+        stage = Stage(1.0, 0.0, rng.randint(1, 12))
+        fits = [server.available_slots for server in pool.servers if server.available_slots >= stage.nslot]
+        found = pool.best_fit(stage.nslot)
+        assert (found is None) == (not fits)
+        if found is not None:
+            assert found.available_slots == min(fits)
+            pool.reserve(found, (stage_id, stage))
+            placed.append(stage_id)
+        if placed and rng.random() < 0.3:
+            pool.release(placed.pop(rng.randrange(len(placed))))
+        check_index(pool)
+
+
+def test_caps_stay_bounded_in_a_busy_bucket():
+    # stages without slots keep every server in one bucket while its memory and disk change
+    rng = random.Random(0)
+    pool = ServerPool([Server(8, rng.uniform(10, 100), rng.uniform(10, 100)) for _ in range(50)])
+    for stage_id in range(2000):
+        server = pool.servers[rng.randrange(50)]
+        if server.placed_stages:
+            pool.release(next(iter(server.placed_stages)))
+        else:
+            pool.reserve(server, (stage_id, Stage(1.0, 0.0, 0, rng.uniform(0, 10), rng.uniform(0, 10))))
+        if stage_id % 100 == 0:
+            check_index(pool)
+    check_index(pool)
+    assert len(pool.caps[8][0]) <= 2 * len(pool.buckets[8]) + 8
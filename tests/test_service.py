@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+from service import PlannerService, open_connection, request
+
+DAGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "queries", "dags.json")
+
+
+def ask(tmp_path, lines, line_limit=1 << 20):
+    '''
+    Start a service on a Unix socket in tmp_path, send lines on one connection and
+    return the answers by id (None for lines without one)
+    '''
+    socket_path = str(tmp_path / "ditto.sock")
+
+    async def run():
+        service = PlannerService(DAGS, 100, [[32, 32, 64]], workers=1, cache_size=0,
+                                 line_limit=line_limit)
+        serving = asyncio.create_task(service.serve(socket_path))
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.01)
+        reader, writer = await open_connection(socket_path)
+        for line in lines:
+            writer.write(line.encode("utf-8") + b"\n")
+        await writer.drain()
+        answers = [json.loads(await reader.readline()) for _ in lines]
+        jobs = await request(reader, writer, {"id": "jobs", "op": "jobs"})
+        writer.close()
+        serving.cancel()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        return answers, jobs
+
+    answers, jobs = asyncio.run(run())
+    return {answer["id"]: answer for answer in answers}, jobs
+
+
+def test_error_replies(tmp_path):
+    answers, jobs = ask(tmp_path, [
+        "not json",
+        json.dumps({"id": 1, "job": "no such job"}),
+        json.dumps({"id": 2, "job": "q1", "strategy": "FASTEST"}),
+        json.dumps({"id": 3, "job": "q1", "servers": 7}),
+        json.dumps({"id": 4, "job": "q1", "strategy": "DITTO", "servers": 0}),
+    ])
+    assert answers[None]["error"].startswith("Bad request")
+    assert "Unknown job" in answers[1]["error"]
+    assert answers[2]["error"].startswith("KeyError")
+    assert answers[3]["error"].startswith("IndexError")
+    assert "error" not in answers[4] and answers[4]["jct"] > 0
+    assert "q1" in jobs["jobs"]
+
+
+def test_non_object_request(tmp_path):
+    answers, _ = ask(tmp_path, ["[1, 2]"])
+    assert "expected a JSON object" in answers[None]["error"]
+
+
+def test_oversized_request(tmp_path):
+    padding = " " * (1 << 18)
+    answers, jobs = ask(tmp_path, [
+        json.dumps({"id": 1, "job": "q1", "pad": padding}),
+        json.dumps({"id": 2, "job": "q1"}),
+    ], line_limit=1024)
+    assert answers[None]["error"].startswith("Bad request")
+    assert 1 not in answers
+    assert "error" not in answers[2] and answers[2]["jct"] > 0
+    assert "q1" in jobs["jobs"]
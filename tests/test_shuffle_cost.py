@@ -0,0 +1,67 @@
+import pytest
+from critical_path import CriticalPath
+from joint_optimization import *
+from shuffle_cost import NicPrice, ShuffleCost
+import synthetic
+
+
+def check_costs(job: Job):
+    model = job.shuffle_cost
+    assert model.costs == {edge: model.edge_cost(edge) for edge in job.edges.keys()}
+
+
+@pytest.mark.parametrize("strategy", [Strategy.DITTO, Strategy.RATIO, Strategy.DITTO_COST])
+def test_repricing_under_rollback(strategy):
+    job = synthetic.tpcds_tree(60, seed=3)
+    pool = ServerPool([Server(n.total_slots, bandwidth=[1.0, 0.5, 2.0][i % 3]) for i, n in enumerate(synthetic.server_pool(job.nslot, seed=3))])
+    job.undo_log = pool.undo_log = UndoLog()
+    ShuffleCost(job, pool, NicPrice())
+    check_costs(job)
+
+    mark = job.undo_log.checkpoint()
+    jct = joint_optimization(job, pool, strategy)
+    check_costs(job)
+    assert get_critical_path(job).distance == CriticalPath(job).distance
+    assert jct == pytest.approx(max(CriticalPath(job).distance.values()))
+    job.undo_log.rollback(mark)
+    check_costs(job)
+    assert not pool.stage_server
+
+
+def test_same_server_is_free():
+    job = synthetic.chain(2, seed=0)
+    pool = ServerPool([Server(64, bandwidth=0.5), Server(64)])
+    model = ShuffleCost(job, pool)
+    job.set_stage_nslot(0, 4)
+    job.set_stage_nslot(1, 4)
+    pool.reserve(pool.servers[0], (0, job.stages[0]))
+    pool.reserve(pool.servers[1], (1, job.stages[1]))
+    assert model.costs[(0, 1)] == pytest.approx(job.edges[(0, 1)] / 0.5)
+    pool.release(1)
+    pool.reserve(pool.servers[0], (1, job.stages[1]))
+    assert model.costs[(0, 1)] == 0
+
+
+def test_grouped_edge_over_two_servers_costs():
+    job = synthetic.chain(3, seed=0)
+    pool = ServerPool([Server(64, bandwidth=0.5), Server(64)])
+    model = ShuffleCost(job, pool)
+    for id in job.stages:
+        job.set_stage_nslot(id, 4)
+    weight = job.edges[(0, 1)]
+    # grouped before placement: planned on one server
+    job.set_edge_weight((0, 1), 0)
+    assert model.costs[(0, 1)] == 0
+    pool.reserve(pool.servers[0], (0, job.stages[0]))
+    assert model.costs[(0, 1)] == 0
+    # place() accepts a group whose stages already sit on two servers
+    pool.reserve(pool.servers[1], (2, job.stages[2]))
+    job.set_edge_weight((1, 2), 0)
+    pool.reserve(pool.servers[1], (1, job.stages[1]))
+    assert place(pool, job, (0, 1))
+    assert model.costs[(0, 1)] == pytest.approx(weight / 0.5)
+    assert model.costs[(1, 2)] == 0
+    check_costs(job)
+    assert get_critical_path(job).distance == CriticalPath(job).distance
+    # and is not grouped again
+    assert greedy_group(job) == []
@@ -0,0 +1,42 @@
+import pytest
+from joint_optimization import *
+from shuffle_cost import ShuffleCost
+from simulator import simulate
+
+
+def fan_out() -> Job:
+    # stage 0 shuffles to 1 and 2 on another server
+    stages = {i: Stage(10.0, 1.0, 2) for i in range(3)}
+    return Job(stages, {(0, 1): 4.0, (0, 2): 4.0}, 6)
+
+
+def test_shuffles_share_a_nic():
+    job = fan_out()
+    placements = {0: 0, 1: 1, 2: 1}
+    result = simulate([(0.0, job, placements)], [8, 8])
+    assert result["jct"][0] == pytest.approx(6.0 + 8.0 + 6.0)
+    assert result["nic_wait"] == pytest.approx(4.0)
+    assert result["slot_wait"] == 0.0
+
+    alone = simulate([(0.0, job, placements)], [8, 8], shared_nics=False)
+    assert alone["jct"][0] == pytest.approx(estimate_jct(job))
+    assert alone["nic_wait"] == 0.0
+
+
+def test_shuffle_cost_prices():
+    job = fan_out()
+    pool = ServerPool([Server(8, bandwidth=0.5), Server(8)])
+    for stage_id, i in ((0, 0), (1, 1), (2, 0)):
+        pool.reserve(pool.servers[i], (stage_id, job.stages[stage_id]))
+    ShuffleCost(job, pool)
+    result = simulate([(0.0, job, {0: 0, 1: 1, 2: 0})], [8, 8])
+    assert result["jct"][0] == pytest.approx(6.0 + 8.0 + 6.0)
+    assert result["nic_wait"] == 0.0
+
+
+def test_slow_jobs_wait_for_slots():
+    first, second = fan_out(), fan_out()
+    placements = {0: 0, 1: 1, 2: 1}
+    # the second job is released when the first one would end without NIC waits
+    result = simulate([(0.0, first, placements), (12.0, second, {0: 1, 1: 0, 2: 0})], [4, 4])
+    assert result["slot_wait"] > 0
@@ -0,0 +1,31 @@
+import pytest
+import synthetic
+
+GENERATORS = [synthetic.chain, synthetic.fan_in, synthetic.diamonds, synthetic.tpcds_tree, synthetic.layered]
+
+
+def snapshot(job):
+    return ([(stage.alpha, stage.beta) for stage in job.stages.values()], list(job.edges.items()), job.nslot)
+
+
+@pytest.mark.parametrize("make", GENERATORS)
+def test_same_seed_same_job(make):
+    assert snapshot(make(120, seed=5)) == snapshot(make(120, seed=5))
+    assert snapshot(make(120, seed=5)) != snapshot(make(120, seed=6))
+
+
+@pytest.mark.parametrize("make", GENERATORS)
+def test_jobs_are_dags_of_the_requested_size(make):
+    job = make(120, seed=2)
+    assert len(job.stages) == 120
+    assert job.nslot == synthetic.SLOTS_PER_STAGE * 120
+    assert all(i in job.stages and j in job.stages and i != j for i, j in job.edges)
+    # stage ids are a topological order
+    assert all(i < j for i, j in job.edges)
+
+
+def test_server_pool_is_seeded():
+    slots = [server.total_slots for server in synthetic.server_pool(1000, seed=3)]
+    assert slots == [server.total_slots for server in synthetic.server_pool(1000, seed=3)]
+    assert sum(slots) >= 1000
+    assert all(8 <= n <= 64 for n in slots)
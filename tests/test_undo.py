@@ -0,0 +1,47 @@
+import pytest
+from joint_optimization import *
+import synthetic
+
+
+def snapshot(job: Job, pool: ServerPool):
+    return (
+        dict(job.edges),
+        {v: stage.nslot for v, stage in job.stages.items()},
+        [(server.total_slots, server.free(), dict(server.placed_stages)) for server in pool.servers],
+        dict(pool.stage_server),
+        {key: dict(bucket) for key, bucket in pool.buckets.items()},
+        list(pool.keys),
+        {key: pool.cap(key) for key in pool.caps},
+    )
+
+
+@pytest.mark.parametrize("strategy", [Strategy.DITTO, Strategy.RATIO, Strategy.AVERAGE, Strategy.DITTO_COST])
+def test_rollback_restores_job_and_pool(strategy):
+    job = synthetic.tpcds_tree(80, seed=1)
+    pool = ServerPool([Server(n, 4096, 1024) for n in (64, 48, 96, 32, 80, 64, 128, 16, 40, 72)])
+    job.undo_log = pool.undo_log = UndoLog()
+    # placements and grouped edges from before, for the rollback to restore
+    for k, server in enumerate(pool.servers[:4]):
+        pool.reserve(server, (1000 + k, Stage(1.0, 0.0, 8, 100, 10)))
+    job.set_edge_weight(next(iter(job.edges)), 0)
+    before = snapshot(job, pool)
+
+    mark = job.undo_log.checkpoint()
+    joint_optimization(job, pool, strategy)
+    pool.remove_server(pool.servers[2])
+    pool.add_server(Server(24))
+    pool.resize_server(pool.servers[0], 8)
+    job.undo_log.rollback(mark)
+    assert snapshot(job, pool) == before
+
+
+def test_commit_keeps_changes():
+    job = synthetic.chain(20, seed=2)
+    pool = ServerPool(synthetic.server_pool(job.nslot, seed=2))
+    job.undo_log = pool.undo_log = UndoLog()
+    mark = job.undo_log.checkpoint()
+    joint_optimization(job, pool, Strategy.DITTO)
+    after = snapshot(job, pool)
+    job.undo_log.commit(mark)
+    assert snapshot(job, pool) == after
+    assert not job.undo_log.records
@@ -0,0 +1,56 @@
+import io
+import json
+import pytest
+import workload
+from workload import iter_job_records
+
+
+def records(n: int):
+    return [{"name": f"q{k}", "stages": [{"name": "s", "alpha": k + 0.5, "beta": 1.0, "children": []}] * (k % 3 + 1)}
+            for k in range(n)]
+
+
+def test_json_array():
+    expected = records(5)
+    assert list(iter_job_records(io.StringIO(json.dumps(expected, indent=2)))) == expected
+    assert list(iter_job_records(io.StringIO(" [ ] "))) == []
+
+
+def test_ndjson():
+    expected = records(5)
+    text = "\n".join(json.dumps(record) for record in expected) + "\n\n"
+    assert list(iter_job_records(io.StringIO(text))) == expected
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 64])
+def test_records_split_across_reads(monkeypatch, read_size):
+    monkeypatch.setattr(workload, "READ_SIZE", read_size)
+    expected = records(8)
+    assert list(iter_job_records(io.StringIO(json.dumps(expected)))) == expected
+    text = "\n".join(json.dumps(record) for record in expected)
+    assert list(iter_job_records(io.StringIO(text))) == expected
+
+
+@pytest.mark.parametrize("text", ['[,{"name": "q"}]', '[{"name": "q"},,{"name": "r"}]', '[{"name": "q"},]',
+                                  '[{"name": "q"} {"name": "r"}]', '[{"name": "q"}', '{"name": "q"} ,{"name": "r"}'])
+def test_malformed_separators(text):
+    with pytest.raises(Exception):
+        list(iter_job_records(io.StringIO(text)))
+
+
+def test_malformed_record_fails_without_reading_on(monkeypatch):
+    monkeypatch.setattr(workload, "READ_SIZE", 256)
+    good = json.dumps(records(1)[0])
+    f = io.StringIO("[" + good + ', {"name": "q", "stages": [}' + " " * 200 + ("," + good) * 10000 + "]")
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_job_records(f))
+    assert f.tell() < 4096
+
+
+def test_record_size_is_bounded(monkeypatch):
+    monkeypatch.setattr(workload, "READ_SIZE", 256)
+    monkeypatch.setattr(workload, "MAX_RECORD_SIZE", 1000)
+    f = io.StringIO('[{"name": "' + "q" * 100000 + '"}]')
+    with pytest.raises(Exception, match="longer than"):
+        list(iter_job_records(f))
+    assert f.tell() < 10000